@@ -1796,13 +1796,20 @@ export async function ensureObservabilityObjects(
         LATENCY_MS       NUMBER,
         REQUEST_BYTES    NUMBER,
         RESPONSE_BYTES   NUMBER,
-        CALLER           VARCHAR
+        CALLER           VARCHAR,
+        EVENT_COUNT      NUMBER,
+        LATENCY_MAX_MS   NUMBER,
+        LATENCY_HIST     VARIANT
       )
       CLUSTER BY (DATE_TRUNC('hour', REQUEST_TS))
       DATA_RETENTION_TIME_IN_DAYS = 1
       COMMENT = ${TRACK_OBS}`,
       db: 'OPENROUTESERVICE_APP', schema: 'OBSERVABILITY',
     },
+    ...['EVENT_COUNT NUMBER', 'LATENCY_MAX_MS NUMBER', 'LATENCY_HIST VARIANT'].map((col) => ({
+      sql: `ALTER TABLE OPENROUTESERVICE_APP.OBSERVABILITY.ORS_REQUEST_LOG ADD COLUMN IF NOT EXISTS ${col}`,
+      db: 'OPENROUTESERVICE_APP', schema: 'OBSERVABILITY',
+    })),
     {
       sql: `CREATE OR REPLACE VIEW OPENROUTESERVICE_APP.OBSERVABILITY.V_ORS_METRICS_SUMMARY
         COMMENT = ${TRACK_OBS}
@@ -1818,6 +1825,10 @@ export async function ensureObservabilityObjects(
             LATENCY_MS,
             REQUEST_BYTES,
             RESPONSE_BYTES,
+            COALESCE(EVENT_COUNT, 1)                     AS N,
+            COALESCE(LATENCY_MAX_MS, LATENCY_MS)         AS MAX_LATENCY_MS,
+            COALESCE(LATENCY_HIST, IFF(LATENCY_MS IS NULL, NULL,
+                     OBJECT_CONSTRUCT(TO_VARCHAR(LATENCY_MS), 1))) AS HIST,
             IFF(STATUS_CODE >= 400 OR ERROR_CODE IS NOT NULL, 1, 0) AS IS_ERROR
           FROM OPENROUTESERVICE_APP.OBSERVABILITY.ORS_REQUEST_LOG
         ),
@@ -1825,23 +1836,56 @@ export async function ensureObservabilityObjects(
           SELECT '1h'  AS WINDOW_NAME, e.* FROM events e WHERE e.REQUEST_TS >= DATEADD(hour, -1, SYSDATE())
           UNION ALL
           SELECT '24h' AS WINDOW_NAME, e.* FROM events e WHERE e.REQUEST_TS >= DATEADD(hour, -24, SYSDATE())
+        ),
+        buckets AS (
+          SELECT w.WINDOW_NAME, w.ENDPOINT, b.KEY::NUMBER AS BUCKET_MS, SUM(b.VALUE::NUMBER) AS N
+          FROM windowed w, LATERAL FLATTEN(INPUT => w.HIST) b
+          GROUP BY w.WINDOW_NAME, w.ENDPOINT, b.KEY::NUMBER
+        ),
+        percentiles AS (
+          SELECT
+            WINDOW_NAME,
+            ENDPOINT,
+            MIN(IFF(CUM_FRAC >= 0.5, BUCKET_MS, NULL))   AS P50_MS,
+            MIN(IFF(CUM_FRAC >= 0.95, BUCKET_MS, NULL))  AS P95_MS
+          FROM (
+            SELECT WINDOW_NAME, ENDPOINT, BUCKET_MS,
+                   SUM(N) OVER (PARTITION BY WINDOW_NAME, ENDPOINT ORDER BY BUCKET_MS)
+                     / SUM(N) OVER (PARTITION BY WINDOW_NAME, ENDPOINT) AS CUM_FRAC
+            FROM buckets
+          )
+          GROUP BY WINDOW_NAME, ENDPOINT
+        ),
+        totals AS (
+          SELECT
+            WINDOW_NAME,
+            ENDPOINT,
+            SUM(N)                                       AS REQ_COUNT,
+            SUM(IS_ERROR * N)                            AS ERROR_COUNT,
+            MAX(MAX_LATENCY_MS)                          AS MAX_MS,
+            SUM(LATENCY_MS * N) / NULLIF(SUM(IFF(LATENCY_MS IS NULL, 0, N)), 0) AS AVG_MS,
+            ROUND(SUM(REQUEST_BYTES * N) / NULLIF(SUM(IFF(REQUEST_BYTES IS NULL, 0, N)), 0), 0) AS AVG_REQ_BYTES,
+            ROUND(SUM(RESPONSE_BYTES * N) / NULLIF(SUM(IFF(RESPONSE_BYTES IS NULL, 0, N)), 0), 0) AS AVG_RESP_BYTES,
+            MAX(REQUEST_TS)                              AS LAST_EVENT_TS
+          FROM windowed
+          GROUP BY WINDOW_NAME, ENDPOINT
         )
         SELECT
-          WINDOW_NAME,
-          ENDPOINT,
-          COUNT(*)                                     AS REQ_COUNT,
-          SUM(IS_ERROR)                                AS ERROR_COUNT,
-          ROUND(100.0 * SUM(IS_ERROR) / NULLIF(COUNT(*), 0), 2) AS ERROR_RATE_PCT,
-          APPROX_PERCENTILE(LATENCY_MS, 0.5)           AS P50_MS,
-          APPROX_PERCENTILE(LATENCY_MS, 0.95)          AS P95_MS,
-          MAX(LATENCY_MS)                              AS MAX_MS,
-          AVG(LATENCY_MS)                              AS AVG_MS,
-          ROUND(AVG(REQUEST_BYTES), 0)                 AS AVG_REQ_BYTES,
-          ROUND(AVG(RESPONSE_BYTES), 0)                AS AVG_RESP_BYTES,
-          MAX(REQUEST_TS)                              AS LAST_EVENT_TS
-        FROM windowed
-        GROUP BY WINDOW_NAME, ENDPOINT
-        ORDER BY WINDOW_NAME, ENDPOINT`,
+          t.WINDOW_NAME,
+          t.ENDPOINT,
+          t.REQ_COUNT,
+          t.ERROR_COUNT,
+          ROUND(100.0 * t.ERROR_COUNT / NULLIF(t.REQ_COUNT, 0), 2) AS ERROR_RATE_PCT,
+          p.P50_MS,
+          p.P95_MS,
+          t.MAX_MS,
+          t.AVG_MS,
+          t.AVG_REQ_BYTES,
+          t.AVG_RESP_BYTES,
+          t.LAST_EVENT_TS
+        FROM totals t
+        LEFT JOIN percentiles p ON p.WINDOW_NAME = t.WINDOW_NAME AND p.ENDPOINT = t.ENDPOINT
+        ORDER BY t.WINDOW_NAME, t.ENDPOINT`,
       db: 'OPENROUTESERVICE_APP', schema: 'OBSERVABILITY',
     },
   ];
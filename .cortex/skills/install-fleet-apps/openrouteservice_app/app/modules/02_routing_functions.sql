@@ -140,6 +140,48 @@
       MAX_BATCH_ROWS = 1
       AS '/ors_status';
 
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE._ORS_WAIT_READY_RAW(region VARCHAR, timeout_s INTEGER)
+      RETURNS VARIANT
+      SERVICE=OPENROUTESERVICE_APP.CORE.routing_gateway_service
+      ENDPOINT='gateway'
+      MAX_BATCH_ROWS = 1
+      AS '/ors_wait_ready';
+
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE._BULK_JOB_SUBMIT_RAW(kind VARCHAR, spec VARIANT, region VARCHAR)
+      RETURNS VARIANT
+      SERVICE=OPENROUTESERVICE_APP.CORE.routing_gateway_service
+      ENDPOINT='gateway'
+      MAX_BATCH_ROWS = 1
+      AS '/bulk_jobs_submit';
+
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE._BULK_JOB_STATUS_RAW(job_id VARCHAR)
+      RETURNS VARIANT
+      SERVICE=OPENROUTESERVICE_APP.CORE.routing_gateway_service
+      ENDPOINT='gateway'
+      MAX_BATCH_ROWS = 10
+      AS '/bulk_jobs_status';
+
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE._BULK_JOB_FETCH_RAW(job_id VARCHAR, page INTEGER)
+      RETURNS VARIANT
+      SERVICE=OPENROUTESERVICE_APP.CORE.routing_gateway_service
+      ENDPOINT='gateway'
+      MAX_BATCH_ROWS = 1
+      AS '/bulk_jobs_fetch';
+
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE._BULK_JOB_CANCEL_RAW(job_id VARCHAR)
+      RETURNS VARIANT
+      SERVICE=OPENROUTESERVICE_APP.CORE.routing_gateway_service
+      ENDPOINT='gateway'
+      MAX_BATCH_ROWS = 1
+      AS '/bulk_jobs_cancel';
+
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE._BULK_JOB_RESUME_RAW(job_id VARCHAR)
+      RETURNS VARIANT
+      SERVICE=OPENROUTESERVICE_APP.CORE.routing_gateway_service
+      ENDPOINT='gateway'
+      MAX_BATCH_ROWS = 1
+      AS '/bulk_jobs_resume';
+
    CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE._MATRIX_TABULAR_RAW(method VARCHAR, origin ARRAY, destinations ARRAY, region VARCHAR)
       RETURNS VARIANT
       SERVICE=OPENROUTESERVICE_APP.CORE.routing_gateway_service
@@ -154,6 +196,20 @@
       MAX_BATCH_ROWS = 100
       AS '/matrix';
 
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE._MATRIX_TABULAR_BINARY_RAW(method VARCHAR, origin ARRAY, destinations ARRAY, region VARCHAR)
+      RETURNS VARIANT
+      SERVICE=OPENROUTESERVICE_APP.CORE.routing_gateway_service
+      ENDPOINT='gateway'
+      MAX_BATCH_ROWS = 1000
+      AS '/matrix_tabular/binary';
+
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE._MATRIX_BINARY_RAW(method VARCHAR, options VARIANT, region VARCHAR)
+      RETURNS VARIANT
+      SERVICE=OPENROUTESERVICE_APP.CORE.routing_gateway_service
+      ENDPOINT='gateway'
+      MAX_BATCH_ROWS = 100
+      AS '/matrix/binary';
+
    -- NOTE: Service functions (SERVICE=...) do not support ALTER FUNCTION SET COMMENT.
    -- They are tracked via the parent procedure's COMMENT and the session query_tag.
 
@@ -291,6 +347,19 @@
          FROM (SELECT OPENROUTESERVICE_APP.CORE._OPTIMIZATION_RAW(challenge, region) AS resp),
             LATERAL FLATTEN(input => resp:routes) f';
 
+   -- OPTIMIZATION_POLYLINE (challenge variant) - returns the VARIANT response with
+   -- each route's geometry left as the encoded polyline (options.polyline=true),
+   -- for callers that decode it themselves; no GEOGRAPHY is built.
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE.OPTIMIZATION_POLYLINE(challenge VARIANT, region VARCHAR DEFAULT NULL)
+      RETURNS VARIANT
+      LANGUAGE SQL
+      COMMENT = '{"origin":"sf_sit-is-fleet","name":"install-fleet-apps","version":"2.0","attributes":{"component":"routing"}}'
+      AS
+      'SELECT OPENROUTESERVICE_APP.CORE._OPTIMIZATION_RAW(
+            OBJECT_INSERT(challenge, ''options'',
+                OBJECT_INSERT(COALESCE(challenge:options, OBJECT_CONSTRUCT()), ''polyline'', TRUE, TRUE), TRUE),
+            region)';
+
    -- MATRIX (locations array) - returns VARIANT (no geography to parse)
    CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE.MATRIX(method VARCHAR, locations ARRAY, region VARCHAR DEFAULT NULL)
       RETURNS VARIANT
@@ -315,6 +384,24 @@
       AS
       'SELECT OPENROUTESERVICE_APP.CORE._MATRIX_TABULAR_RAW(method, origin, destinations, region)';
 
+   -- MATRIX_BINARY / MATRIX_TABULAR_BINARY - same answer as MATRIX(options) /
+   -- MATRIX_TABULAR, but durations and distances are base64 little-endian
+   -- uint32 (whole seconds / meters, 4294967295 = unroutable) with a `shape`,
+   -- for bulk consumers that decode into arrays instead of walking the VARIANT.
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE.MATRIX_BINARY(method VARCHAR, options VARIANT, region VARCHAR DEFAULT NULL)
+      RETURNS VARIANT
+      LANGUAGE SQL
+      COMMENT = '{"origin":"sf_sit-is-fleet","name":"install-fleet-apps","version":"2.0","attributes":{"component":"routing"}}'
+      AS
+      'SELECT OPENROUTESERVICE_APP.CORE._MATRIX_BINARY_RAW(method, options, region)';
+
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE.MATRIX_TABULAR_BINARY(method VARCHAR, origin ARRAY, destinations ARRAY, region VARCHAR DEFAULT NULL)
+      RETURNS VARIANT
+      LANGUAGE SQL
+      COMMENT = '{"origin":"sf_sit-is-fleet","name":"install-fleet-apps","version":"2.0","attributes":{"component":"routing"}}'
+      AS
+      'SELECT OPENROUTESERVICE_APP.CORE._MATRIX_TABULAR_BINARY_RAW(method, origin, destinations, region)';
+
    -- MATRIX_TABULAR_W (region-first arg order wrapper for BUILD_TRAVEL_TIME_RANGE_REGION non-default path) - returns VARIANT
    CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE.MATRIX_TABULAR_W(region VARCHAR, method VARCHAR, origin ARRAY, destinations ARRAY)
       RETURNS VARIANT
@@ -331,6 +418,59 @@
       AS
       'SELECT OPENROUTESERVICE_APP.CORE._ORS_STATUS_RAW(region)';
 
+   -- ORS_WAIT_READY - ORS_STATUS that blocks in the gateway until service_ready
+   -- or timeout_s (capped by ORS_STATUS_WAIT_MAX_S); adds waited_s and, when
+   -- still not ready, wait_timed_out. One held call replaces a poll loop.
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE.ORS_WAIT_READY(region VARCHAR DEFAULT NULL, timeout_s INTEGER DEFAULT 120)
+      RETURNS VARIANT
+      LANGUAGE SQL
+      COMMENT = '{"origin":"sf_sit-is-fleet","name":"install-fleet-apps","version":"2.0","attributes":{"component":"routing"}}'
+      AS
+      'SELECT OPENROUTESERVICE_APP.CORE._ORS_WAIT_READY_RAW(region, timeout_s)';
+
+   -- BULK_JOB_SUBMIT / STATUS / FETCH / CANCEL / RESUME - background sweeps
+   -- that do not fit one call (thousands of isochrones, region-wide matrices).
+   -- SUBMIT returns job_id and the page count; poll STATUS until status = 'done'
+   -- (pages can be fetched as they finish); FETCH(job_id, page) returns one
+   -- page of [index, result] items and next_page; RESUME restarts a failed or
+   -- cancelled job at its first unfinished page. kind = 'isochrones'
+   -- (spec {profile, locations, range, range_type?, smoothing?}) or 'matrix'
+   -- (spec {profile, locations, sources?, destinations?}).
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE.BULK_JOB_SUBMIT(kind VARCHAR, spec VARIANT, region VARCHAR DEFAULT NULL)
+      RETURNS VARIANT
+      LANGUAGE SQL
+      COMMENT = '{"origin":"sf_sit-is-fleet","name":"install-fleet-apps","version":"2.0","attributes":{"component":"routing"}}'
+      AS
+      'SELECT OPENROUTESERVICE_APP.CORE._BULK_JOB_SUBMIT_RAW(kind, spec, region)';
+
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE.BULK_JOB_STATUS(job_id VARCHAR)
+      RETURNS VARIANT
+      LANGUAGE SQL
+      COMMENT = '{"origin":"sf_sit-is-fleet","name":"install-fleet-apps","version":"2.0","attributes":{"component":"routing"}}'
+      AS
+      'SELECT OPENROUTESERVICE_APP.CORE._BULK_JOB_STATUS_RAW(job_id)';
+
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE.BULK_JOB_FETCH(job_id VARCHAR, page INTEGER DEFAULT 0)
+      RETURNS VARIANT
+      LANGUAGE SQL
+      COMMENT = '{"origin":"sf_sit-is-fleet","name":"install-fleet-apps","version":"2.0","attributes":{"component":"routing"}}'
+      AS
+      'SELECT OPENROUTESERVICE_APP.CORE._BULK_JOB_FETCH_RAW(job_id, page)';
+
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE.BULK_JOB_CANCEL(job_id VARCHAR)
+      RETURNS VARIANT
+      LANGUAGE SQL
+      COMMENT = '{"origin":"sf_sit-is-fleet","name":"install-fleet-apps","version":"2.0","attributes":{"component":"routing"}}'
+      AS
+      'SELECT OPENROUTESERVICE_APP.CORE._BULK_JOB_CANCEL_RAW(job_id)';
+
+   CREATE OR REPLACE FUNCTION OPENROUTESERVICE_APP.CORE.BULK_JOB_RESUME(job_id VARCHAR)
+      RETURNS VARIANT
+      LANGUAGE SQL
+      COMMENT = '{"origin":"sf_sit-is-fleet","name":"install-fleet-apps","version":"2.0","attributes":{"component":"routing"}}'
+      AS
+      'SELECT OPENROUTESERVICE_APP.CORE._BULK_JOB_RESUME_RAW(job_id)';
+
    -- ===== UTILITY FUNCTIONS (unchanged) =====
    CREATE TABLE IF NOT EXISTS OPENROUTESERVICE_APP.CORE.MAP_CONFIG (
       city_name VARCHAR,
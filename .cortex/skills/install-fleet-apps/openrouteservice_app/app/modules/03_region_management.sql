@@ -1938,10 +1938,12 @@ BEGIN
 
     -- Wait (bounded) until the engine is ready so callers that only fire-and-
     -- forget a RESUME (APPLY_ORS_LIMITS) can still hand off to this proc safely.
+    -- ORS_WAIT_READY holds each call in the gateway for up to 60s, so this
+    -- loop normally makes one or two calls instead of polling every 10s.
     WHILE (NOT :ready AND :waited < 300) DO
         BEGIN
-            rs := (EXECUTE IMMEDIATE 'SELECT COALESCE(TRY_PARSE_JSON(OPENROUTESERVICE_APP.CORE.ORS_STATUS('''
-                || :region_lit || ''')::VARCHAR):service_ready::BOOLEAN, FALSE) AS R');
+            rs := (EXECUTE IMMEDIATE 'SELECT COALESCE(TRY_PARSE_JSON(OPENROUTESERVICE_APP.CORE.ORS_WAIT_READY('''
+                || :region_lit || ''', 60)::VARCHAR):service_ready::BOOLEAN, FALSE) AS R');
             LET cr CURSOR FOR rs;
             FOR r IN cr DO ready := COALESCE(r.R, FALSE); END FOR;
         EXCEPTION WHEN OTHER THEN ready := FALSE;
@@ -2637,8 +2639,8 @@ BEGIN
     LET dn_started TIMESTAMP := SYSDATE();
     WHILE (NOT :downsize_ready AND TIMESTAMPDIFF(SECOND, :dn_started, SYSDATE()) < 120) DO
         BEGIN
-            rs := (EXECUTE IMMEDIATE 'SELECT COALESCE(TRY_PARSE_JSON(OPENROUTESERVICE_APP.CORE.ORS_STATUS('''
-                || :P_REGION || ''')::VARCHAR):service_ready::BOOLEAN, FALSE) AS R');
+            rs := (EXECUTE IMMEDIATE 'SELECT COALESCE(TRY_PARSE_JSON(OPENROUTESERVICE_APP.CORE.ORS_WAIT_READY('''
+                || :P_REGION || ''', 60)::VARCHAR):service_ready::BOOLEAN, FALSE) AS R');
             LET cdr CURSOR FOR rs;
             FOR r IN cdr DO downsize_ready := COALESCE(r.R, FALSE); END FOR;
         EXCEPTION WHEN OTHER THEN downsize_ready := FALSE;
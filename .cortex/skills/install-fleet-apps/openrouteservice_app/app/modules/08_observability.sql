@@ -13,12 +13,18 @@
 --   * Ingest procedure: INGEST_ORS_METRICS(window_minutes)
 --   * Scheduled task: ORS_METRICS_INGEST_TASK (every 5 minutes, USER_TASK)
 --
--- The Python gateway writes a structured `[ORS_METRIC] {json}` line to stdout
--- for every routing call (see services/gateway/routing_service.py). The
--- ingest procedure reads SYSTEM$GET_SERVICE_LOGS, parses those lines, and
--- batch-inserts new events into ORS_REQUEST_LOG. The procedure is idempotent
--- across runs because each event carries a millisecond-precision REQUEST_TS
--- plus REQUEST_ID and we dedupe on the pair via NOT EXISTS.
+-- The Python gateway writes structured `[ORS_METRIC] {json}` lines to stdout
+-- (see services/gateway/routing_service.py). Routing calls are aggregated in
+-- the gateway and flushed every METRIC_FLUSH_INTERVAL_S as one line per
+-- (endpoint, profile, region, host, status, error, caller): latency / byte
+-- fields are per-call means, `count` is the number of calls and `hist` is
+-- an HDR-style latency histogram ({bucket_ms: count}). The ingest procedure
+-- reads SYSTEM$GET_SERVICE_LOGS, parses those lines, and batch-inserts new
+-- events into ORS_REQUEST_LOG (EVENT_COUNT / LATENCY_MAX_MS / LATENCY_HIST;
+-- NULL on per-call rows from older gateways, which count as one call). The
+-- procedure is idempotent across runs because each event carries a
+-- millisecond-precision REQUEST_TS plus REQUEST_ID and we dedupe on the pair
+-- via NOT EXISTS.
 
 ALTER SESSION SET query_tag = '{"origin":"sf_sit-is-fleet","name":"oss-observability","version":{"major":1,"minor":0},"attributes":{"is_quickstart":1,"source":"sql"}}';
 
@@ -39,16 +45,26 @@ CREATE TABLE IF NOT EXISTS OPENROUTESERVICE_APP.OBSERVABILITY.ORS_REQUEST_LOG (
     LATENCY_MS       NUMBER,
     REQUEST_BYTES    NUMBER,
     RESPONSE_BYTES   NUMBER,
-    CALLER           VARCHAR              -- 'tabular' | 'post' | 'matrix_chunked' | etc.
+    CALLER           VARCHAR,             -- 'tabular' | 'post' | 'matrix_chunked' | etc.
+    EVENT_COUNT      NUMBER,              -- calls aggregated into this row (NULL = 1)
+    LATENCY_MAX_MS   NUMBER,
+    LATENCY_HIST     VARIANT              -- {bucket_ms: count}, bucket = highest latency in it
 )
 CLUSTER BY (DATE_TRUNC('hour', REQUEST_TS))
 DATA_RETENTION_TIME_IN_DAYS = 1
 COMMENT = '{"origin":"sf_sit-is-fleet","name":"oss-observability","version":{"major":1,"minor":0},"attributes":{"is_quickstart":1,"source":"sql"}}';
 
+-- Tables created before the gateway aggregated its metrics.
+ALTER TABLE OPENROUTESERVICE_APP.OBSERVABILITY.ORS_REQUEST_LOG ADD COLUMN IF NOT EXISTS EVENT_COUNT NUMBER;
+ALTER TABLE OPENROUTESERVICE_APP.OBSERVABILITY.ORS_REQUEST_LOG ADD COLUMN IF NOT EXISTS LATENCY_MAX_MS NUMBER;
+ALTER TABLE OPENROUTESERVICE_APP.OBSERVABILITY.ORS_REQUEST_LOG ADD COLUMN IF NOT EXISTS LATENCY_HIST VARIANT;
+
 -- Aggregation view used by /api/observability/ors-metrics. Returns one row
 -- per (window, endpoint) with p50 / p95 / error-rate. Windows are emitted
 -- as a UNION so the same view answers both "last hour" and "last 24h" with
--- a single query from the control-app.
+-- a single query from the control-app. Rows are weighted by EVENT_COUNT and
+-- percentiles come from the merged LATENCY_HIST buckets (a per-call row is a
+-- one-sample histogram), so aggregated and per-call rows mix correctly.
 CREATE OR REPLACE VIEW OPENROUTESERVICE_APP.OBSERVABILITY.V_ORS_METRICS_SUMMARY
 COMMENT = '{"origin":"sf_sit-is-fleet","name":"oss-observability","version":{"major":1,"minor":0},"attributes":{"is_quickstart":1,"source":"sql"}}'
 AS
@@ -63,6 +79,10 @@ WITH events AS (
         LATENCY_MS,
         REQUEST_BYTES,
         RESPONSE_BYTES,
+        COALESCE(EVENT_COUNT, 1)                     AS N,
+        COALESCE(LATENCY_MAX_MS, LATENCY_MS)         AS MAX_LATENCY_MS,
+        COALESCE(LATENCY_HIST, IFF(LATENCY_MS IS NULL, NULL,
+                 OBJECT_CONSTRUCT(TO_VARCHAR(LATENCY_MS), 1))) AS HIST,
         IFF(STATUS_CODE >= 400 OR ERROR_CODE IS NOT NULL, 1, 0) AS IS_ERROR
     FROM OPENROUTESERVICE_APP.OBSERVABILITY.ORS_REQUEST_LOG
 ),
@@ -70,23 +90,56 @@ windowed AS (
     SELECT '1h'  AS WINDOW_NAME, e.* FROM events e WHERE e.REQUEST_TS >= DATEADD(hour, -1, SYSDATE())
     UNION ALL
     SELECT '24h' AS WINDOW_NAME, e.* FROM events e WHERE e.REQUEST_TS >= DATEADD(hour, -24, SYSDATE())
+),
+buckets AS (
+    SELECT w.WINDOW_NAME, w.ENDPOINT, b.KEY::NUMBER AS BUCKET_MS, SUM(b.VALUE::NUMBER) AS N
+    FROM windowed w, LATERAL FLATTEN(INPUT => w.HIST) b
+    GROUP BY w.WINDOW_NAME, w.ENDPOINT, b.KEY::NUMBER
+),
+percentiles AS (
+    SELECT
+        WINDOW_NAME,
+        ENDPOINT,
+        MIN(IFF(CUM_FRAC >= 0.5, BUCKET_MS, NULL))   AS P50_MS,
+        MIN(IFF(CUM_FRAC >= 0.95, BUCKET_MS, NULL))  AS P95_MS
+    FROM (
+        SELECT WINDOW_NAME, ENDPOINT, BUCKET_MS,
+               SUM(N) OVER (PARTITION BY WINDOW_NAME, ENDPOINT ORDER BY BUCKET_MS)
+                 / SUM(N) OVER (PARTITION BY WINDOW_NAME, ENDPOINT) AS CUM_FRAC
+        FROM buckets
+    )
+    GROUP BY WINDOW_NAME, ENDPOINT
+),
+totals AS (
+    SELECT
+        WINDOW_NAME,
+        ENDPOINT,
+        SUM(N)                                       AS REQ_COUNT,
+        SUM(IS_ERROR * N)                            AS ERROR_COUNT,
+        MAX(MAX_LATENCY_MS)                          AS MAX_MS,
+        SUM(LATENCY_MS * N) / NULLIF(SUM(IFF(LATENCY_MS IS NULL, 0, N)), 0) AS AVG_MS,
+        ROUND(SUM(REQUEST_BYTES * N) / NULLIF(SUM(IFF(REQUEST_BYTES IS NULL, 0, N)), 0), 0) AS AVG_REQ_BYTES,
+        ROUND(SUM(RESPONSE_BYTES * N) / NULLIF(SUM(IFF(RESPONSE_BYTES IS NULL, 0, N)), 0), 0) AS AVG_RESP_BYTES,
+        MAX(REQUEST_TS)                              AS LAST_EVENT_TS
+    FROM windowed
+    GROUP BY WINDOW_NAME, ENDPOINT
 )
 SELECT
-    WINDOW_NAME,
-    ENDPOINT,
-    COUNT(*)                                     AS REQ_COUNT,
-    SUM(IS_ERROR)                                AS ERROR_COUNT,
-    ROUND(100.0 * SUM(IS_ERROR) / NULLIF(COUNT(*), 0), 2) AS ERROR_RATE_PCT,
-    APPROX_PERCENTILE(LATENCY_MS, 0.5)           AS P50_MS,
-    APPROX_PERCENTILE(LATENCY_MS, 0.95)          AS P95_MS,
-    MAX(LATENCY_MS)                              AS MAX_MS,
-    AVG(LATENCY_MS)                              AS AVG_MS,
-    ROUND(AVG(REQUEST_BYTES), 0)                 AS AVG_REQ_BYTES,
-    ROUND(AVG(RESPONSE_BYTES), 0)                AS AVG_RESP_BYTES,
-    MAX(REQUEST_TS)                              AS LAST_EVENT_TS
-FROM windowed
-GROUP BY WINDOW_NAME, ENDPOINT
-ORDER BY WINDOW_NAME, ENDPOINT;
+    t.WINDOW_NAME,
+    t.ENDPOINT,
+    t.REQ_COUNT,
+    t.ERROR_COUNT,
+    ROUND(100.0 * t.ERROR_COUNT / NULLIF(t.REQ_COUNT, 0), 2) AS ERROR_RATE_PCT,
+    p.P50_MS,
+    p.P95_MS,
+    t.MAX_MS,
+    t.AVG_MS,
+    t.AVG_REQ_BYTES,
+    t.AVG_RESP_BYTES,
+    t.LAST_EVENT_TS
+FROM totals t
+LEFT JOIN percentiles p ON p.WINDOW_NAME = t.WINDOW_NAME AND p.ENDPOINT = t.ENDPOINT
+ORDER BY t.WINDOW_NAME, t.ENDPOINT;
 
 
 -- ---------------------------------------------------------------------------
@@ -167,7 +220,10 @@ BEGIN
         TRY_TO_NUMBER(J:"latency_ms"::STRING)                               AS LATENCY_MS,
         TRY_TO_NUMBER(J:"req_bytes"::STRING)                                AS REQUEST_BYTES,
         TRY_TO_NUMBER(J:"resp_bytes"::STRING)                               AS RESPONSE_BYTES,
-        J:"caller"::STRING                                                  AS CALLER
+        J:"caller"::STRING                                                  AS CALLER,
+        TRY_TO_NUMBER(J:"count"::STRING)                                    AS EVENT_COUNT,
+        TRY_TO_NUMBER(J:"latency_max_ms"::STRING)                           AS LATENCY_MAX_MS,
+        IFF(IS_OBJECT(J:"hist"), J:"hist", NULL)                            AS LATENCY_HIST
     FROM parsed
     WHERE J IS NOT NULL
       AND J:"endpoint" IS NOT NULL
@@ -177,11 +233,13 @@ BEGIN
 
     INSERT INTO OPENROUTESERVICE_APP.OBSERVABILITY.ORS_REQUEST_LOG (
         REQUEST_TS, REQUEST_ID, ENDPOINT, PROFILE, REGION, ORS_HOST,
-        STATUS_CODE, ERROR_CODE, LATENCY_MS, REQUEST_BYTES, RESPONSE_BYTES, CALLER
+        STATUS_CODE, ERROR_CODE, LATENCY_MS, REQUEST_BYTES, RESPONSE_BYTES, CALLER,
+        EVENT_COUNT, LATENCY_MAX_MS, LATENCY_HIST
     )
     SELECT
         c.REQUEST_TS, c.REQUEST_ID, c.ENDPOINT, c.PROFILE, c.REGION, c.ORS_HOST,
-        c.STATUS_CODE, c.ERROR_CODE, c.LATENCY_MS, c.REQUEST_BYTES, c.RESPONSE_BYTES, c.CALLER
+        c.STATUS_CODE, c.ERROR_CODE, c.LATENCY_MS, c.REQUEST_BYTES, c.RESPONSE_BYTES, c.CALLER,
+        c.EVENT_COUNT, c.LATENCY_MAX_MS, c.LATENCY_HIST
     FROM _ORS_METRIC_CANDIDATES c
     WHERE c.REQUEST_ID IS NOT NULL
       AND NOT EXISTS (
@@ -1,17 +1,35 @@
 from flask import Flask
 from flask import request
 from flask import make_response
-from polyline import decode
+from polyline import decode, encode
+import numpy as np
 import requests
 import logging
+import atexit
+import base64
 import json
+import math
 import os
+import shutil
 import sys
 import time
 import uuid
 import random
+import functools
+import contextvars
+import hashlib
+import hmac
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+try:
+    import orjson
+except ImportError:  # optional; the stdlib codec below is the fallback
+    orjson = None
 
 SERVICE_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
 SERVICE_PORT = os.getenv('SERVER_PORT', 8080)
@@ -19,6 +37,20 @@ VROOM_PORT = os.getenv('VROOM_PORT', 3000)
 ORS_PORT = os.getenv('ORS_PORT', 8082)
 ORS_API_PATH = os.getenv('ORS_API_PATH', '/ors/v2')
 MATRIX_CONCURRENCY = int(os.getenv('MATRIX_CONCURRENCY', '6'))
+# Threads per gunicorn worker. Must match --threads in the gateway Dockerfile
+# (which reads the same env var); used to size the per-host session pools.
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', '4'))
+# Serving mode, also read by the Dockerfile. `gthread` (default) holds one OS
+# thread per in-flight request. `gevent` serves the same app, routes and
+# responses on gunicorn's gevent worker: sockets, threads and locks are
+# monkey-patched before this module is imported, so a downstream ORS/VROOM
+# call parks a greenlet instead of a thread and one worker keeps up to
+# GUNICORN_WORKER_CONNECTIONS requests open. Downstream fan-out is then
+# bounded by the per-host slots, sized to ASYNC_HOST_CONCURRENCY by default.
+GUNICORN_WORKER_CLASS = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+GUNICORN_WORKER_CONNECTIONS = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+ASYNC_MODE = GUNICORN_WORKER_CLASS == 'gevent'
+ASYNC_HOST_CONCURRENCY = int(os.getenv('ASYNC_HOST_CONCURRENCY', '256'))
 # v1.1.0 - Unified region model. There is NO global ORS_SERVICE or VROOM_SERVICE
 # anymore; every region (including the default) is served by a per-region pair
 # named ORS_SERVICE_<REGION> / VROOM_SERVICE_<REGION>. When a caller does not
@@ -31,6 +63,8 @@ DEFAULT_REGION_NAME = os.getenv('DEFAULT_REGION_NAME', 'SanFrancisco')
 ORS_TIMEOUT_DEFAULT = int(os.getenv('ORS_TIMEOUT_DEFAULT', '120'))
 ORS_TIMEOUT_MATRIX = int(os.getenv('ORS_TIMEOUT_MATRIX', '55'))
 ORS_TIMEOUT_ISOCHRONES = int(os.getenv('ORS_TIMEOUT_ISOCHRONES', '300'))
+# Wall-clock budget for a whole tiled matrix run (all tiles, in parallel).
+ORS_TIMEOUT_MATRIX_TILED = int(os.getenv('ORS_TIMEOUT_MATRIX_TILED', str(ORS_TIMEOUT_MATRIX)))
 GATEWAY_VERSION = 'v1.1.9'
 
 def get_logger(logger_name):
@@ -58,15 +92,21 @@ def _normalize_region(region):
 
 def resolve_ors_host(region=None):
     """Per-region ORS service. After the v1.1.0 unification there is no global
-    ORS_SERVICE - even the default region resolves to ors-service-<default>."""
-    return f'ors-service-{_normalize_region(region)}'
+    ORS_SERVICE - even the default region resolves to ors-service-<default>.
+    The host's keep-alive session pool is created on first resolution."""
+    host = f'ors-service-{_normalize_region(region)}'
+    _session_pool(host)
+    return host
 
 
 def resolve_vroom_host(region=None):
     """Per-region VROOM service co-located with the region's ORS. After v1.1.0
     there is no global VROOM_SERVICE - the default region maps to
-    vroom-service-<default>."""
-    return f'vroom-service-{_normalize_region(region)}'
+    vroom-service-<default>. The host's keep-alive session pool is created on
+    first resolution."""
+    host = f'vroom-service-{_normalize_region(region)}'
+    _session_pool(host)
+    return host
 
 
 # Backward-compat aliases were retired in v1.1.5. Pre-v1.1.0 code referenced
@@ -76,8 +116,955 @@ def resolve_vroom_host(region=None):
 # DEFAULT_REGION_NAME via _normalize_region.
 
 
+# ---------------------------------------------------------------------------
+# JSON codec for downstream bodies and gateway responses.
+#
+# get_ors_response used to json.dumps the payload only to measure req_bytes,
+# let requests serialize it a second time for the POST, format it again for
+# an INFO log line, then decode the response text on top of reading
+# r.content -- three or four full passes over a multi-MB matrix body per
+# call. Bodies are now encoded once to bytes, those exact bytes are sent,
+# responses are decoded straight from r.content, and byte counts are the
+# lengths of those buffers.
+#
+# orjson is used when installed (it is in the gateway image); otherwise, and
+# for anything orjson refuses (e.g. non-string dict keys), the stdlib json
+# module with compact separators.
+# ---------------------------------------------------------------------------
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+def _json_encode(obj, sort_keys=False):
+    """obj -> compact UTF-8 JSON bytes. sort_keys gives the canonical form
+    used for request hashing."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+        except TypeError:
+            pass
+    try:
+        return json.dumps(obj, separators=(',', ':'), sort_keys=sort_keys).encode('utf-8')
+    except TypeError:  # mixed-type keys cannot be sorted
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _json_decode(raw):
+    """JSON bytes/str -> Python object. Raises ValueError on invalid JSON."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+# ---------------------------------------------------------------------------
+# Per-request stage timing.
+#
+# An OPTIMIZATION call that takes a minute could have spent it on the matrix
+# pre-compute, waiting for a host slot, in the VROOM solve, decoding the
+# polyline, reconstructing geometry or serializing the response, and the
+# per-call [ORS_METRIC] events cannot tell which. The traced handlers
+# (/optimization, /optimization_tabular, /matrix_tabular) open a trace
+# for the request. Code on the request path wraps its stages in _span(stage);
+# rows and chunks running on pool threads record into the same trace
+# because pool submissions carry the request's context (_in_request_context).
+#
+# Every traced request writes one `[GATEWAY_TRACE] {json}` line with its
+# wall time and, per stage, the call count and summed milliseconds (stages
+# running in parallel across rows can sum past the wall time). The lines go
+# out with the batched metric flush; the ORS_REQUEST_LOG ingest does not
+# read them. A request sent with `X-Gateway-Trace: 1` (or every request when
+# TRACE_RESPONSE_HEADER=1) also gets the stages back as a Server-Timing
+# header plus X-Gateway-Trace-Id.
+#
+# Individual spans (stage, offset, duration, host) are recorded only for a
+# TRACE_SAMPLE_RATE fraction of requests (or `X-Gateway-Trace: full`), and
+# written only when the request took at least TRACE_SLOW_MS, capped at
+# TRACE_MAX_SPANS per request.
+# ---------------------------------------------------------------------------
+TRACE_REQUESTS = os.getenv('TRACE_REQUESTS', '1') == '1'
+TRACE_RESPONSE_HEADER = os.getenv('TRACE_RESPONSE_HEADER', '0') == '1'
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.01'))
+TRACE_SLOW_MS = int(os.getenv('TRACE_SLOW_MS', '10000'))
+TRACE_MAX_SPANS = int(os.getenv('TRACE_MAX_SPANS', '2000'))
+
+_TRACE = contextvars.ContextVar('gateway_trace', default=None)
+
+
+@contextmanager
+def _span(stage, **attrs):
+    """Time the enclosed block as `stage` of the current request's trace."""
+    trace = _TRACE.get()
+    if trace is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        with trace['lock']:
+            stage_totals = trace['stages'].setdefault(stage, [0, 0.0])
+            stage_totals[0] += 1
+            stage_totals[1] += ms
+            if trace['full'] and len(trace['spans']) < TRACE_MAX_SPANS:
+                trace['spans'].append(dict(attrs, stage=stage, start_ms=round((t0 - trace['t0']) * 1000, 1),
+                                           ms=round(ms, 1)))
+
+
+def _in_request_context(fn):
+    """fn, run on a pool thread inside the submitting request's context."""
+    ctx = contextvars.copy_context()
+    return lambda *args: ctx.copy().run(fn, *args)
+
+
+def _traced(name):
+    """Decorator for Flask handlers: trace the request as `name`."""
+    def wrap(handler):
+        @functools.wraps(handler)
+        def traced_handler(*args, **kwargs):
+            if not TRACE_REQUESTS:
+                return handler(*args, **kwargs)
+            mode = (request.headers.get('X-Gateway-Trace') or '').strip().lower()
+            trace = {
+                'id': uuid.uuid4().hex,
+                't0': time.perf_counter(),
+                'lock': threading.Lock(),
+                'stages': {},
+                'spans': [],
+                'full': mode == 'full' or random.random() < TRACE_SAMPLE_RATE,
+            }
+            token = _TRACE.set(trace)
+            try:
+                with _span('parse'):
+                    request.get_json(silent=True)
+                response = make_response(handler(*args, **kwargs))
+            finally:
+                _TRACE.reset(token)
+            wall_ms = (time.perf_counter() - trace['t0']) * 1000
+            stages = {stage: {'count': n, 'ms': round(ms, 1)} for stage, (n, ms) in trace['stages'].items()}
+            line = {
+                'ts': _metric_ts(),
+                'trace_id': trace['id'],
+                'endpoint': name,
+                'status': response.status_code,
+                'wall_ms': round(wall_ms, 1),
+                'stages': stages,
+            }
+            if trace['full'] and wall_ms >= TRACE_SLOW_MS:
+                line['spans'] = trace['spans']
+            _emit_trace(line)
+            if mode or TRACE_RESPONSE_HEADER:
+                timings = [f'{stage};dur={info["ms"]};desc="x{info["count"]}"' for stage, info in stages.items()]
+                timings.append(f'total;dur={round(wall_ms, 1)}')
+                response.headers['Server-Timing'] = ', '.join(timings)
+                response.headers['X-Gateway-Trace-Id'] = trace['id']
+            return response
+        return traced_handler
+    return wrap
+
+
+# ---------------------------------------------------------------------------
+# Request deadline.
+#
+# Every downstream call used to pick its own timeout (ORS_TIMEOUT_MATRIX,
+# ORS_TIMEOUT_MATRIX_PRECOMPUTE, 30s per geometry route, 300s for VROOM) and
+# retries and the VROOM default-region fallback added more on top, so one
+# OPTIMIZATION row could run well past the point where _map_rows had given up
+# on it, doing work nobody would receive. A row now carries a deadline, set
+# by _map_rows to BATCH_DEADLINE_S from the start of the batch and held in a
+# context variable, so it follows the row into fan-out pools wrapped with
+# _in_request_context. Nested _deadline scopes can only shorten it.
+#
+# _deadline_timeout(t) gives a downstream call min(t, remaining budget) and
+# raises DeadlineExceeded once the budget is spent; slot waits, retry
+# backoffs, single-flight waits and fallbacks check it too. A timeout cut
+# short by the deadline is not counted against the host (breaker, limiter):
+# the budget ran out, which says nothing about the host.
+# ---------------------------------------------------------------------------
+_DEADLINE = contextvars.ContextVar('gateway_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The current request's deadline passed before the downstream work."""
+
+
+@contextmanager
+def _deadline(seconds):
+    """Bound the downstream work of the enclosed block to `seconds` from now
+    (or to the enclosing deadline, if sooner)."""
+    at = time.monotonic() + seconds
+    outer = _DEADLINE.get()
+    token = _DEADLINE.set(at if outer is None else min(outer, at))
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def _deadline_remaining():
+    """Seconds left before the current deadline; None without one."""
+    at = _DEADLINE.get()
+    return None if at is None else at - time.monotonic()
+
+
+def _deadline_timeout(timeout_s):
+    """(timeout, bound) for a downstream call that may take `timeout_s`;
+    bound=True when the remaining budget is the shorter of the two."""
+    remaining = _deadline_remaining()
+    if remaining is None or remaining >= timeout_s:
+        return timeout_s, False
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return remaining, True
+
+
+def _deadline_error(host):
+    return {
+        'error': 'deadline_exceeded',
+        'message': f'The request deadline ({BATCH_DEADLINE_S}s per batch) passed before {host} answered; '
+                   f'the remaining work was abandoned. Retry the row, or send smaller batches.',
+        'ors_host': host,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Keep-alive HTTP session pools per downstream host.
+#
+# Every ORS / VROOM call used to go through a bare requests.post, i.e. a new
+# TCP connection per call. Under MATRIX_TABULAR batch load the connect and
+# teardown showed up in gateway latency and cost the ORS container file
+# descriptors. Each host now owns a pool of requests.Session objects, each
+# holding one keep-alive connection. A session is checked out for exactly one
+# downstream call, so no Session is ever shared between threads.
+#
+# Sizing: one gunicorn thread can fan a batch out MATRIX_CONCURRENCY ways, so
+# a worker has at most GUNICORN_THREADS * MATRIX_CONCURRENCY calls in flight
+# to one host. In gevent mode the bound is ASYNC_HOST_CONCURRENCY instead.
+# ORS_SESSION_POOL_SIZE overrides either.
+#
+# Pools are created lazily by resolve_ors_host / resolve_vroom_host. Hit
+# (idle session reused), miss (new session opened) and wait (pool exhausted,
+# caller blocked) counts are flushed as a `session_pool` event through
+# _emit_metric at most every ORS_SESSION_POOL_METRIC_INTERVAL_S seconds.
+#
+# A caller waits for a free session at most ORS_SESSION_WAIT_MAX_S (then
+# the call fails as a requests Timeout, like a slow downstream) and never
+# past the request deadline (DeadlineExceeded), so a leaked session or a
+# saturated pool cannot hang a request thread.
+# ---------------------------------------------------------------------------
+ORS_SESSION_POOL_SIZE = int(os.getenv(
+    'ORS_SESSION_POOL_SIZE', str(ASYNC_HOST_CONCURRENCY if ASYNC_MODE else GUNICORN_THREADS * MATRIX_CONCURRENCY)))
+ORS_SESSION_POOL_METRIC_INTERVAL_S = int(os.getenv('ORS_SESSION_POOL_METRIC_INTERVAL_S', '60'))
+ORS_SESSION_WAIT_MAX_S = float(os.getenv('ORS_SESSION_WAIT_MAX_S', '30'))
+
+_SESSION_POOLS = {}  # host -> {cond, idle: [Session...], created, size, hits, misses, waits, wait_ms, last_emit}
+_SESSION_POOLS_LOCK = threading.Lock()
+
+
+def _session_pool(host):
+    pool = _SESSION_POOLS.get(host)
+    if pool is None:
+        with _SESSION_POOLS_LOCK:
+            pool = _SESSION_POOLS.get(host)
+            if pool is None:
+                pool = {
+                    'cond': threading.Condition(),
+                    'idle': [],
+                    'created': 0,
+                    'size': max(1, ORS_SESSION_POOL_SIZE),
+                    'hits': 0,
+                    'misses': 0,
+                    'waits': 0,
+                    'wait_ms': 0,
+                    'last_emit': time.monotonic(),
+                }
+                _SESSION_POOLS[host] = pool
+    return pool
+
+
+def _new_session():
+    session = requests.Session()
+    # One connection per session: the session itself is the pooled unit.
+    session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+    return session
+
+
+def _flush_pool_metric(host, pool):
+    now = time.monotonic()
+    with pool['cond']:
+        if now - pool['last_emit'] < ORS_SESSION_POOL_METRIC_INTERVAL_S:
+            return
+        counts = {
+            'pool_hits': pool['hits'],
+            'pool_misses': pool['misses'],
+            'pool_waits': pool['waits'],
+            'pool_size': pool['size'],
+        }
+        wait_ms = pool['wait_ms']
+        pool['hits'] = pool['misses'] = pool['waits'] = pool['wait_ms'] = 0
+        pool['last_emit'] = now
+    _emit_metric('session_pool', None, host, 200, wait_ms, None, None,
+                 caller='session_pool', extra=counts)
+
+
+@contextmanager
+def _pooled_session(host):
+    """Check a keep-alive session for `host` out of its pool for one call.
+    Blocks when all `size` sessions are in use, up to ORS_SESSION_WAIT_MAX_S
+    and the request deadline."""
+    pool = _session_pool(host)
+    session = None
+    with pool['cond']:
+        if pool['idle']:
+            pool['hits'] += 1
+            session = pool['idle'].pop()
+        elif pool['created'] < pool['size']:
+            pool['misses'] += 1
+            pool['created'] += 1
+        else:
+            pool['waits'] += 1
+            t0 = time.monotonic()
+            try:
+                while not pool['idle']:
+                    waited = time.monotonic() - t0
+                    remaining = _deadline_remaining()
+                    if remaining is not None and remaining <= 0:
+                        raise DeadlineExceeded()
+                    if waited >= ORS_SESSION_WAIT_MAX_S:
+                        logger.warning(f'no free session for {host} after {waited:.1f}s '
+                                       f'({pool["size"]} in use); a session may have leaked')
+                        raise requests.exceptions.Timeout(
+                            f'no free session for {host} within {ORS_SESSION_WAIT_MAX_S}s')
+                    timeout = ORS_SESSION_WAIT_MAX_S - waited
+                    pool['cond'].wait(min(timeout, remaining) if remaining is not None else timeout)
+            finally:
+                pool['wait_ms'] += int((time.monotonic() - t0) * 1000)
+            session = pool['idle'].pop()
+    if session is None:
+        session = _new_session()
+    _flush_pool_metric(host, pool)
+    try:
+        yield session
+    finally:
+        with pool['cond']:
+            pool['idle'].append(session)
+            pool['cond'].notify()
+
+
+# ---------------------------------------------------------------------------
+# Container-shared gateway state.
+#
+# gunicorn runs several worker processes per container and each used to keep
+# its own circuit breaker and concurrency limit per host. A failing ORS was
+# only cut off by the worker that happened to count enough failures, while
+# the others kept sending it traffic, and every worker probed its own limit
+# as if it were alone. Breaker and limiter state are now shared through one
+# SQLite file (GATEWAY_STATE_DB, on /dev/shm so it never touches disk) that
+# every worker on the container opens.
+#
+# The db stays off the request path. Each worker decides on its own copy of
+# the state in process memory: a breaker check, taking and releasing a slot
+# and the AIMD step touch neither the db nor a cross-process lock, and a
+# worker trips its breaker or backs off its limit on its own failures at
+# once. Every GATEWAY_STATE_SYNC_S the metrics flusher thread (_state_sync)
+# merges what changed since the last sync -- limit steps, breaker failures,
+# trips and resets, this worker's in-flight counts per lane -- in one short
+# transaction, and reads back the merged limits and breakers and the other
+# workers' in-flight counts. A sync with nothing to merge only reads. The
+# container-wide bounds therefore hold to within one sync interval.
+#
+# Each thread uses its own connection, whose busy timeout is
+# GATEWAY_STATE_BUSY_TIMEOUT_MS (a few ms). A sync that cannot get the db in
+# that time is skipped and its changes carried over to the next one; the
+# worker goes on with its local state meanwhile. In gevent mode every db call
+# also runs on the hub's native threadpool (_state_call), so neither sqlite's
+# busy handler nor a slow write ever blocks the hub.
+#
+# Timestamps stored there are wall-clock (time.time()) since monotonic clocks
+# are not comparable between processes. In-flight counts are kept per (host,
+# lane, pid) and rows of dead workers are reaped, so a killed worker never
+# leaks slots. An empty GATEWAY_STATE_DB, or a path that cannot be opened,
+# falls back to an in-memory database: per-process state, as before.
+# ---------------------------------------------------------------------------
+GATEWAY_STATE_DB = os.getenv('GATEWAY_STATE_DB', '/dev/shm/routing-gateway-state.db')
+GATEWAY_STATE_SYNC_S = float(os.getenv('GATEWAY_STATE_SYNC_S', '1'))
+GATEWAY_STATE_BUSY_TIMEOUT_MS = int(os.getenv('GATEWAY_STATE_BUSY_TIMEOUT_MS', '5'))
+GATEWAY_STATE_REAP_INTERVAL_S = int(os.getenv('GATEWAY_STATE_REAP_INTERVAL_S', '30'))
+
+# pid/path of this process's db; `generation` names the in-memory fallback.
+_STATE = {'pid': None, 'path': None, 'keeper': None, 'generation': 0, 'last_reap': 0.0}
+_STATE_LOCAL = threading.local()
+
+
+def _state_connect(path):
+    conn = sqlite3.connect(path, timeout=GATEWAY_STATE_BUSY_TIMEOUT_MS / 1000.0, isolation_level=None,
+                           uri=path.startswith('file:'), check_same_thread=False)
+    if not path.startswith('file:'):
+        conn.execute('PRAGMA synchronous=OFF')
+    return conn
+
+
+def _state_schema(conn):
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute('CREATE TABLE IF NOT EXISTS breaker ('
+                 'host TEXT PRIMARY KEY, state TEXT NOT NULL, open_until REAL NOT NULL, failures TEXT NOT NULL)')
+    conn.execute('CREATE TABLE IF NOT EXISTS host_limit ('
+                 'host TEXT PRIMARY KEY, lim REAL NOT NULL, last_decrease REAL NOT NULL)')
+    conn.execute('CREATE TABLE IF NOT EXISTS lane_slots ('
+                 'host TEXT NOT NULL, lane TEXT NOT NULL, pid INTEGER NOT NULL, in_flight INTEGER NOT NULL, '
+                 'waiting INTEGER NOT NULL, PRIMARY KEY (host, lane, pid))')
+    conn.execute('CREATE TABLE IF NOT EXISTS ors_status ('
+                 'host TEXT PRIMARY KEY, status TEXT, fetched_at REAL NOT NULL, fetcher INTEGER, '
+                 'lease_until REAL NOT NULL)')
+    conn.execute('CREATE TABLE IF NOT EXISTS metric_series ('
+                 'pid INTEGER NOT NULL, flushed_at REAL NOT NULL, series_key TEXT NOT NULL, agg TEXT NOT NULL)')
+    # A recycled pid must not inherit a dead worker's slots.
+    conn.execute('DELETE FROM lane_slots WHERE pid = ?', (os.getpid(),))
+    conn.execute('COMMIT')
+
+
+def _state_busy(e):
+    return isinstance(e, sqlite3.OperationalError) and 'locked' in str(e)
+
+
+def _state_init():
+    """Pick this process's db, once per pid: a connection must not cross a fork.
+    A busy db raises (and is retried by the next caller); an unusable one falls
+    back to the in-memory db."""
+    pid, path, keeper = os.getpid(), GATEWAY_STATE_DB, None
+    if path:
+        try:
+            conn = _state_connect(path)
+            conn.execute('PRAGMA journal_mode=WAL')
+            _state_schema(conn)
+            conn.close()
+        except sqlite3.Error as e:
+            if _state_busy(e):
+                raise
+            logger.warning(f'gateway state db {path} unavailable ({e}); using per-process state')
+            path = ''
+    if not path:
+        # Shared cache, so every thread's connection sees the same db; the
+        # keeper connection keeps it alive.
+        path = f'file:routing-gateway-state-{_STATE["generation"]}?mode=memory&cache=shared'
+        keeper = _state_connect(path)
+        _state_schema(keeper)
+    _STATE.update(path=path, keeper=keeper, last_reap=0.0, pid=pid)
+
+
+def _state_conn():
+    if _STATE['pid'] != os.getpid():
+        _state_init()
+    local = _STATE_LOCAL.__dict__
+    if local.get('pid') != _STATE['pid'] or local.get('path') != _STATE['path']:
+        if local.get('pid') == _STATE['pid']:
+            local['conn'].close()
+        local.update(conn=_state_connect(_STATE['path']), pid=_STATE['pid'], path=_STATE['path'])
+    return local['conn']
+
+
+@contextmanager
+def _state_txn(write=True):
+    """One atomic transaction on this thread's connection to the shared state
+    db; yields the connection. write=False opens a deferred (read-only)
+    transaction. Raises sqlite3.OperationalError when the db stays locked for
+    longer than GATEWAY_STATE_BUSY_TIMEOUT_MS."""
+    conn = _state_conn()
+    conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+    try:
+        yield conn
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def _state_call(fn, *args):
+    """fn(*args) for a function that only does state-db work. In gevent mode it
+    runs on the hub's native threadpool, so the calling greenlet parks while
+    the others keep running."""
+    if ASYNC_MODE:
+        import gevent
+        # Raised here rather than in the pool, which would print every busy db.
+        ok, result = gevent.get_hub().threadpool.apply(_state_call_captured, (fn,) + args)
+        if not ok:
+            raise result
+        return result
+    return fn(*args)
+
+
+def _state_call_captured(fn, *args):
+    try:
+        return True, fn(*args)
+    except Exception as e:
+        return False, e
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _state_reap(conn):
+    pids = [pid for (pid,) in conn.execute('SELECT DISTINCT pid FROM lane_slots')]
+    conn.executemany('DELETE FROM lane_slots WHERE pid = ?', [(pid,) for pid in pids if not _pid_alive(pid)])
+
+
+def _state_sync_db(limits, breakers):
+    now = time.time()
+    reap = now - _STATE['last_reap'] >= GATEWAY_STATE_REAP_INTERVAL_S
+    write = reap or bool(breakers) or any(_host_limit_changed(snap) for snap in limits.values())
+    with _state_txn(write=write) as conn:
+        if reap:
+            _state_reap(conn)
+        shared = _host_limit_sync_db(conn, limits), _breaker_sync_db(conn, breakers)
+    if reap:
+        _STATE['last_reap'] = now
+    return shared
+
+
+def _state_sync():
+    """Merge this worker's limiter and breaker changes into the shared state
+    db and adopt the other workers' (see above). Returns False when the db was
+    busy or unavailable; the changes are then kept for the next sync."""
+    limits, breakers = _host_limit_snapshot(), _breaker_snapshot()
+    try:
+        shared_limits, shared_breakers = _state_call(_state_sync_db, limits, breakers)
+    except Exception as e:
+        _host_limit_restore(limits)
+        _breaker_restore(breakers)
+        logger.debug(f'gateway state sync skipped ({e}); keeping local state')
+        return False
+    _host_limit_merge(shared_limits)
+    _breaker_merge(shared_breakers)
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Adaptive per-host concurrency limit.
+#
+# Every ORS call made by get_ors_response (and every VROOM solve in
+# get_vroom_response) holds one of the host's slots for the duration of the
+# HTTP exchange only, never while waiting on other work, so nested fan-out
+# (matrix_tabular rows -> 6099 chunks -> 10-wide re-splits) cannot deadlock
+# and all endpoints share one bound per host.
+#
+# The bound used to be static (MATRIX_CONCURRENCY per batch), whatever the
+# size of the ORS instance behind the host. It is now an AIMD limit per host:
+#   - each successful call adds 1/limit (about +1 per limit's worth of calls)
+#     while the host is actually running near its limit;
+#   - a 5xx, timeout or connection failure multiplies it by ORS_LIMIT_BACKOFF,
+#     at most once per congestion event (only calls started after the last
+#     decrease can trigger another one).
+# A large regional ORS is driven up towards ORS_HOST_CONCURRENCY while a
+# small city instance settles wherever it starts failing. The limit starts
+# at MATRIX_CONCURRENCY and never drops below ORS_LIMIT_MIN.
+#
+# Slots are handed out per lane (endpoint class) so bulk work cannot starve
+# interactive calls. A call's lane follows its ORS function (_lane_of):
+#   interactive -- directions, route geometry and VROOM solves; may use the
+#                  whole limit and is served first;
+#   matrix      -- at most ORS_LANE_MATRIX_SHARE of the limit;
+#   isochrones  -- at most ORS_LANE_ISOCHRONES_SHARE of the limit.
+# The bulk lanes together never take the last ORS_LANE_RESERVE of the limit
+# (always leaving them at least one slot), and while an interactive caller
+# waits for one of the host's slots no bulk call is admitted, so bulk work
+# queues behind it. A limit of 8 with the defaults leaves 2 slots that only
+# interactive calls can take, and isochrones at most 4 of the other 6. The
+# limit itself is still the host's: every lane's overload backs it off.
+#
+# The limit and the in-flight counts are container-wide (shared state db
+# above), so the bound holds for all gunicorn workers together, to within
+# one GATEWAY_STATE_SYNC_S: a worker counts its own calls exactly and the
+# other workers' as of the last sync. A caller over the limit waits on its
+# process's condition, which local releases and every sync notify.
+#
+# The fan-out pools (chunked/tiled matrix, geometry reconstruction) size
+# themselves from the host's current limit (_host_limit). ORS_HOST_CONCURRENCY
+# defaults to the session pool size so a slot holder never waits on a
+# session. Limit / in-flight / wait counts are flushed per host as a
+# `host_limit` event every ORS_LIMIT_METRIC_INTERVAL_S.
+# ---------------------------------------------------------------------------
+ORS_HOST_CONCURRENCY = int(os.getenv('ORS_HOST_CONCURRENCY', str(ORS_SESSION_POOL_SIZE)))
+ORS_LIMIT_MIN = int(os.getenv('ORS_LIMIT_MIN', '1'))
+ORS_LIMIT_BACKOFF = float(os.getenv('ORS_LIMIT_BACKOFF', '0.5'))
+ORS_LIMIT_METRIC_INTERVAL_S = int(os.getenv('ORS_LIMIT_METRIC_INTERVAL_S', '60'))
+ORS_LANE_RESERVE = float(os.getenv('ORS_LANE_RESERVE', '0.25'))
+ORS_LANE_MATRIX_SHARE = float(os.getenv('ORS_LANE_MATRIX_SHARE', '0.75'))
+ORS_LANE_ISOCHRONES_SHARE = float(os.getenv('ORS_LANE_ISOCHRONES_SHARE', '0.5'))
+
+# lane -> (priority, share of the host limit); lower priority value is served first.
+_LANES = {
+    'interactive': (0, 1.0),
+    'matrix': (1, ORS_LANE_MATRIX_SHARE),
+    'isochrones': (1, ORS_LANE_ISOCHRONES_SHARE),
+}
+_FUNCTION_LANES = {'matrix': 'matrix', 'isochrones': 'isochrones'}
+
+_HOST_LIMITS = {}  # host -> {cond, counters, limit, usage, others, unmerged steps} (see _host_limiter)
+_HOST_LIMITS_LOCK = threading.Lock()
+
+
+def _lane_of(function):
+    return _FUNCTION_LANES.get(function, 'interactive')
+
+
+def _host_limiter(host):
+    lim = _HOST_LIMITS.get(host)
+    if lim is None:
+        with _HOST_LIMITS_LOCK:
+            lim = _HOST_LIMITS.get(host)
+            if lim is None:
+                ceiling = max(1, ORS_HOST_CONCURRENCY)
+                lim = {
+                    'cond': threading.Condition(),
+                    'increases': 0,
+                    'decreases': 0,
+                    'waits': 0,
+                    'last_emit': time.monotonic(),
+                    # This process's view of the shared limit: its own AIMD
+                    # steps apply at once, the other workers' at the next sync.
+                    'limit': float(min(ceiling, max(ORS_LIMIT_MIN, MATRIX_CONCURRENCY))),
+                    'last_decrease': 0.0,
+                    'usage': {lane: [0, 0] for lane in _LANES},  # this process: [in_flight, waiting]
+                    'others': {},  # the other workers' usage as of the last sync
+                    # Not yet merged into the shared state.
+                    'step': 0.0,
+                    'decrease_started': 0.0,
+                    'decreased_at': 0.0,
+                    'published': None,
+                }
+                _HOST_LIMITS[host] = lim
+        _ensure_metric_flusher()
+    return lim
+
+
+def _host_usage(lim):
+    """Container-wide {lane: [in_flight, waiting]} of a limiter; caller holds its cond."""
+    usage = {lane: list(counts) for lane, counts in lim['usage'].items()}
+    for lane, (in_flight, waiting) in lim['others'].items():
+        counts = usage.setdefault(lane, [0, 0])
+        counts[0] += in_flight
+        counts[1] += waiting
+    return usage
+
+
+def _lane_room(limit, usage, lane, yield_to_waiters=True):
+    """Slots `lane` may still take on a host at `limit` whose lanes are at
+    `usage`; <= 0 means the call has to wait."""
+    limit = max(1, int(limit))
+    priority, share = _LANES[lane]
+    room = limit - sum(in_flight for in_flight, _ in usage.values())
+    if priority == 0:
+        return room
+    if yield_to_waiters and any(waiting for other, (_, waiting) in usage.items()
+                                if _LANES.get(other, (0, 1.0))[0] < priority):
+        return 0
+    reserve = min(math.ceil(limit * ORS_LANE_RESERVE), limit - 1)
+    bulk = sum(in_flight for other, (in_flight, _) in usage.items() if _LANES.get(other, (0, 1.0))[0] > 0)
+    own = usage.get(lane, [0, 0])[0]
+    return min(room, limit - reserve - bulk, max(1, int(limit * share)) - own)
+
+
+def _host_limit(host):
+    """Current concurrency limit of `host`, for sizing fan-out pools."""
+    return max(1, int(_host_limiter(host)['limit']))
+
+
+def _flush_host_limit_metric(host, lim):
+    now = time.monotonic()
+    with lim['cond']:
+        if now - lim['last_emit'] < ORS_LIMIT_METRIC_INTERVAL_S:
+            return
+        usage = _host_usage(lim)
+        counts = {
+            'limit_increases': lim['increases'],
+            'limit_decreases': lim['decreases'],
+            'limit_waits': lim['waits'],
+            'limit': int(lim['limit']),
+            'in_flight': sum(u[0] for u in usage.values()),
+        }
+        counts.update({f'in_flight_{lane}': usage.get(lane, [0, 0])[0] for lane in _LANES})
+        lim['increases'] = lim['decreases'] = lim['waits'] = 0
+        lim['last_emit'] = now
+    _emit_metric('host_limit', None, host, 200, 0, None, None,
+                 caller='host_limit', extra=counts)
+
+
+def _host_limit_changed(snap):
+    return snap['publish'] or snap['step'] or snap['decrease_started']
+
+
+def _host_limit_snapshot():
+    """Take each host's unmerged AIMD steps and this process's lane usage for
+    _state_sync."""
+    snaps = {}
+    for host, lim in list(_HOST_LIMITS.items()):
+        with lim['cond']:
+            usage = {lane: list(counts) for lane, counts in lim['usage'].items()}
+            snaps[host] = {'usage': usage, 'publish': usage != lim['published'], 'step': lim['step'],
+                           'decrease_started': lim['decrease_started'], 'decreased_at': lim['decreased_at']}
+            lim['published'] = usage
+            lim['step'] = lim['decrease_started'] = lim['decreased_at'] = 0.0
+    return snaps
+
+
+def _host_limit_restore(snaps):
+    """Put back the changes of a sync that did not reach the db."""
+    for host, snap in snaps.items():
+        lim = _HOST_LIMITS.get(host)
+        if lim is None:
+            continue
+        with lim['cond']:
+            lim['step'] += snap['step']
+            if snap['decrease_started'] > lim['decrease_started']:
+                lim['decrease_started'], lim['decreased_at'] = snap['decrease_started'], snap['decreased_at']
+            lim['published'] = None
+
+
+def _host_limit_sync_db(conn, snaps):
+    """Merge the snapshots into the shared limits; returns {host: (limit,
+    last_decrease, usage of the other workers)}."""
+    pid, ceiling = os.getpid(), float(max(1, ORS_HOST_CONCURRENCY))
+    shared = {}
+    for host, snap in snaps.items():
+        changed = _host_limit_changed(snap)
+        if changed:
+            conn.execute('INSERT OR IGNORE INTO host_limit (host, lim, last_decrease) VALUES (?, ?, 0)',
+                         (host, float(min(ceiling, max(ORS_LIMIT_MIN, MATRIX_CONCURRENCY)))))
+        row = conn.execute('SELECT lim, last_decrease FROM host_limit WHERE host = ?', (host,)).fetchone()
+        if row is None:
+            continue
+        limit, last_decrease = row
+        # One decrease per congestion event, container-wide: only a call
+        # started after the last merged decrease backs the limit off again.
+        if snap['decrease_started'] > last_decrease:
+            limit = max(float(max(1, ORS_LIMIT_MIN)), limit * ORS_LIMIT_BACKOFF)
+            last_decrease = snap['decreased_at']
+        limit = min(ceiling, limit + snap['step'])
+        if changed:
+            conn.execute('UPDATE host_limit SET lim = ?, last_decrease = ? WHERE host = ?',
+                         (limit, last_decrease, host))
+        if snap['publish']:
+            conn.executemany('INSERT OR REPLACE INTO lane_slots (host, lane, pid, in_flight, waiting) '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             [(host, lane, pid, in_flight, waiting)
+                              for lane, (in_flight, waiting) in snap['usage'].items()])
+        others = {lane: [in_flight, waiting] for lane, in_flight, waiting in conn.execute(
+            'SELECT lane, SUM(in_flight), SUM(waiting) FROM lane_slots WHERE host = ? AND pid != ? GROUP BY lane',
+            (host, pid))}
+        shared[host] = (limit, last_decrease, others)
+    return shared
+
+
+def _host_limit_merge(shared):
+    for host, (limit, last_decrease, others) in shared.items():
+        lim = _HOST_LIMITS.get(host)
+        if lim is None:
+            continue
+        with lim['cond']:
+            # Keep the steps this process took while the sync ran.
+            if lim['decrease_started']:
+                limit = min(limit, lim['limit'])
+            lim['limit'] = min(float(max(1, ORS_HOST_CONCURRENCY)), limit + lim['step'])
+            lim['last_decrease'] = max(lim['last_decrease'], last_decrease)
+            lim['others'] = others
+            lim['cond'].notify_all()
+
+
+@contextmanager
+def _host_slot(host, lane='interactive'):
+    """Hold one of `host`'s slots in `lane` for one downstream exchange.
+    Yields a dict; set its 'overloaded' key when the response itself signals
+    overload (5xx), and 'deadline_bound' when the call's timeout was cut to
+    the request deadline. Timeouts and connection failures are detected here."""
+    lim = _host_limiter(host)
+    with lim['cond']:
+        if _lane_room(lim['limit'], _host_usage(lim), lane) <= 0:
+            lim['waits'] += 1
+            lim['usage'][lane][1] += 1
+            try:
+                with _span('slot_wait', host=host, lane=lane):
+                    while _lane_room(lim['limit'], _host_usage(lim), lane) <= 0:
+                        remaining = _deadline_remaining()
+                        if remaining is not None and remaining <= 0:
+                            raise DeadlineExceeded()
+                        # Local releases and every sync notify.
+                        lim['cond'].wait(GATEWAY_STATE_SYNC_S if remaining is None
+                                         else min(remaining, GATEWAY_STATE_SYNC_S))
+            finally:
+                lim['usage'][lane][1] -= 1
+        lim['usage'][lane][0] += 1
+    started = time.time()
+    slot = {'overloaded': False, 'deadline_bound': False}
+    try:
+        yield slot
+    except requests.exceptions.Timeout:
+        slot['overloaded'] = not slot['deadline_bound']
+        raise
+    except requests.exceptions.ConnectionError:
+        slot['overloaded'] = True
+        raise
+    finally:
+        ceiling = max(1, ORS_HOST_CONCURRENCY)
+        with lim['cond']:
+            limit = lim['limit']
+            # Near the bound this lane may use: the limit is what held it back.
+            busy = _lane_room(limit, _host_usage(lim), lane, yield_to_waiters=False) <= 1
+            lim['usage'][lane][0] -= 1
+            if slot['overloaded']:
+                if started > lim['last_decrease']:
+                    now = time.time()
+                    lim['limit'] = max(float(max(1, ORS_LIMIT_MIN)), limit * ORS_LIMIT_BACKOFF)
+                    lim['last_decrease'] = lim['decreased_at'] = now
+                    lim['decrease_started'] = started
+                    # Steps taken before the congestion are moot.
+                    lim['step'] = 0.0
+                    lim['decreases'] += 1
+            elif busy and limit < ceiling:
+                step = min(float(ceiling), limit + 1.0 / limit) - limit
+                lim['limit'] += step
+                lim['step'] += step
+                lim['increases'] += 1
+            lim['cond'].notify_all()
+        _flush_host_limit_metric(host, lim)
+
+
+# ---------------------------------------------------------------------------
+# Request bulkhead for bulk endpoints.
+#
+# In gthread mode a worker has GUNICORN_THREADS request threads, and a
+# matrix_tabular sweep or a continental isochrones batch holds one for
+# minutes. A few of them in flight used to leave no thread for the SA app's
+# interactive DIRECTIONS calls, however much ORS capacity the interactive
+# lane had left. Handlers of bulk lanes are wrapped in _request_lane: with
+# GATEWAY_BULK_REQUEST_SLOTS > 0 at most that many of them run per worker
+# (e.g. GUNICORN_THREADS - 1), and the next one queues for up to
+# GATEWAY_BULK_QUEUE_WAIT_S for a slot before it is answered with 429 and a
+# Retry-After hint, which Snowflake retries with backoff.
+#
+# The bound is opt-in (default 0, no bound): the matrix builder in
+# 05_matrix_pipeline.sql runs parallel SQL workers against MATRIX_TABULAR,
+# and turning its batches into 429s would move that load onto Snowflake's
+# service-function retries. A queued batch still holds its thread while it
+# waits. In gevent mode a request does not hold a thread at all.
+# ---------------------------------------------------------------------------
+GATEWAY_BULK_REQUEST_SLOTS = int(os.getenv('GATEWAY_BULK_REQUEST_SLOTS', '0'))
+GATEWAY_BULK_QUEUE_WAIT_S = float(os.getenv('GATEWAY_BULK_QUEUE_WAIT_S', '30'))
+GATEWAY_BULK_RETRY_AFTER_S = int(os.getenv('GATEWAY_BULK_RETRY_AFTER_S', '5'))
+
+_BULK_REQUESTS = {'in_flight': 0}
+_BULK_REQUESTS_COND = threading.Condition()
+
+
+def _request_lane(lane):
+    """Decorator for Flask handlers serving `lane`; bulk lanes are bounded
+    per worker when GATEWAY_BULK_REQUEST_SLOTS is set."""
+    def wrap(handler):
+        if _LANES[lane][0] == 0:
+            return handler
+
+        @functools.wraps(handler)
+        def bulkhead_handler(*args, **kwargs):
+            if not GATEWAY_BULK_REQUEST_SLOTS:
+                return handler(*args, **kwargs)
+            with _BULK_REQUESTS_COND:
+                admitted = _BULK_REQUESTS_COND.wait_for(
+                    lambda: _BULK_REQUESTS['in_flight'] < GATEWAY_BULK_REQUEST_SLOTS,
+                    timeout=GATEWAY_BULK_QUEUE_WAIT_S)
+                if admitted:
+                    _BULK_REQUESTS['in_flight'] += 1
+            if not admitted:
+                _emit_metric(lane, None, None, 429, 0, None, None, error_code='bulkhead_full', caller='request_lane')
+                response = make_response({
+                    'error': 'bulkhead_full',
+                    'message': f'{GATEWAY_BULK_REQUEST_SLOTS} matrix/isochrones batches still running on this '
+                               f'gateway worker after {GATEWAY_BULK_QUEUE_WAIT_S:g}s in queue; '
+                               f'retry after {GATEWAY_BULK_RETRY_AFTER_S}s.',
+                }, 429)
+                response.headers['Retry-After'] = str(GATEWAY_BULK_RETRY_AFTER_S)
+                return response
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                with _BULK_REQUESTS_COND:
+                    _BULK_REQUESTS['in_flight'] -= 1
+                    _BULK_REQUESTS_COND.notify()
+        return bulkhead_handler
+    return wrap
+
+
+# ---------------------------------------------------------------------------
+# Row-parallel batch execution.
+#
+# A Snowflake service-function batch carries up to MAX_BATCH_ROWS rows and
+# every endpoint used to walk them one after another, so 100 isochrones took
+# 100x the latency of one. _map_rows runs a row function over the batch on
+# one pool per downstream host, so a batch that spans regions does not let
+# one region starve the others, and returns the results in input order. Each
+# pool is as wide as the host's current adaptive limit (ROW_CONCURRENCY > 0
+# pins it), and the per-call _host_slot bound still caps what all concurrent
+# batches together send to one host. In gevent mode a row costs a greenlet
+# rather than a thread, so the default width is ASYNC_HOST_CONCURRENCY.
+#
+# BATCH_DEADLINE_S bounds the whole batch below the gunicorn worker timeout
+# (360s). Rows still running at the deadline are abandoned: their pool is
+# shut down without waiting and each gets a `batch_deadline_exceeded` error
+# result, so Snowflake receives a complete response instead of a timeout.
+# The rows carry the same deadline (see "Request deadline"), so abandoned
+# rows stop calling downstream instead of running on in the background.
+# ---------------------------------------------------------------------------
+ROW_CONCURRENCY = int(os.getenv('ROW_CONCURRENCY', str(ASYNC_HOST_CONCURRENCY if ASYNC_MODE else 0)))
+BATCH_DEADLINE_S = int(os.getenv('BATCH_DEADLINE_S', '330'))
+
+
+def _map_rows(endpoint, rows, process_row, host_of):
+    """[process_row(row) for row in rows], run concurrently per host_of(row)
+    and cut off at BATCH_DEADLINE_S. process_row returns [row_id, result]."""
+    hosts = [host_of(row) for row in rows]
+    by_host = {}
+    for i, host in enumerate(hosts):
+        by_host.setdefault(host, []).append(i)
+    executors = {host: ThreadPoolExecutor(max_workers=max(1, min(ROW_CONCURRENCY or _host_limit(host), len(idx))))
+                 for host, idx in by_host.items()}
+    futures = [None] * len(rows)
+    with _deadline(BATCH_DEADLINE_S):
+        run_row = _in_request_context(process_row)
+        remaining = _deadline_remaining()
+    try:
+        for host, idx in by_host.items():
+            for i in idx:
+                futures[i] = executors[host].submit(run_row, rows[i])
+        done, _ = wait(futures, timeout=max(0.0, remaining))
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+    output_rows = []
+    for row, host, future in zip(rows, hosts, futures):
+        if future in done:
+            output_rows.append(future.result())
+            continue
+        logger.error(f'{endpoint} row {row[0]} abandoned at the {BATCH_DEADLINE_S}s batch deadline ({host})')
+        _emit_metric(endpoint, None, host, 504, BATCH_DEADLINE_S * 1000, None, None,
+                     error_code='batch_deadline_exceeded', caller='batch')
+        output_rows.append([row[0], {
+            'error': 'batch_deadline_exceeded',
+            'message': f'Row not finished within the {BATCH_DEADLINE_S}s batch deadline; the other rows of the '
+                       f'batch were returned. Retry the row, or send smaller batches.',
+            'ors_host': host,
+        }])
+    return output_rows
+
+
 def _make_response(output_rows):
-    response = make_response({"data": output_rows})
+    with _span('serialize'):
+        raw = _json_encode({"data": output_rows})
+    response = make_response(raw)
     response.headers['Content-type'] = 'application/json'
     return response
 
@@ -98,27 +1085,30 @@ def _extract_region(row, region_index):
 
 @app.get("/health")
 def readiness_probe():
-    return {'status': 'OK', 'version': GATEWAY_VERSION, 'ors_host': resolve_ors_host(None), 'vroom_host': resolve_vroom_host(None)}
+    return {'status': 'OK', 'version': GATEWAY_VERSION, 'ors_host': resolve_ors_host(None), 'vroom_host': resolve_vroom_host(None),
+            # Not shared: bulk jobs are only visible to the instance that took them.
+            'bulk_jobs': {'dir': BULK_JOB_DIR, 'shared': os.path.ismount(BULK_JOB_DIR)}}
 
 
 def _get_ors_health(ors_host=None):
     host = ors_host or resolve_ors_host(None)
     try:
         health_url = f'http://{host}:{ORS_PORT}{ORS_API_PATH}/health'
-        r = requests.get(url=health_url, timeout=5)
+        with _pooled_session(host) as session:
+            r = session.get(url=health_url, timeout=5)
         return r.status_code == 200
     except Exception:
         return False
 
 
-def _probe_ors_state(ors_host=None):
+def _probe_ors_health_state(host):
     """Distinguish 'warming_up' (process up, /health returns non-200, e.g. 503)
     from 'unreachable' (TCP refused / DNS fails, i.e. service suspended or not provisioned).
     Returns one of: 'ready' | 'warming_up' | 'unreachable' | 'unknown'."""
-    host = ors_host or resolve_ors_host(None)
     try:
         health_url = f'http://{host}:{ORS_PORT}{ORS_API_PATH}/health'
-        r = requests.get(url=health_url, timeout=5)
+        with _pooled_session(host) as session:
+            r = session.get(url=health_url, timeout=5)
         if r.status_code == 200:
             return 'ready'
         # Process is accepting connections but /health says not-ready: graph still loading.
@@ -129,13 +1119,13 @@ def _probe_ors_state(ors_host=None):
         return 'unknown'
 
 
-def _get_ors_status(ors_host=None):
-    host = ors_host or resolve_ors_host(None)
+def _fetch_ors_status(host):
     try:
         status_url = f'http://{host}:{ORS_PORT}{ORS_API_PATH}/status'
         logger.info(f'Querying ORS status: {status_url}')
-        r = requests.get(url=status_url, timeout=10)
-        status_data = r.json()
+        with _pooled_session(host) as session:
+            r = session.get(url=status_url, timeout=10)
+            status_data = r.json()
 
         bounds_info = {}
         if 'profiles' in status_data:
@@ -155,7 +1145,7 @@ def _get_ors_status(ors_host=None):
         return status_data
     except requests.exceptions.ConnectionError:
         # Differentiate warming-up vs suspended/unknown by probing /health separately.
-        state = _probe_ors_state(host)
+        state = _probe_ors_health_state(host)
         if state == 'warming_up':
             logger.info(f'ORS at {host} is warming up - /health returned non-200 while loading graph')
             return {
@@ -187,7 +1177,222 @@ def _get_ors_status(ors_host=None):
         return {'error': str(e), 'service_ready': False, 'health_ready': False, 'ors_host': host}
 
 
-def _status_with_version(host=None):
+# ---------------------------------------------------------------------------
+# Cached region status.
+#
+# The provisioning poll loops call ORS_STATUS every few seconds per region,
+# and each call went to ORS twice (/status, then /health). Every
+# ConnectionError in get_ors_response probed /health again, and the cache
+# stamps (_graph_build_stamp) fetched /status on their own schedule. All of
+# these now read one per-host status cache:
+#   - a status read is served from the cache while it is younger than
+#     ORS_STATUS_TTL_S; concurrent misses share one fetch;
+#   - a fetch is published in the shared state db (ors_status) and a miss
+#     takes a recent enough status fetched by another worker from there;
+#   - a ConnectionError asks for a status fetched after the failing call
+#     started (`since`), so a burst of failures costs one probe, not one each;
+#   - cache stamps accept entries up to ORS_GRAPH_STAMP_TTL_S old.
+#
+# /ors_wait_ready (ORS_WAIT_READY in SQL) holds one request open until the
+# region reports service_ready or its timeout passes (at most
+# ORS_STATUS_WAIT_MAX_S), waking on every refresh. While a region has
+# waiters a daemon thread refreshes it every ORS_STATUS_REFRESH_S, and the
+# thread exits with the last waiter, so nothing keeps polling an idle ORS
+# that AUTO_SUSPEND should be allowed to stop. Of the workers refreshing a
+# region only the one holding its lease in ors_status (ORS_STATUS_LEASE_S)
+# goes to ORS; the others adopt what it publishes. A waiter holds a gunicorn
+# thread, so at most ORS_STATUS_MAX_WAITERS wait at once per worker; beyond
+# that the call answers immediately, like ORS_STATUS.
+# ---------------------------------------------------------------------------
+ORS_STATUS_TTL_S = float(os.getenv('ORS_STATUS_TTL_S', '5'))
+ORS_STATUS_REFRESH_S = float(os.getenv('ORS_STATUS_REFRESH_S', '5'))
+ORS_STATUS_LEASE_S = float(os.getenv('ORS_STATUS_LEASE_S', '20'))
+ORS_STATUS_WAIT_MAX_S = int(os.getenv('ORS_STATUS_WAIT_MAX_S', '280'))
+ORS_STATUS_MAX_WAITERS = int(os.getenv(
+    'ORS_STATUS_MAX_WAITERS', str(ASYNC_HOST_CONCURRENCY if ASYNC_MODE else max(1, GUNICORN_THREADS // 2))))
+
+_STATUS_CACHE = {}  # host -> {status: dict, fetched_at (monotonic), fetching: bool}
+_STATUS_COND = threading.Condition()
+# pid running the refresher thread; host -> requests waiting in _wait_ors_ready.
+_STATUS_REFRESHER = {'pid': None, 'waiters': {}}
+
+
+def _status_shared_read(host):
+    with _state_txn(write=False) as conn:
+        row = conn.execute('SELECT status, fetched_at FROM ors_status WHERE host = ? AND status IS NOT NULL',
+                           (host,)).fetchone()
+    return (json.loads(row[0]), row[1]) if row else None
+
+
+def _status_shared_publish(host, status, fetched_at):
+    with _state_txn() as conn:
+        conn.execute('INSERT INTO ors_status (host, status, fetched_at, fetcher, lease_until) '
+                     'VALUES (?, ?, ?, NULL, 0) ON CONFLICT (host) DO UPDATE SET '
+                     'status = excluded.status, fetched_at = excluded.fetched_at, fetcher = NULL, lease_until = 0',
+                     (host, json.dumps(status), fetched_at))
+
+
+def _status_shared_claim(host, max_age):
+    """(claimed, (status, fetched_at) or None): a row fresher than `max_age`
+    is returned instead of a claim; a live lease of another worker refuses it."""
+    now, pid = time.time(), os.getpid()
+    with _state_txn() as conn:
+        row = conn.execute('SELECT status, fetched_at, fetcher, lease_until FROM ors_status WHERE host = ?',
+                           (host,)).fetchone()
+        if row and row[0] is not None and now - row[1] < max_age:
+            return False, (json.loads(row[0]), row[1])
+        if row and row[3] > now and row[2] not in (None, pid) and _pid_alive(row[2]):
+            return False, None
+        conn.execute('INSERT INTO ors_status (host, status, fetched_at, fetcher, lease_until) '
+                     'VALUES (?, NULL, 0, ?, ?) ON CONFLICT (host) DO UPDATE SET '
+                     'fetcher = excluded.fetcher, lease_until = excluded.lease_until',
+                     (host, pid, now + ORS_STATUS_LEASE_S))
+    return True, None
+
+
+def _status_adopt(host, status, fetched_wall):
+    """Take a status another worker fetched (wall-clock `fetched_wall`) into
+    the local cache if it is newer; returns its monotonic fetch time."""
+    fetched_at = time.monotonic() - max(0.0, time.time() - fetched_wall)
+    with _STATUS_COND:
+        entry = _STATUS_CACHE.setdefault(host, {'status': None, 'fetched_at': 0.0, 'fetching': False})
+        if entry['status'] is None or fetched_at > entry['fetched_at']:
+            entry['status'], entry['fetched_at'] = status, fetched_at
+            _STATUS_COND.notify_all()
+    return fetched_at
+
+
+def _status_refresh(host):
+    """One background refresh of `host`. Only the worker holding the host's
+    lease in the shared state fetches; the others adopt what it publishes."""
+    try:
+        claimed, row = _state_call(_status_shared_claim, host, ORS_STATUS_REFRESH_S)
+    except sqlite3.Error:
+        claimed, row = True, None
+    if row is not None:
+        _status_adopt(host, *row)
+    elif claimed:
+        _get_ors_status(host, since=time.monotonic())
+
+
+def _status_refresher_loop():
+    while True:
+        time.sleep(ORS_STATUS_REFRESH_S)
+        with _STATUS_COND:
+            hosts = [host for host, waiters in _STATUS_REFRESHER['waiters'].items() if waiters]
+            if not hosts:
+                # Nobody waits: stop, so an idle region is left alone.
+                _STATUS_REFRESHER['pid'] = None
+                return
+        for host in hosts:
+            try:
+                _status_refresh(host)
+            except Exception as e:
+                logger.error(f'ORS status refresh failed for {host}: {e}')
+
+
+def _get_ors_status(ors_host=None, max_age=None, since=None):
+    """Status of `ors_host` from the cache: fetched less than `max_age`
+    (default ORS_STATUS_TTL_S) seconds ago and, with `since`, no earlier than
+    that monotonic time. Otherwise taken from the shared state when another
+    worker fetched it recently enough, or fetched, once for all concurrent
+    callers. Returns a copy the caller may modify."""
+    host = ors_host or resolve_ors_host(None)
+    max_age = ORS_STATUS_TTL_S if max_age is None else max_age
+    with _STATUS_COND:
+        entry = _STATUS_CACHE.setdefault(host, {'status': None, 'fetched_at': 0.0, 'fetching': False})
+        while True:
+            fetched_at = entry['fetched_at']
+            fresh = entry['status'] is not None and time.monotonic() - fetched_at < max_age
+            if fresh and (since is None or fetched_at >= since):
+                return dict(entry['status'])
+            if not entry['fetching']:
+                break
+            _STATUS_COND.wait()
+        entry['fetching'] = True
+    started = time.monotonic()
+    status = fetched_at = None
+    try:
+        try:
+            shared = _state_call(_status_shared_read, host)
+        except sqlite3.Error:
+            shared = None
+        if shared is not None:
+            status, fetched_wall = shared
+            fetched_at = time.monotonic() - max(0.0, time.time() - fetched_wall)
+            if started - fetched_at >= max_age or (since is not None and fetched_at < since):
+                status = None
+        if status is None:
+            status, fetched_at = _fetch_ors_status(host), started
+            try:
+                _state_call(_status_shared_publish, host, status, time.time() - (time.monotonic() - started))
+            except sqlite3.Error:
+                pass
+    finally:
+        with _STATUS_COND:
+            entry['fetching'] = False
+            if status is not None and (entry['status'] is None or fetched_at >= entry['fetched_at']):
+                entry['status'] = status
+                entry['fetched_at'] = fetched_at
+            _STATUS_COND.notify_all()
+    return dict(status)
+
+
+def _probe_ors_state(ors_host=None, since=None):
+    """'ready' | 'warming_up' | 'unreachable' | 'unknown' for `ors_host`, read
+    from the status cache (a fetch no earlier than `since` when given)."""
+    status = _get_ors_status(ors_host, since=since)
+    error = status.get('error')
+    if error is None:
+        return 'ready' if status.get('health_ready') else 'warming_up'
+    if error == 'service_warming_up':
+        return 'warming_up'
+    if error in ('service_unreachable', 'timeout'):
+        return 'unreachable'
+    return 'unknown'
+
+
+def _wait_ors_ready(host, timeout_s):
+    """Block until `host` reports service_ready or `timeout_s` passes; returns
+    the last status with `waited_s` (and `wait_timed_out` when not ready)."""
+    t0 = time.monotonic()
+    deadline = t0 + max(0.0, min(float(timeout_s), ORS_STATUS_WAIT_MAX_S))
+    waiters = _STATUS_REFRESHER['waiters']
+    with _STATUS_COND:
+        admitted = sum(waiters.values()) < ORS_STATUS_MAX_WAITERS
+        if admitted:
+            waiters[host] = waiters.get(host, 0) + 1
+            start = _STATUS_REFRESHER['pid'] != os.getpid()
+            if start:
+                _STATUS_REFRESHER['pid'] = os.getpid()
+    if not admitted:
+        deadline = t0
+    elif start:
+        threading.Thread(target=_status_refresher_loop, name='ors-status-refresher', daemon=True).start()
+    try:
+        status = _get_ors_status(host)
+        while not status.get('service_ready'):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with _STATUS_COND:
+                # Woken by the refresher (or any other fetch) landing; only
+                # the refresher goes to ORS while we wait.
+                _STATUS_COND.wait(min(remaining, ORS_STATUS_REFRESH_S))
+                status = dict(_STATUS_CACHE[host]['status'])
+    finally:
+        if admitted:
+            with _STATUS_COND:
+                waiters[host] -= 1
+                if not waiters[host]:
+                    del waiters[host]
+    status['waited_s'] = round(time.monotonic() - t0, 1)
+    if not status.get('service_ready'):
+        status['wait_timed_out'] = True
+    return status
+
+
+def _status_with_version(host=None, status=None):
     # Always attach the gateway's baked build version to the status payload.
     # GATEWAY_VERSION is compiled into the image, so this is the reliable
     # stale-image detector: a cached old image reports the old version even when
@@ -195,7 +1400,8 @@ def _status_with_version(host=None):
     # and does not re-pull an unchanged tag). Surfaced to SQL via ORS_STATUS.
     # Injected here (not inside _get_ors_status) so it is present regardless of
     # ORS graph state - the probe tests the gateway process, not ORS readiness.
-    status = _get_ors_status(host)
+    if status is None:
+        status = _get_ors_status(host)
     if isinstance(status, dict):
         status['gateway_version'] = GATEWAY_VERSION
     return status
@@ -224,6 +1430,35 @@ def post_ors_status():
     return _make_response(output_rows)
 
 
+@app.post("/ors_wait_ready")
+def post_ors_wait_ready():
+    """
+    row = [id, region, timeout_s]  -- region can be NULL, timeout_s defaults to 120
+
+    Rows wait concurrently, and every row's timeout_s counts from the start of
+    the batch, so a batch waits at most its longest timeout_s, not their sum.
+    """
+    message = request.json
+    logger.debug(f'Received wait-ready request: {message}')
+    input_rows = _parse_rows(message)
+    if not input_rows:
+        return {}
+    t0 = time.monotonic()
+
+    def host_of(row):
+        return resolve_ors_host(_extract_region(row, 1))
+
+    def process_row(row):
+        try:
+            timeout_s = float(row[2]) if len(row) > 2 and row[2] is not None else 120.0
+        except (TypeError, ValueError):
+            timeout_s = 120.0
+        remaining = max(0.0, timeout_s - (time.monotonic() - t0))
+        return [row[0], _status_with_version(status=_wait_ors_ready(host_of(row), remaining))]
+
+    return _make_response(_map_rows('ors_wait_ready', input_rows, process_row, host_of))
+
+
 @app.get("/r/health/<region>")
 def region_health(region):
     host = resolve_ors_host(region)
@@ -236,34 +1471,280 @@ def region_health(region):
     }
 
 
-def _compute_matrices_from_ors(locations, profile, ors_host):
-    body = {
-        'locations': locations,
-        'metrics': ['distance', 'duration'],
-    }
-    endpoint = f'{ORS_API_PATH}/matrix/{profile}'
-    if not endpoint.startswith('/'):
-        endpoint = '/' + endpoint
-    url = f'http://{ors_host}:{ORS_PORT}{endpoint}'
-    # Tighter timeout (was 120s). Continental graphs can routinely exceed 120s
-    # for a 200x200 matrix, and the silent fallback to per-leg VROOM routing
-    # turns into a multi-minute apparent hang at the OPTIMIZATION TVF caller.
-    # 45s is enough for any well-sized request (the UI now caps at ~50
-    # locations) and lets us surface a clear error fast.
-    timeout_s = int(os.getenv('ORS_TIMEOUT_MATRIX_PRECOMPUTE', '45'))
-    logger.info(f'Pre-computing matrix from regional ORS: {url} with {len(locations)} locations (timeout={timeout_s}s)')
-    try:
-        r = requests.post(url=url, headers={'Content-Type': 'application/json'}, json=body, timeout=timeout_s)
-        data = r.json()
-        if 'durations' in data and 'distances' in data:
-            durations = [[round(v) if v is not None else 0 for v in row] for row in data['durations']]
-            costs = [[round(v) if v is not None else 0 for v in row] for row in data['distances']]
-            return {'durations': durations, 'costs': costs}
+# ---------------------------------------------------------------------------
+# Matrix hot path on typed arrays.
+#
+# The OPTIMIZATION pre-compute rounded every cell of the ORS matrix (and
+# filled unroutable `null` cells with 0) in nested list comprehensions,
+# calling round() once per float. That now runs as one vectorized pass over
+# a float64 array (null -> NaN -> 0).
+#
+# Chunk stitching and tile assembly deliberately stay on lists: their input
+# arrives as parsed JSON lists and leaves as JSON lists, so converting to
+# arrays and back costs more than the row-wise extend / slice assignment it
+# replaces (see benchmarks/gateway-matrix).
+# ---------------------------------------------------------------------------
+def _matrix_array(rows):
+    """ORS matrix rows -> 2-D float64 array, None (unroutable) -> NaN."""
+    arr = np.array(rows or [], dtype=np.float64)
+    if arr.ndim != 2:
+        arr = arr.reshape(len(rows or []), -1) if arr.size else np.empty((0, 0))
+    return arr
+
+
+def _rounded_matrix(rows):
+    """Integer matrix for a VROOM custom matrix: rounded half-to-even like
+    round(), unroutable cells filled with 0."""
+    return np.rint(np.nan_to_num(_matrix_array(rows), nan=0.0)).astype(np.int64).tolist()
+
+
+# ---------------------------------------------------------------------------
+# Compact binary matrix format: /matrix/binary and /matrix_tabular/binary.
+#
+# A 200x200 MATRIX answer carries ~80k floats as JSON text that the gateway
+# renders, Snowflake parses into a VARIANT and the consumer parses again.
+# With the `binary` format the gateway still asks ORS for json, then replaces
+# `durations` and `distances` with base64 of row-major little-endian uint32
+# arrays (whole seconds / whole meters, rounded half-to-even like
+# _rounded_matrix) and adds `shape` = [sources, destinations]. Unroutable
+# cells, and cells of failed tiles or chunks, hold MATRIX_BINARY_MISSING.
+# sources, destinations, metadata, _partial / failed_tiles /
+# failed_destinations and error answers pass through unchanged. Consumers decode with
+#   np.frombuffer(base64.b64decode(s), '<u4').reshape(shape)
+# The ORS call, the matrix cache and the cell store are untouched: packing
+# is the last step before the row is serialized.
+# ---------------------------------------------------------------------------
+MATRIX_BINARY_FORMAT = 'binary'
+MATRIX_BINARY_MISSING = 0xFFFFFFFF
+
+
+def _ors_matrix_format(format):
+    """Gateway output format -> the format requested from ORS."""
+    return 'json' if format == MATRIX_BINARY_FORMAT else format
+
+
+def _matrix_uint32(rows):
+    arr = _matrix_array(rows)
+    missing = np.isnan(arr)
+    out = np.clip(np.rint(np.nan_to_num(arr, nan=0.0)), 0, MATRIX_BINARY_MISSING - 1).astype('<u4')
+    out[missing] = MATRIX_BINARY_MISSING
+    return out
+
+
+def _pack_matrix(resp):
+    """ORS-shaped matrix answer -> binary format; anything else unchanged."""
+    if not isinstance(resp, dict) or 'error' in resp:
+        return resp
+    keys = [k for k in ('durations', 'distances') if isinstance(resp.get(k), list)]
+    if not keys:
+        return resp
+    packed = dict(resp)
+    with _span('matrix.pack'):
+        for key in keys:
+            arr = _matrix_uint32(resp[key])
+            packed[key] = base64.b64encode(arr.tobytes()).decode('ascii')
+            packed['shape'] = list(arr.shape)
+    packed['dtype'] = 'uint32le'
+    packed['missing'] = MATRIX_BINARY_MISSING
+    return packed
+
+
+# ---------------------------------------------------------------------------
+# Matrix result cache.
+#
+# /matrix, /matrix_tabular and the OPTIMIZATION matrix pre-compute resend the
+# same location sets over and over (dashboard refreshes, agent retries).
+# Successful ORS matrix responses are kept as raw response bytes in an
+# in-process LRU keyed by a hash of (host, profile, format, normalized body),
+# so a repeat is parsed from memory instead of recomputed by ORS.
+#
+# Each entry is stamped with the profile's graph_build_date from
+# the cached region status (at most ORS_GRAPH_STAMP_TTL_S old).
+# A rebuilt graph changes the stamp and makes every older entry for that
+# host/profile stale. When the build date cannot be read (ORS unreachable or
+# warming up) the cache is neither read nor written.
+#
+#   MATRIX_CACHE_MAX_BYTES   default 64 MiB per worker; 0 disables the cache
+#   MATRIX_CACHE_TTL_S       default 3600
+#   ORS_GRAPH_STAMP_TTL_S    default 60
+#
+# Per-request bypass: ?cache=bypass, header `X-Gateway-Cache: bypass`, or
+# options.cache=false on /matrix. Bypass skips the lookup; the fresh result
+# still replaces the cached entry. Hit / miss / eviction counts go to the
+# [ORS_METRIC] stream as a `matrix_cache` event, and every hit also emits the
+# usual per-call metric with a `.cache_hit` caller suffix.
+# ---------------------------------------------------------------------------
+MATRIX_CACHE_MAX_BYTES = int(os.getenv('MATRIX_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+MATRIX_CACHE_TTL_S = int(os.getenv('MATRIX_CACHE_TTL_S', '3600'))
+MATRIX_CACHE_METRIC_INTERVAL_S = int(os.getenv('MATRIX_CACHE_METRIC_INTERVAL_S', '60'))
+ORS_GRAPH_STAMP_TTL_S = int(os.getenv('ORS_GRAPH_STAMP_TTL_S', '60'))
+
+_MATRIX_CACHE = OrderedDict()  # key -> {raw: bytes, stamp, expires_at}
+_MATRIX_CACHE_STATE = {'bytes': 0, 'hits': 0, 'misses': 0, 'evictions': 0, 'last_emit': time.monotonic()}
+_MATRIX_CACHE_LOCK = threading.Lock()
+
+
+def _graph_build_stamp(host, profile):
+    """graph_build_date of `profile` on `host`, or None when unknown."""
+    status = _get_ors_status(host, max_age=ORS_GRAPH_STAMP_TTL_S)
+    info = (status.get('bounds_info') or {}).get(profile) or {}
+    return info.get('graph_build_date')
+
+
+def _matrix_cache_key(host, profile, format, body):
+    if not isinstance(body, dict):
+        return None
+    normalized = dict(body)
+    try:
+        normalized['locations'] = [[round(float(c), 6) for c in loc] for loc in body.get('locations') or []]
+    except (TypeError, ValueError):
+        return None
+    if isinstance(normalized.get('metrics'), list):
+        normalized['metrics'] = sorted(normalized['metrics'])
+    raw = json.dumps([host, profile, format, normalized], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _cache_bypass_requested():
+    """True when the inbound request asked to skip the gateway caches."""
+    flag = (request.args.get('cache') or request.headers.get('X-Gateway-Cache') or '').strip().lower()
+    return flag in ('bypass', 'false', 'off', 'no', '0')
+
+
+def _flush_matrix_cache_metric():
+    now = time.monotonic()
+    with _MATRIX_CACHE_LOCK:
+        st = _MATRIX_CACHE_STATE
+        if now - st['last_emit'] < MATRIX_CACHE_METRIC_INTERVAL_S:
+            return
+        counts = {
+            'cache_hits': st['hits'],
+            'cache_misses': st['misses'],
+            'cache_evictions': st['evictions'],
+            'cache_entries': len(_MATRIX_CACHE),
+            'cache_bytes': st['bytes'],
+        }
+        st['hits'] = st['misses'] = st['evictions'] = 0
+        st['last_emit'] = now
+    _emit_metric('matrix_cache', None, None, 200, 0, None, None,
+                 caller='matrix_cache', extra=counts)
+
+
+def _matrix_cache_lookup(host, profile, format, body, use_cache=True):
+    """Returns (key, stamp, cached_bytes). key is None when the response must
+    not be cached at all; cached_bytes is None on a miss or a bypass."""
+    if MATRIX_CACHE_MAX_BYTES <= 0:
+        return None, None, None
+    stamp = _graph_build_stamp(host, profile)
+    key = _matrix_cache_key(host, profile, format, body) if stamp is not None else None
+    if key is None:
+        return None, None, None
+    cached = None
+    if use_cache:
+        now = time.monotonic()
+        with _MATRIX_CACHE_LOCK:
+            entry = _MATRIX_CACHE.get(key)
+            if entry and (entry['stamp'] != stamp or entry['expires_at'] <= now):
+                _MATRIX_CACHE.pop(key)
+                _MATRIX_CACHE_STATE['bytes'] -= len(entry['raw'])
+                _MATRIX_CACHE_STATE['evictions'] += 1
+                entry = None
+            if entry:
+                _MATRIX_CACHE.move_to_end(key)
+                _MATRIX_CACHE_STATE['hits'] += 1
+                cached = entry['raw']
+            else:
+                _MATRIX_CACHE_STATE['misses'] += 1
+        _flush_matrix_cache_metric()
+    return key, stamp, cached
+
+
+def _matrix_cache_store(key, stamp, raw):
+    # A single entry may take at most a quarter of the budget so one huge
+    # matrix cannot flush everything else.
+    if key is None or not raw or len(raw) > MATRIX_CACHE_MAX_BYTES // 4:
+        return
+    with _MATRIX_CACHE_LOCK:
+        old = _MATRIX_CACHE.pop(key, None)
+        if old:
+            _MATRIX_CACHE_STATE['bytes'] -= len(old['raw'])
+        _MATRIX_CACHE[key] = {'raw': raw, 'stamp': stamp, 'expires_at': time.monotonic() + MATRIX_CACHE_TTL_S}
+        _MATRIX_CACHE_STATE['bytes'] += len(raw)
+        while _MATRIX_CACHE_STATE['bytes'] > MATRIX_CACHE_MAX_BYTES and _MATRIX_CACHE:
+            _, evicted = _MATRIX_CACHE.popitem(last=False)
+            _MATRIX_CACHE_STATE['bytes'] -= len(evicted['raw'])
+            _MATRIX_CACHE_STATE['evictions'] += 1
+
+
+def _compute_matrices_from_ors(locations, profile, ors_host, use_cache=True):
+    body = {
+        'locations': locations,
+        'metrics': ['distance', 'duration'],
+    }
+    endpoint = f'{ORS_API_PATH}/matrix/{profile}'
+    if not endpoint.startswith('/'):
+        endpoint = '/' + endpoint
+    url = f'http://{ors_host}:{ORS_PORT}{endpoint}'
+    # Tighter timeout (was 120s). Continental graphs can routinely exceed 120s
+    # for a 200x200 matrix, and the silent fallback to per-leg VROOM routing
+    # turns into a multi-minute apparent hang at the OPTIMIZATION TVF caller.
+    # 45s is enough for any well-sized request (the UI now caps at ~50
+    # locations) and lets us surface a clear error fast.
+    timeout_s = int(os.getenv('ORS_TIMEOUT_MATRIX_PRECOMPUTE', '45'))
+    logger.info(f'Pre-computing matrix from regional ORS: {url} with {len(locations)} locations (timeout={timeout_s}s)')
+    bound = False
+    try:
+        cache_key, cache_stamp, cached = _matrix_cache_lookup(ors_host, profile, None, body, use_cache)
+        if cached is not None:
+            logger.info(f'Matrix pre-compute served from cache for {ors_host} ({len(locations)} locations)')
+            data = _json_decode(cached)
+        else:
+            # The heaviest ORS call of the gateway: it takes a matrix-lane
+            # slot and answers to that lane's breaker like every other call.
+            lane = _lane_of('matrix')
+            allow, _ = _breaker_check(ors_host, lane)
+            if not allow:
+                logger.error(f'Matrix pre-compute on {ors_host} refused: circuit breaker open')
+                return {'__error__': f'circuit breaker is open for matrix calls to {ors_host}; '
+                                     f'retry after the {ORS_BREAKER_COOLDOWN_S}s cooldown'}
+            req = _json_encode(body)
+            call_timeout_s, bound = _deadline_timeout(timeout_s)
+            t0 = time.monotonic()
+            try:
+                with _host_slot(ors_host, lane) as slot, _pooled_session(ors_host) as session, \
+                        _span('ors.http', host=ors_host, function='matrix'):
+                    slot['deadline_bound'] = bound
+                    r = session.post(url=url, headers=JSON_HEADERS, data=req, timeout=call_timeout_s)
+                    raw = r.content
+                    slot['overloaded'] = r.status_code >= 500
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                timed_out = isinstance(e, requests.exceptions.Timeout)
+                if not (timed_out and bound):
+                    _breaker_on_failure(ors_host, lane)
+                    _emit_metric('matrix', profile, ors_host, 504 if timed_out else 502,
+                                 int((time.monotonic() - t0) * 1000), len(req), None,
+                                 error_code='timeout' if timed_out else 'service_unreachable',
+                                 caller='matrix_precompute')
+                raise
+            _emit_metric('matrix', profile, ors_host, r.status_code, int((time.monotonic() - t0) * 1000),
+                         len(req), len(raw), caller='matrix_precompute')
+            if r.status_code >= 500:
+                _breaker_on_failure(ors_host, lane)
+            else:
+                _breaker_on_success(ors_host, lane)
+            data = _json_decode(raw)
+            if r.status_code == 200 and 'durations' in data and 'distances' in data:
+                _matrix_cache_store(cache_key, cache_stamp, raw)
+        if 'durations' in data and 'distances' in data:
+            return {'durations': _rounded_matrix(data['durations']), 'costs': _rounded_matrix(data['distances'])}
         if 'error' in data:
             logger.error(f'ORS matrix error: {data}')
             return {'__error__': data.get('error') or data}
         return None
-    except requests.exceptions.Timeout:
+    except (requests.exceptions.Timeout, DeadlineExceeded) as e:
+        if bound or isinstance(e, DeadlineExceeded):
+            logger.error(f'ORS matrix pre-compute on {ors_host} abandoned at the request deadline')
+            return {'__error__': f'matrix pre-compute on {ors_host} abandoned at the request deadline'}
         logger.error(f'ORS matrix pre-compute timed out on {ors_host} after {timeout_s}s')
         return {'__error__': f'matrix pre-compute timed out after {timeout_s}s on {ors_host}'}
     except Exception as e:
@@ -328,7 +1809,17 @@ def _remap_indices(jobs, vehicles, indices, shipments=None):
                     sub['location_index'] = indices[t]
 
 
-def _handle_optimization_tabular(input_rows, ors_host_override=None, vroom_host_override=None, want_geometry=True):
+def _handle_optimization_tabular(input_rows, ors_host_override=None, vroom_host_override=None, want_geometry=True,
+                                 use_cache=True, encoded_geometry=False):
+    return _map_rows(
+        'optimization', input_rows,
+        lambda row: _solve_optimization_row(row, ors_host_override, vroom_host_override, want_geometry, use_cache,
+                                            encoded_geometry),
+        lambda row: vroom_host_override or resolve_vroom_host(None))
+
+
+def _solve_optimization_row(row, ors_host_override=None, vroom_host_override=None, want_geometry=True,
+                            use_cache=True, encoded_geometry=False):
     # want_geometry: when False, the gateway does NOT reconstruct per-route road
     # geometry after the VROOM solve. VROOM is always asked with options.g=False
     # when a matrix is pre-computed, so without reconstruction the routes come
@@ -337,10 +1828,11 @@ def _handle_optimization_tabular(input_rows, ors_host_override=None, vroom_host_
     # routes. Callers that render the solve geometry directly (or omit options.g)
     # get the default True and unchanged behavior; callers that fetch the drawn
     # route lazily via DIRECTIONS (e.g. Backload Proposals) send options.g=False.
+    # encoded_geometry: return route geometry as encoded polylines instead of
+    # [[lon, lat], ...] (see _decode_polyline).
     _collected_locs = []
 
     def build_vroom_payload(row):
-        _collected_locs.clear()
         vehicles = row[2]
         for v in vehicles:
             if isinstance(v, dict) and 'profile' not in v:
@@ -368,7 +1860,8 @@ def _handle_optimization_tabular(input_rows, ors_host_override=None, vroom_host_
                     break
             locs, loc_indices = _collect_locations(jobs, vehs, shps)
             if len(locs) >= 2:
-                computed = _compute_matrices_from_ors(locs, profile, ors_host_override)
+                with _span('matrix_precompute', locations=len(locs)):
+                    computed = _compute_matrices_from_ors(locs, profile, ors_host_override, use_cache=use_cache)
                 if isinstance(computed, dict) and computed.get('__error__'):
                     # Surface a structured error to the OPTIMIZATION caller
                     # instead of silently dropping the matrices and letting
@@ -393,45 +1886,306 @@ def _handle_optimization_tabular(input_rows, ors_host_override=None, vroom_host_
             payload['options'] = {'g': False}
         return payload
 
-    results = []
-    for row in input_rows:
-        payload = build_vroom_payload(row)
-        if payload.get('__matrix_error__'):
-            results.append([row[0], {
-                'code': 99,
-                'error': 'matrix_precompute_failed',
-                'message': payload['__matrix_error__'],
-                'hint': 'Try again after the ORS graph is fully loaded, or reduce the number of unique locations (lower vehicle/shipment caps).',
-            }])
+    payload = build_vroom_payload(row)
+    if payload.get('__matrix_error__'):
+        return [row[0], {
+            'code': 99,
+            'error': 'matrix_precompute_failed',
+            'message': payload['__matrix_error__'],
+            'hint': 'Try again after the ORS graph is fully loaded, or reduce the number of unique locations (lower vehicle/shipment caps).',
+        }]
+    with _span('vroom'):
+        resp = get_vroom_response(payload, vroom_host=vroom_host_override, encoded_geometry=encoded_geometry)
+    if 'routes' in resp and isinstance(resp.get('routes'), list):
+        if want_geometry:
+            if ors_host_override:
+                needs_geo = any('geometry' not in r for r in resp['routes'])
+                if needs_geo:
+                    profile = 'driving-car'
+                    for v in (row[2] if len(row) > 2 else []):
+                        if isinstance(v, dict) and 'profile' in v:
+                            profile = v['profile']
+                            break
+                    with _span('geometry', routes=len(resp['routes'])):
+                        _reconstruct_geometry(resp['routes'], profile, ors_host_override, list(_collected_locs),
+                                              use_cache=use_cache)
+                    if encoded_geometry:
+                        for r in resp['routes']:
+                            if isinstance(r, dict) and isinstance(r.get('geometry'), list):
+                                r['geometry'] = _encode_polyline(r['geometry'])
+        else:
+            # Client opted out of geometry (options.g=false). VROOM/vroom-express
+            # can still emit an encoded route geometry even when the payload sets
+            # options.g=false, and get_vroom_response DECODES it into a full
+            # [[lon,lat],...] array - which for a large region is exactly what
+            # blows the _OPTIMIZATION_RAW 20MB response cap. Strip it here so the
+            # response is compact; the client redraws the selected route lazily
+            # via ORS DIRECTIONS.
+            for r in resp['routes']:
+                if isinstance(r, dict):
+                    r.pop('geometry', None)
+    return [row[0], resp]
+
+
+# ---------------------------------------------------------------------------
+# Leg geometry cache.
+#
+# The same stop sequences get routed again and again: the Backload Proposals
+# UI draws each route lazily through DIRECTIONS after an options.g=false
+# solve, and _reconstruct_geometry re-routes legs that earlier solves already
+# routed. Every leg (consecutive coordinate pair) of a successful ORS
+# directions response is kept in an in-process LRU keyed by
+# (host, profile, from, to) -- the host stands in for the region -- with its
+# geometry slice, summary and segment. A multi-stop route is then assembled
+# from cached legs and ORS is called only for the contiguous runs of legs
+# that are missing. ORS routes every leg between via points independently,
+# so the assembled route matches the one-call answer.
+#
+# Entries carry the profile's graph_build_date (_graph_build_stamp, shared
+# with the matrix cache); a rebuilt graph makes them stale. Only plain
+# geojson requests ({"coordinates": [...]} and nothing else) go through the
+# cache -- any routing option can change the geometry. A route fetched
+# entirely from ORS is returned exactly as ORS sent it.
+#
+#   LEG_CACHE_MAX_POINTS   default 500000 geometry points per worker;
+#                          0 disables the cache
+#
+# ?cache=bypass / `X-Gateway-Cache: bypass` skips the lookup (fresh legs are
+# still stored). Hits, misses and the hit rate go to the [ORS_METRIC] stream
+# as a `leg_cache` event every LEG_CACHE_METRIC_INTERVAL_S.
+# ---------------------------------------------------------------------------
+LEG_CACHE_MAX_POINTS = int(os.getenv('LEG_CACHE_MAX_POINTS', '500000'))
+LEG_CACHE_METRIC_INTERVAL_S = int(os.getenv('LEG_CACHE_METRIC_INTERVAL_S', '60'))
+
+_LEG_CACHE = OrderedDict()  # (host, profile, from, to) -> {stamp, coords, segment, metadata}
+_LEG_CACHE_STATE = {'points': 0, 'hits': 0, 'misses': 0, 'evictions': 0, 'last_emit': time.monotonic()}
+_LEG_CACHE_LOCK = threading.Lock()
+
+
+def _leg_point(location):
+    return round(float(location[0]), 6), round(float(location[1]), 6)
+
+
+def _flush_leg_cache_metric():
+    now = time.monotonic()
+    with _LEG_CACHE_LOCK:
+        st = _LEG_CACHE_STATE
+        if now - st['last_emit'] < LEG_CACHE_METRIC_INTERVAL_S:
+            return
+        lookups = st['hits'] + st['misses']
+        counts = {
+            'cache_hits': st['hits'],
+            'cache_misses': st['misses'],
+            'cache_hit_rate': round(st['hits'] / lookups, 4) if lookups else None,
+            'cache_evictions': st['evictions'],
+            'cache_entries': len(_LEG_CACHE),
+            'cache_points': st['points'],
+        }
+        st['hits'] = st['misses'] = st['evictions'] = 0
+        st['last_emit'] = now
+    _emit_metric('leg_cache', None, None, 200, 0, None, None,
+                 caller='leg_cache', extra=counts)
+
+
+def _split_legs(resp, n_legs):
+    """Cut an ORS geojson directions response into n_legs cache entries
+    (geometry slice + segment with leg-relative step way_points), or None
+    when the response is not a clean n_legs route."""
+    try:
+        feature = resp['features'][0]
+        line = feature['geometry']['coordinates']
+        props = feature['properties']
+        way_points = props['way_points']
+        segments = props.get('segments') or []
+    except (KeyError, IndexError, TypeError):
+        return None
+    if len(way_points) != n_legs + 1 or len(segments) != n_legs:
+        return None
+    metadata = resp.get('metadata') if isinstance(resp, dict) else None
+    legs = []
+    for i in range(n_legs):
+        start, end = way_points[i], way_points[i + 1]
+        segment = dict(segments[i])
+        segment['steps'] = [dict(step, way_points=[p - start for p in step.get('way_points', [])])
+                            for step in segments[i].get('steps', [])]
+        legs.append({'coords': line[start:end + 1], 'segment': segment, 'metadata': metadata})
+    return legs
+
+
+def _route_from_legs(host, profile, coords, fetch, use_cache=True):
+    """Resolve the legs of `coords` from the cache, calling `fetch(sub_coords)`
+    (-> parsed ORS geojson response) once per contiguous run of missing legs.
+
+    Returns (legs, resp). legs is the per-leg list, or None when the route
+    could not be built; resp is the raw ORS response when the whole route
+    came from a single fetch (or the response that stopped assembly)."""
+    n_legs = len(coords) - 1
+    stamp = _graph_build_stamp(host, profile) if LEG_CACHE_MAX_POINTS > 0 else None
+    keys = [(host, profile, _leg_point(a), _leg_point(b)) for a, b in zip(coords, coords[1:])]
+    legs = [None] * n_legs
+    if stamp is not None and use_cache:
+        with _LEG_CACHE_LOCK:
+            for i, key in enumerate(keys):
+                entry = _LEG_CACHE.get(key)
+                if entry and entry['stamp'] != stamp:
+                    _LEG_CACHE.pop(key)
+                    _LEG_CACHE_STATE['points'] -= len(entry['coords'])
+                    _LEG_CACHE_STATE['evictions'] += 1
+                    entry = None
+                if entry:
+                    _LEG_CACHE.move_to_end(key)
+                    _LEG_CACHE_STATE['hits'] += 1
+                    legs[i] = entry
+                else:
+                    _LEG_CACHE_STATE['misses'] += 1
+        _flush_leg_cache_metric()
+
+    runs = []
+    for i, leg in enumerate(legs):
+        if leg is not None:
             continue
-        resp = get_vroom_response(payload, vroom_host=vroom_host_override)
-        if 'routes' in resp and isinstance(resp.get('routes'), list):
-            if want_geometry:
-                if ors_host_override:
-                    needs_geo = any('geometry' not in r for r in resp['routes'])
-                    if needs_geo:
-                        profile = 'driving-car'
-                        for v in (row[2] if len(row) > 2 else []):
-                            if isinstance(v, dict) and 'profile' in v:
-                                profile = v['profile']
-                                break
-                        _reconstruct_geometry(resp['routes'], profile, ors_host_override, list(_collected_locs))
-            else:
-                # Client opted out of geometry (options.g=false). VROOM/vroom-express
-                # can still emit an encoded route geometry even when the payload sets
-                # options.g=false, and get_vroom_response DECODES it into a full
-                # [[lon,lat],...] array - which for a large region is exactly what
-                # blows the _OPTIMIZATION_RAW 20MB response cap. Strip it here so the
-                # response is compact; the client redraws the selected route lazily
-                # via ORS DIRECTIONS.
-                for r in resp['routes']:
-                    if isinstance(r, dict):
-                        r.pop('geometry', None)
-        results.append([row[0], resp])
-    return results
-
-
-def _reconstruct_geometry(routes, profile, ors_host, locations=None):
+        if runs and runs[-1][1] == i - 1:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i])
+    resp = None
+    for first, last in runs:
+        resp = fetch(coords[first:last + 2])
+        fetched = _split_legs(resp, last - first + 1)
+        if fetched is None:
+            return None, resp
+        legs[first:last + 1] = fetched
+        if stamp is not None:
+            _leg_cache_store(keys[first:last + 1], stamp, fetched)
+    whole = runs == [[0, n_legs - 1]]
+    return legs, (resp if whole else None)
+
+
+def _leg_cache_store(keys, stamp, legs):
+    with _LEG_CACHE_LOCK:
+        for key, leg in zip(keys, legs):
+            old = _LEG_CACHE.pop(key, None)
+            if old:
+                _LEG_CACHE_STATE['points'] -= len(old['coords'])
+            _LEG_CACHE[key] = dict(leg, stamp=stamp)
+            _LEG_CACHE_STATE['points'] += len(leg['coords'])
+        while _LEG_CACHE_STATE['points'] > LEG_CACHE_MAX_POINTS and _LEG_CACHE:
+            _, evicted = _LEG_CACHE.popitem(last=False)
+            _LEG_CACHE_STATE['points'] -= len(evicted['coords'])
+            _LEG_CACHE_STATE['evictions'] += 1
+
+
+def _route_coordinates(legs):
+    line = []
+    for leg in legs:
+        line.extend(leg['coords'][1:] if line else leg['coords'])
+    return line
+
+
+def _assemble_directions(legs, coords):
+    """ORS-shaped geojson directions response built from cached legs."""
+    line, segments, way_points = [], [], [0]
+    for leg in legs:
+        offset = len(line) - 1 if line else 0
+        line.extend(leg['coords'][1:] if line else leg['coords'])
+        segment = dict(leg['segment'])
+        segment['steps'] = [dict(step, way_points=[p + offset for p in step.get('way_points', [])])
+                            for step in leg['segment'].get('steps', [])]
+        segments.append(segment)
+        way_points.append(len(line) - 1)
+    lons = [p[0] for p in line]
+    lats = [p[1] for p in line]
+    bbox = [min(lons), min(lats), max(lons), max(lats)] if line else []
+    metadata = dict(legs[0].get('metadata') or {})
+    metadata['query'] = dict(metadata.get('query') or {}, coordinates=coords)
+    metadata['timestamp'] = int(time.time() * 1000)
+    return {
+        'type': 'FeatureCollection',
+        'bbox': bbox,
+        'features': [{
+            'bbox': bbox,
+            'type': 'Feature',
+            'properties': {
+                'segments': segments,
+                'way_points': way_points,
+                'summary': {
+                    'distance': round(sum(s.get('distance', 0) for s in segments), 1),
+                    'duration': round(sum(s.get('duration', 0) for s in segments), 1),
+                },
+            },
+            'geometry': {'coordinates': line, 'type': 'LineString'},
+        }],
+        'metadata': metadata,
+    }
+
+
+def _leg_cacheable(body, format):
+    if format != 'geojson' or not isinstance(body, dict) or set(body) != {'coordinates'}:
+        return False
+    coords = body['coordinates']
+    if not isinstance(coords, list) or not 2 <= len(coords) <= GUARDRAIL_DIRECTIONS_MAX_WAYPOINTS:
+        return False
+    try:
+        return all(len(c) == 2 and _leg_point(c) for c in coords)
+    except (TypeError, ValueError):
+        return False
+
+
+def _directions(profile, body, format, host, region_hint=None, use_cache=True):
+    """DIRECTIONS through the leg cache; anything the cache cannot represent
+    goes straight to get_ors_response."""
+    if not _leg_cacheable(body, format):
+        return get_ors_response('directions', profile, body, format, host, region_hint=region_hint)
+    t0 = time.monotonic()
+    coords = body['coordinates']
+    legs, resp = _route_from_legs(
+        host, profile, coords,
+        lambda sub: get_ors_response('directions', profile, {'coordinates': sub}, format, host, region_hint=region_hint),
+        use_cache)
+    if resp is not None:
+        return resp
+    _emit_metric('directions', profile, host, 200, int((time.monotonic() - t0) * 1000), None, None,
+                 caller='request.leg_cache', region=region_hint, request_id=uuid.uuid4().hex)
+    return _assemble_directions(legs, coords)
+
+
+def _reconstruct_geometry(routes, profile, ors_host, locations=None, use_cache=True):
+    # One ORS directions call per route. The calls are independent, so they
+    # fan out on a pool as wide as the host's current limit and each holds one
+    # of the host's slots (_host_slot) like every other ORS call; a 50-vehicle solve
+    # no longer waits for 50 serial round trips. Legs already in the leg
+    # cache are not re-routed; only the missing runs go to ORS. A route whose
+    # call fails, or is not reached before the request deadline, keeps its
+    # straight-line step coordinates.
+    endpoint = f'{ORS_API_PATH}/directions/{profile}/geojson'
+    if not endpoint.startswith('/'):
+        endpoint = '/' + endpoint
+    url = f'http://{ors_host}:{ORS_PORT}{endpoint}'
+
+    def _fetch(coords):
+        timeout_s, bound = _deadline_timeout(30)
+        with _host_slot(ors_host) as slot, _pooled_session(ors_host) as session:
+            slot['deadline_bound'] = bound
+            r = session.post(url=url, headers=JSON_HEADERS, data=_json_encode({'coordinates': coords}),
+                             timeout=timeout_s)
+            raw = r.content
+            slot['overloaded'] = r.status_code >= 500
+        return _json_decode(raw)
+
+    def _route_geometry(route, coords):
+        try:
+            legs, data = _route_from_legs(ors_host, profile, coords, _fetch, use_cache)
+            if legs is not None:
+                return _route_coordinates(legs)
+            if isinstance(data, dict) and 'features' in data and len(data['features']) > 0:
+                geom = data['features'][0].get('geometry', {})
+                return geom.get('coordinates', coords)
+            return coords
+        except Exception as e:
+            logger.warning(f'Geometry reconstruction failed for route {route.get("vehicle")}: {e}')
+            return coords
+
+    pending = []
     for route in routes:
         if 'geometry' in route:
             continue
@@ -445,33 +2199,28 @@ def _reconstruct_geometry(routes, profile, ors_host, locations=None):
             if loc and isinstance(loc, list) and len(loc) == 2:
                 coords.append(loc)
         if len(coords) >= 2:
-            try:
-                body = {'coordinates': coords}
-                endpoint = f'{ORS_API_PATH}/directions/{profile}/geojson'
-                if not endpoint.startswith('/'):
-                    endpoint = '/' + endpoint
-                url = f'http://{ors_host}:{ORS_PORT}{endpoint}'
-                r = requests.post(url=url, headers={'Content-Type': 'application/json'}, json=body, timeout=30)
-                data = r.json()
-                if 'features' in data and len(data['features']) > 0:
-                    geom = data['features'][0].get('geometry', {})
-                    route['geometry'] = geom.get('coordinates', coords)
-                else:
-                    route['geometry'] = coords
-            except Exception as e:
-                logger.warning(f'Geometry reconstruction failed for route {route.get("vehicle")}: {e}')
-                route['geometry'] = coords
+            pending.append((route, coords))
         elif len(coords) == 1:
             route['geometry'] = [coords[0], coords[0]]
         else:
             route['geometry'] = []
 
+    if len(pending) > 1:
+        with ThreadPoolExecutor(max_workers=min(_host_limit(ors_host), len(pending))) as executor:
+            geometries = list(executor.map(_in_request_context(lambda item: _route_geometry(*item)), pending))
+    else:
+        geometries = [_route_geometry(route, coords) for route, coords in pending]
+    for (route, _), geometry in zip(pending, geometries):
+        route['geometry'] = geometry
+
 
 @app.post("/optimization_tabular")
+@_traced('optimization_tabular')
 def post_optimization_tabular():
     """
     row = [id, jobs, vehicles, matrices, region]
     region is the LAST column and can be NULL.
+    ?polyline=true returns route geometry as encoded polylines.
     """
     message = request.json
     logger.debug(f'Received request: {message}')
@@ -484,24 +2233,33 @@ def post_optimization_tabular():
     stripped_rows = []
     for row in input_rows:
         stripped_rows.append(row[:-1])
-    output_rows = _handle_optimization_tabular(stripped_rows, ors_host_override=ors_host, vroom_host_override=vroom_host)
+    output_rows = _handle_optimization_tabular(stripped_rows, ors_host_override=ors_host, vroom_host_override=vroom_host,
+                                               use_cache=not _cache_bypass_requested(),
+                                               encoded_geometry=_polyline_requested())
     logger.info(f'Produced {len(output_rows)} rows')
     return _make_response(output_rows)
 
 
 @app.post("/optimization")
+@_traced('optimization')
 def post_optimization():
     """
     row = [id, challenge, region]
     region is the LAST column and can be NULL.
+    options.polyline=true in the challenge (or ?polyline=true) returns route
+    geometry as encoded polylines; the key is gateway-only and is not
+    forwarded to VROOM.
     """
     message = request.json
     logger.debug(f'Received request: {message}')
     input_rows = _parse_rows(message)
     if not input_rows:
         return {}
-    output_rows = []
-    for row in input_rows:
+    use_cache = not _cache_bypass_requested()
+    polyline_requested = _polyline_requested()
+
+    def _process_row(row):
+        encoded_geometry = _pop_polyline_option(row[1], polyline_requested)
         region = _extract_region(row, -1)
         ors_host = resolve_ors_host(region) if region else None
         vroom_host = resolve_vroom_host(region) if region else None
@@ -516,25 +2274,27 @@ def post_optimization():
             want_geometry = True
             if isinstance(row[1], dict):
                 want_geometry = bool(row[1].get('options', {}).get('g', True))
-            tabular_rows = _handle_optimization_tabular(
-                [[row[0], row[1].get('jobs', []), row[1].get('vehicles', []), row[1].get('matrices', []), row[1].get('shipments', [])]],
+            return _solve_optimization_row(
+                [row[0], row[1].get('jobs', []), row[1].get('vehicles', []), row[1].get('matrices', []), row[1].get('shipments', [])],
                 ors_host_override=ors_host,
                 vroom_host_override=vroom_host,
                 want_geometry=want_geometry,
+                use_cache=use_cache,
+                encoded_geometry=encoded_geometry,
             )
-            output_rows.append(tabular_rows[0])
-        else:
-            output_rows.append([row[0], get_vroom_response(row[1])])
+        return [row[0], get_vroom_response(row[1], encoded_geometry=encoded_geometry)]
+
+    output_rows = _map_rows('optimization', input_rows, _process_row,
+                            lambda row: resolve_vroom_host(_extract_region(row, -1)))
     logger.info(f'Produced {len(output_rows)} rows')
     return _make_response(output_rows)
 
 
 def _handle_directions_tabular(input_rows, format, ors_host=None):
     host = ors_host or resolve_ors_host(None)
-    output_rows = []
-    for row in input_rows:
-        output_rows.append([row[0], get_ors_response('directions', row[1], {'coordinates': [row[2], row[3]]}, format, host)])
-    return output_rows
+    return _map_rows('directions', input_rows,
+                     lambda row: [row[0], _directions(row[1], {'coordinates': [row[2], row[3]]}, format, host)],
+                     lambda row: host)
 
 
 @app.post("/directions_tabular")
@@ -549,17 +2309,24 @@ def post_directions_tabular_with_format(format="geojson"):
     input_rows = _parse_rows(message)
     if not input_rows:
         return {}
-    output_rows = []
-    for row in input_rows:
+    use_cache = not _cache_bypass_requested()
+
+    def _process_row(row):
         region = _extract_region(row, 4)
         ors_host = resolve_ors_host(region)
-        output_rows.append([row[0], get_ors_response('directions', row[1], {'coordinates': [row[2], row[3]]}, format, ors_host)])
+        return [row[0], _directions(row[1], {'coordinates': [row[2], row[3]]}, format, ors_host,
+                                    region_hint=region, use_cache=use_cache)]
+
+    output_rows = _map_rows('directions', input_rows, _process_row,
+                            lambda row: resolve_ors_host(_extract_region(row, 4)))
     return _make_response(output_rows)
 
 
 def _handle_directions(input_rows, format, ors_host=None):
     host = ors_host or resolve_ors_host(None)
-    return [[row[0], get_ors_response('directions', row[1], row[2], format, host)] for row in input_rows]
+    return _map_rows('directions', input_rows,
+                     lambda row: [row[0], _directions(row[1], row[2], format, host)],
+                     lambda row: host)
 
 
 @app.post("/directions")
@@ -574,14 +2341,219 @@ def post_directions_with_format(format="geojson"):
     input_rows = _parse_rows(message)
     if not input_rows:
         return {}
-    output_rows = []
-    for row in input_rows:
+    use_cache = not _cache_bypass_requested()
+
+    def _process_row(row):
         region = _extract_region(row, 3)
         ors_host = resolve_ors_host(region)
-        output_rows.append([row[0], get_ors_response('directions', row[1], row[2], format, ors_host)])
+        return [row[0], _directions(row[1], row[2], format, ors_host,
+                                    region_hint=region, use_cache=use_cache)]
+
+    output_rows = _map_rows('directions', input_rows, _process_row,
+                            lambda row: resolve_ors_host(_extract_region(row, 3)))
     return _make_response(output_rows)
 
 
+# ---------------------------------------------------------------------------
+# Isochrone result cache.
+#
+# Catchment and emergency-response workloads ask for isochrones around the
+# same depots and POIs with the same ranges over and over, and each miss can
+# cost up to ORS_TIMEOUT_ISOCHRONES on a continental HGV graph. Isochrone
+# features are cached per location, keyed by (host, profile, range,
+# range_type, smoothing, snapped location) -- the host stands in for the
+# region. The location is snapped to an ISOCHRONE_CACHE_SNAP_M grid, so
+# points a few metres apart share the polygon of whichever one was computed
+# first; ORS itself always receives the caller's exact coordinates.
+#
+# A multi-location request is served from cached locations plus one ORS call
+# for the missing ones; the returned features are split back out by
+# group_index. A request computed entirely by ORS is returned exactly as ORS
+# sent it. Only the body keys the gateway itself builds (locations, range,
+# range_type, location_type=start, smoothing) are cacheable; anything else
+# goes straight through. Entries carry the graph_build_date stamp shared with
+# the matrix and leg caches and go stale when the graph is rebuilt.
+#
+#   ISOCHRONE_CACHE_MAX_BYTES   default 64 MiB of encoded features per
+#                               worker; 0 disables the cache
+#   ISOCHRONE_CACHE_SNAP_M      default 25 (metres); 0 keys on the exact
+#                               coordinates
+#
+# ?cache=bypass / `X-Gateway-Cache: bypass` skips the lookup. Hit / miss
+# counts and the hit rate go to the [ORS_METRIC] stream as an
+# `isochrone_cache` event every ISOCHRONE_CACHE_METRIC_INTERVAL_S.
+# ---------------------------------------------------------------------------
+ISOCHRONE_CACHE_MAX_BYTES = int(os.getenv('ISOCHRONE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+ISOCHRONE_CACHE_SNAP_M = float(os.getenv('ISOCHRONE_CACHE_SNAP_M', '25'))
+ISOCHRONE_CACHE_METRIC_INTERVAL_S = int(os.getenv('ISOCHRONE_CACHE_METRIC_INTERVAL_S', '60'))
+
+_ISOCHRONE_CACHE = OrderedDict()  # key -> {raw: bytes, stamp}
+_ISOCHRONE_CACHE_STATE = {'bytes': 0, 'hits': 0, 'misses': 0, 'evictions': 0, 'last_emit': time.monotonic()}
+_ISOCHRONE_CACHE_LOCK = threading.Lock()
+_ISOCHRONE_CACHE_BODY_KEYS = {'locations', 'range', 'range_type', 'location_type', 'smoothing'}
+
+
+def _snap_location(location):
+    lon, lat = float(location[0]), float(location[1])
+    if ISOCHRONE_CACHE_SNAP_M <= 0:
+        return round(lon, 6), round(lat, 6)
+    step = ISOCHRONE_CACHE_SNAP_M / 111320.0  # metres -> degrees of latitude
+    return int(round(lon / step)), int(round(lat / step))
+
+
+def _isochrone_cache_keys(host, profile, body):
+    """One cache key per location of an isochrones body, or None when the
+    body carries options the cache does not model."""
+    if not isinstance(body, dict) or set(body) - _ISOCHRONE_CACHE_BODY_KEYS:
+        return None
+    if body.get('location_type', 'start') != 'start':
+        return None
+    try:
+        shared = (host, profile, tuple(float(r) for r in body['range']),
+                  body.get('range_type', 'time'), int(body.get('smoothing') or 0))
+        keys = [shared + (_snap_location(loc),) for loc in body['locations']]
+    except (KeyError, TypeError, ValueError, IndexError):
+        return None
+    return keys or None
+
+
+def _flush_isochrone_cache_metric():
+    now = time.monotonic()
+    with _ISOCHRONE_CACHE_LOCK:
+        st = _ISOCHRONE_CACHE_STATE
+        if now - st['last_emit'] < ISOCHRONE_CACHE_METRIC_INTERVAL_S:
+            return
+        lookups = st['hits'] + st['misses']
+        counts = {
+            'cache_hits': st['hits'],
+            'cache_misses': st['misses'],
+            'cache_hit_rate': round(st['hits'] / lookups, 4) if lookups else None,
+            'cache_evictions': st['evictions'],
+            'cache_entries': len(_ISOCHRONE_CACHE),
+            'cache_bytes': st['bytes'],
+        }
+        st['hits'] = st['misses'] = st['evictions'] = 0
+        st['last_emit'] = now
+    _emit_metric('isochrone_cache', None, None, 200, 0, None, None,
+                 caller='isochrone_cache', extra=counts)
+
+
+def _isochrone_cache_get(keys, stamp):
+    """Cached {features, metadata} per key, None where missing or stale."""
+    found = []
+    with _ISOCHRONE_CACHE_LOCK:
+        for key in keys:
+            entry = _ISOCHRONE_CACHE.get(key)
+            if entry and entry['stamp'] != stamp:
+                _ISOCHRONE_CACHE.pop(key)
+                _ISOCHRONE_CACHE_STATE['bytes'] -= len(entry['raw'])
+                _ISOCHRONE_CACHE_STATE['evictions'] += 1
+                entry = None
+            if entry:
+                _ISOCHRONE_CACHE.move_to_end(key)
+                _ISOCHRONE_CACHE_STATE['hits'] += 1
+                found.append(entry['raw'])
+            else:
+                _ISOCHRONE_CACHE_STATE['misses'] += 1
+                found.append(None)
+    _flush_isochrone_cache_metric()
+    return [_json_decode(raw) if raw is not None else None for raw in found]
+
+
+def _isochrone_cache_put(keys, stamp, parts):
+    # As with the matrix cache, one entry may take at most a quarter of the
+    # budget.
+    encoded = [(key, _json_encode(part)) for key, part in zip(keys, parts)]
+    with _ISOCHRONE_CACHE_LOCK:
+        for key, raw in encoded:
+            if len(raw) > ISOCHRONE_CACHE_MAX_BYTES // 4:
+                continue
+            old = _ISOCHRONE_CACHE.pop(key, None)
+            if old:
+                _ISOCHRONE_CACHE_STATE['bytes'] -= len(old['raw'])
+            _ISOCHRONE_CACHE[key] = {'raw': raw, 'stamp': stamp}
+            _ISOCHRONE_CACHE_STATE['bytes'] += len(raw)
+        while _ISOCHRONE_CACHE_STATE['bytes'] > ISOCHRONE_CACHE_MAX_BYTES and _ISOCHRONE_CACHE:
+            _, evicted = _ISOCHRONE_CACHE.popitem(last=False)
+            _ISOCHRONE_CACHE_STATE['bytes'] -= len(evicted['raw'])
+            _ISOCHRONE_CACHE_STATE['evictions'] += 1
+
+
+def _split_isochrones(resp, n_locations):
+    """Per-location {features, metadata} parts of an ORS isochrones response,
+    by the features' group_index, or None when it is not a clean answer for
+    n_locations locations."""
+    if not isinstance(resp, dict) or 'error' in resp or not isinstance(resp.get('features'), list):
+        return None
+    metadata = {k: v for k, v in (resp.get('metadata') or {}).items() if k != 'query'}
+    parts = [{'features': [], 'metadata': metadata} for _ in range(n_locations)]
+    for feature in resp['features']:
+        try:
+            parts[int(feature['properties']['group_index'])]['features'].append(feature)
+        except (KeyError, TypeError, ValueError, IndexError):
+            return None
+    return parts
+
+
+def _geojson_bbox(features):
+    lons, lats = [], []
+
+    def _walk(coords):
+        if coords and isinstance(coords[0], (int, float)):
+            lons.append(coords[0])
+            lats.append(coords[1])
+        else:
+            for c in coords or []:
+                _walk(c)
+
+    for feature in features:
+        _walk((feature.get('geometry') or {}).get('coordinates'))
+    return [min(lons), min(lats), max(lons), max(lats)] if lons else []
+
+
+def _assemble_isochrones(parts, body):
+    """ORS-shaped isochrones response from per-location parts, in location
+    order with group_index renumbered to match `body`."""
+    features = []
+    for i, part in enumerate(parts):
+        for feature in part['features']:
+            feature['properties'] = dict(feature.get('properties') or {}, group_index=i)
+            features.append(feature)
+    metadata = dict(parts[0].get('metadata') or {})
+    metadata['query'] = body
+    metadata['timestamp'] = int(time.time() * 1000)
+    return {'type': 'FeatureCollection', 'bbox': _geojson_bbox(features), 'features': features,
+            'metadata': metadata}
+
+
+def _isochrones(profile, body, format, host, region_hint=None, use_cache=True):
+    """ISOCHRONES through the isochrone cache; anything the cache cannot
+    represent goes straight to get_ors_response."""
+    keys = (_isochrone_cache_keys(host, profile, body)
+            if ISOCHRONE_CACHE_MAX_BYTES > 0 and format == 'geojson' else None)
+    stamp = _graph_build_stamp(host, profile) if keys else None
+    if stamp is None:
+        return get_ors_response('isochrones', profile, body, format, host, region_hint=region_hint)
+    t0 = time.monotonic()
+    parts = _isochrone_cache_get(keys, stamp) if use_cache else [None] * len(keys)
+    missing = [i for i, part in enumerate(parts) if part is None]
+    if not missing:
+        _emit_metric('isochrones', profile, host, 200, int((time.monotonic() - t0) * 1000), None, None,
+                     caller='request.cache_hit', region=region_hint, request_id=uuid.uuid4().hex)
+        return _assemble_isochrones(parts, body)
+    sub_body = dict(body, locations=[body['locations'][i] for i in missing])
+    resp = get_ors_response('isochrones', profile, sub_body, format, host, region_hint=region_hint)
+    fetched = _split_isochrones(resp, len(missing))
+    if fetched is None:
+        return resp
+    _isochrone_cache_put([keys[i] for i in missing], stamp, fetched)
+    if len(missing) == len(parts):
+        return resp
+    for i, part in zip(missing, fetched):
+        parts[i] = part
+    return _assemble_isochrones(parts, body)
+
+
 def _isochrone_body(method_row, smoothing=None):
     """Build the ORS isochrones request body. (#113)
 
@@ -602,19 +2574,81 @@ def _isochrone_body(method_row, smoothing=None):
     return body
 
 
+# ---------------------------------------------------------------------------
+# Multi-location isochrone batching for ISOCHRONES_TABULAR.
+#
+# Each tabular row is one location, and sending one ORS request per row
+# paid one graph traversal setup and one round trip per POI. Rows of a batch
+# that share (region, profile, range, smoothing) are now sent together as one
+# multi-location ORS call of up to ISOCHRONES_BATCH_MAX_LOCATIONS locations
+# (never more than GUARDRAIL_ISOCHRONES_MAX_LOCATIONS; 1 disables batching),
+# and the returned features are split back to their rows by group_index.
+# Each row still gets a single-location FeatureCollection, exactly as before.
+# The batched call goes through _isochrones, so cached locations are not
+# recomputed.
+#
+# ORS fails a whole multi-location request when one point cannot be snapped
+# (e.g. 3099). On such an engine error the rows of that call are re-run one
+# by one so a bad point only fails its own row. Gateway-level errors
+# (timeout, circuit_open, service_unreachable, ...) apply to every row.
+# ---------------------------------------------------------------------------
+ISOCHRONES_BATCH_MAX_LOCATIONS = int(os.getenv('ISOCHRONES_BATCH_MAX_LOCATIONS', '50'))
+
+
+def _isochrones_tabular_rows(rows, format, use_cache=True):
+    """rows: [(row_id, region, host, profile, body)] with single-location
+    bodies -> [[row_id, response]] in input order."""
+    cap = max(1, min(ISOCHRONES_BATCH_MAX_LOCATIONS, GUARDRAIL_ISOCHRONES_MAX_LOCATIONS))
+    groups = OrderedDict()
+    for i, (_, _, host, profile, body) in enumerate(rows):
+        key = (host, profile, json.dumps(body.get('range')), body.get('range_type'), body.get('smoothing'))
+        groups.setdefault(key, []).append(i)
+    units = []
+    for members in groups.values():
+        for start in range(0, len(members), cap):
+            chunk = members[start:start + cap]
+            units.append([rows[chunk[0]][0], chunk])
+
+    def _row_response(i):
+        row_id, region, host, profile, body = rows[i]
+        return _isochrones(profile, body, format, host, region_hint=region, use_cache=use_cache)
+
+    def _process_unit(unit):
+        members = unit[1]
+        if len(members) == 1:
+            return [unit[0], [_row_response(members[0])]]
+        _, region, host, profile, first = rows[members[0]]
+        body = dict(first, locations=[rows[i][4]['locations'][0] for i in members])
+        resp = _isochrones(profile, body, format, host, region_hint=region, use_cache=use_cache)
+        parts = _split_isochrones(resp, len(members))
+        if parts is not None:
+            return [unit[0], [_assemble_isochrones([part], rows[i][4]) for i, part in zip(members, parts)]]
+        if isinstance(resp, dict) and isinstance(resp.get('error'), str):
+            return [unit[0], [resp] * len(members)]
+        logger.warning(f'Batched isochrones for {len(members)} rows failed on {host}; retrying rows one by one')
+        return [unit[0], [_row_response(i) for i in members]]
+
+    results = [None] * len(rows)
+    unit_rows = _map_rows('isochrones', units, _process_unit, lambda unit: rows[unit[1][0]][2])
+    for unit, (_, out) in zip(units, unit_rows):
+        for j, i in enumerate(unit[1]):
+            results[i] = out[j] if isinstance(out, list) else out
+    return [[row[0], resp] for row, resp in zip(rows, results)]
+
+
 def _handle_isochrones_tabular(input_rows, format, ors_host=None):
     host = ors_host or resolve_ors_host(None)
-    output_rows = []
+    rows = []
     for row in input_rows:
         # Optional caller-supplied smoothing at position 5 (TABULAR caller).
         smoothing = row[5] if len(row) > 5 else None
-        body = _isochrone_body(row, smoothing)
-        output_rows.append([row[0], get_ors_response('isochrones', row[1], body, format, host)])
-    return output_rows
+        rows.append((row[0], None, host, row[1], _isochrone_body(row, smoothing)))
+    return _isochrones_tabular_rows(rows, format)
 
 
 @app.post("/isochrones_tabular")
 @app.post("/isochrones_tabular/<format>")
+@_request_lane('isochrones')
 def post_isochrones_tabular(format="geojson"):
     """
     row = [id, method, lon, lat, range, region]                (5-arg, legacy)
@@ -627,7 +2661,9 @@ def post_isochrones_tabular(format="geojson"):
     input_rows = _parse_rows(message)
     if not input_rows:
         return {}
-    output_rows = []
+    use_cache = not _cache_bypass_requested()
+
+    rows = []
     for row in input_rows:
         # 6-arg form has region at index 6, smoothing at index 5;
         # legacy 5-arg form has region at index 5, no smoothing.
@@ -637,15 +2673,15 @@ def post_isochrones_tabular(format="geojson"):
         else:
             smoothing = None
             region = _extract_region(row, 5)
-        ors_host = resolve_ors_host(region)
-        body = _isochrone_body(row, smoothing)
-        output_rows.append([row[0], get_ors_response('isochrones', row[1], body, format, ors_host)])
+        rows.append((row[0], region, resolve_ors_host(region), row[1], _isochrone_body(row, smoothing)))
+    output_rows = _isochrones_tabular_rows(rows, format, use_cache=use_cache)
     logger.info(f'Produced {len(output_rows)} rows')
     return _make_response(output_rows)
 
 
 @app.post("/isochrones")
 @app.post("/isochrones/<format>")
+@_request_lane('isochrones')
 def post_isochrones(format="geojson"):
     """
     Snowflake service-function row = [id, method, options, region].
@@ -660,8 +2696,9 @@ def post_isochrones(format="geojson"):
     input_rows = _parse_rows(message)
     if not input_rows:
         return {}
-    output_rows = []
-    for row in input_rows:
+    use_cache = not _cache_bypass_requested()
+
+    def _process_row(row):
         region = _extract_region(row, 3)
         ors_host = resolve_ors_host(region)
         opts = row[2]
@@ -678,12 +2715,129 @@ def post_isochrones(format="geojson"):
         smoothing = opts.get('smoothing')
         if smoothing is not None and int(smoothing) > 0:
             body['smoothing'] = int(smoothing)
-        output_rows.append([row[0], get_ors_response(
-            'isochrones', row[1], body, format, ors_host, region_hint=region)])
+        return [row[0], _isochrones(row[1], body, format, ors_host, region_hint=region, use_cache=use_cache)]
+
+    output_rows = _map_rows('isochrones', input_rows, _process_row,
+                            lambda row: resolve_ors_host(_extract_region(row, 3)))
     logger.info(f'Produced {len(output_rows)} isochrone rows')
     return _make_response(output_rows)
 
 
+# ---------------------------------------------------------------------------
+# Tiled matrix execution (opt-in).
+#
+# A matrix with more than GUARDRAIL_MATRIX_MAX_LOCATIONS locations is
+# normally rejected with request_too_large and callers chunk client-side.
+# With ?tiled=true (or options.tiled=true on /matrix) the gateway instead
+# splits the sources x destinations product into tiles whose location count
+# fits the guardrail, runs them in parallel against the region's ORS (each
+# tile is an ordinary get_ors_response call, so the cache, breaker and host
+# slots all apply) and stitches the full matrix.
+#
+# ORS_TIMEOUT_MATRIX_TILED (or the request deadline, if sooner) bounds the
+# whole run; bulk jobs pass their own page budget. The budget is installed as
+# the tiles' deadline, so a tile still queued for a slot or running when it
+# passes stops itself instead of holding the slot for an answer nobody reads.
+# Tiles that fail or do not finish in time leave None cells; the response
+# then carries `_partial` and a `failed_tiles` list, mirroring the
+# _retry_matrix_chunked contract. Empty sources or destinations give an
+# empty matrix without calling ORS.
+# ---------------------------------------------------------------------------
+def _matrix_tiling_requested():
+    return (request.args.get('tiled') or '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _matrix_needs_tiling(body):
+    return isinstance(body, dict) and len(body.get('locations') or []) > GUARDRAIL_MATRIX_MAX_LOCATIONS
+
+
+def _tiled_matrix(profile, body, format, ors_host, use_cache=True, timeout_s=None):
+    timeout_s = timeout_s or ORS_TIMEOUT_MATRIX_TILED
+    locations = body.get('locations') or []
+    sources_idx = body.get('sources') if isinstance(body.get('sources'), list) else list(range(len(locations)))
+    destinations_idx = (body.get('destinations') if isinstance(body.get('destinations'), list)
+                        else list(range(len(locations))))
+    passthrough = {k: v for k, v in body.items() if k not in ('locations', 'sources', 'destinations')}
+    n_src, n_dst = len(sources_idx), len(destinations_idx)
+    if not n_src or not n_dst:
+        return {
+            'durations': [[] for _ in range(n_src)],
+            'distances': [[] for _ in range(n_src)],
+            'sources': [None] * n_src,
+            'destinations': [None] * n_dst,
+            '_tiled': {'tiles': 0, 'tile_sources': 0, 'tile_destinations': 0},
+        }
+    cap = max(2, GUARDRAIL_MATRIX_MAX_LOCATIONS)
+    tile_src = min(n_src, max(1, cap // 2))
+    tile_dst = min(n_dst, cap - tile_src)
+    tiles = [(i, j) for i in range(0, n_src, tile_src) for j in range(0, n_dst, tile_dst)]
+    logger.info(f'Tiled matrix on {ors_host}: {n_src}x{n_dst} as {len(tiles)} tiles of <= {tile_src}x{tile_dst}')
+
+    def _run_tile(tile):
+        i, j = tile
+        src = sources_idx[i:i + tile_src]
+        dst = destinations_idx[j:j + tile_dst]
+        tile_body = dict(passthrough)
+        tile_body['locations'] = [locations[k] for k in src] + [locations[k] for k in dst]
+        tile_body['sources'] = list(range(len(src)))
+        tile_body['destinations'] = list(range(len(src), len(src) + len(dst)))
+        return get_ors_response('matrix', profile, tile_body, format, ors_host, caller='matrix_tiled',
+                                use_cache=use_cache)
+
+    durations = [[None] * n_dst for _ in range(n_src)]
+    distances = [[None] * n_dst for _ in range(n_src)]
+    sources = [None] * n_src
+    destinations = [None] * n_dst
+    metadata = None
+    failed_tiles = []
+    executor = ThreadPoolExecutor(max_workers=max(1, min(_host_limit(ors_host), len(tiles))))
+    try:
+        with _deadline(timeout_s):
+            futures = {executor.submit(_in_request_context(_run_tile), tile): tile for tile in tiles}
+            done, _ = wait(futures, timeout=max(0.0, _deadline_remaining()))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    first_error = None
+    for future, (i, j) in futures.items():
+        tile_ref = {'sources': [i, min(i + tile_src, n_src)], 'destinations': [j, min(j + tile_dst, n_dst)]}
+        if future not in done:
+            failed_tiles.append(dict(tile_ref, error='timeout'))
+            continue
+        resp = future.result()
+        if not isinstance(resp, dict) or 'error' in resp or 'durations' not in resp:
+            first_error = first_error or resp
+            failed_tiles.append(dict(tile_ref, error=resp.get('error') if isinstance(resp, dict) else 'invalid_response'))
+            continue
+        for a, row in enumerate(resp.get('durations') or []):
+            durations[i + a][j:j + len(row)] = row
+        for a, row in enumerate(resp.get('distances') or []):
+            distances[i + a][j:j + len(row)] = row
+        for a, entry in enumerate(resp.get('sources') or []):
+            sources[i + a] = entry
+        for b, entry in enumerate(resp.get('destinations') or []):
+            destinations[j + b] = entry
+        metadata = metadata or resp.get('metadata')
+
+    if len(failed_tiles) == len(tiles):
+        if first_error is not None:
+            return first_error
+        return {'error': 'timeout', 'ors_host': ors_host, 'timeout_seconds': timeout_s,
+                'message': f'Tiled matrix ({len(tiles)} tiles) did not finish within {timeout_s}s on {ors_host}.'}
+    result = {
+        'durations': durations,
+        'distances': distances,
+        'sources': sources,
+        'destinations': destinations,
+        '_tiled': {'tiles': len(tiles), 'tile_sources': tile_src, 'tile_destinations': tile_dst},
+    }
+    if metadata is not None:
+        result['metadata'] = metadata
+    if failed_tiles:
+        result['_partial'] = True
+        result['failed_tiles'] = failed_tiles
+    return result
+
+
 def _build_matrix_body(method, row_data, has_destinations):
     if has_destinations:
         origin = row_data[0]
@@ -706,178 +2860,1078 @@ def _build_matrix_body(method, row_data, has_destinations):
         }
 
 
-def _retry_matrix_chunked(profile, locations, sources_idx, destinations_idx, format, ors_host, chunk_size=50, _depth=0):
-    # Depth guard (#audit-pr-120): the original implementation would silently
-    # `continue` past failed chunks at the smallest chunk_size, returning a
-    # stitched matrix with missing destination columns and no signal to the
-    # caller that the result was incomplete. We now (a) cap recursion at
-    # depth 2 (50 -> 10 -> stop) and (b) record per-chunk failures so the
-    # response carries a `_partial` marker plus a `failed_destinations` list.
-    MAX_DEPTH = 2
-    all_durations = None
-    all_distances = None
-    failed_destinations = []
+def _retry_matrix_chunked(profile, locations, sources_idx, destinations_idx, format, ors_host, chunk_size=50, _depth=0,
+                          use_cache=True):
+    # Depth guard (#audit-pr-120): the original implementation would silently
+    # `continue` past failed chunks at the smallest chunk_size, returning a
+    # stitched matrix with missing destination columns and no signal to the
+    # caller that the result was incomplete. We now (a) cap recursion at
+    # depth 2 (50 -> 10 -> stop) and (b) record per-chunk failures so the
+    # response carries a `_partial` marker plus a `failed_destinations` list.
+    #
+    # Chunks (and the 10-wide re-splits of a failed chunk) run concurrently;
+    # the ORS calls they make draw on the same per-host slots as the
+    # matrix_tabular row executor (_host_slot), so a chunked row cannot
+    # multiply the load on the host. Results are stitched in chunk order, and
+    # a failed chunk keeps its columns filled with None, so the matrix is
+    # always sources x destinations and column j is destinations_idx[j].
+    MAX_DEPTH = 2
+    failed_destinations = []
+
+    def _run_chunk(chunk_dests):
+        """Returns (matrix_or_None, failed_destination_indices)."""
+        body = {
+            'locations': locations,
+            'sources': sources_idx,
+            'destinations': chunk_dests,
+            'metrics': ['distance', 'duration'],
+            'resolve_locations': True
+        }
+        resp = get_ors_response('matrix', profile, body, format, ors_host, use_cache=use_cache)
+        if 'error' not in resp:
+            return resp, []
+        # Re-splitting cannot beat a spent deadline.
+        if chunk_size > 10 and _depth < MAX_DEPTH and resp.get('error') != 'deadline_exceeded':
+            partial = _retry_matrix_chunked(
+                profile, locations, sources_idx, chunk_dests, format, ors_host, 10,
+                _depth=_depth + 1, use_cache=use_cache,
+            )
+            if partial and 'error' not in partial:
+                # Propagate any partial markers from the inner call.
+                return partial, list(partial.get('failed_destinations', [])) if partial.get('_partial') else []
+        # Either we are at the smallest chunk_size or recursion is
+        # exhausted: record the failed destination indices instead of
+        # silently dropping them.
+        return None, chunk_dests
+
+    chunks = [destinations_idx[i:i + chunk_size] for i in range(0, len(destinations_idx), chunk_size)]
+    if len(chunks) > 1:
+        with ThreadPoolExecutor(max_workers=min(_host_limit(ors_host), len(chunks))) as executor:
+            outcomes = list(executor.map(_in_request_context(_run_chunk), chunks))
+    else:
+        outcomes = [_run_chunk(chunk) for chunk in chunks]
+
+    n_rows = next((len(resp.get('durations', [])) for resp, _ in outcomes if resp is not None), None)
+    if n_rows is None:
+        return {'error': 'all_chunks_failed', 'message': 'All matrix chunks failed'}
+    all_durations = [[] for _ in range(n_rows)]
+    all_distances = [[] for _ in range(n_rows)]
+    for chunk, (resp, failed) in zip(chunks, outcomes):
+        failed_destinations.extend(failed)
+        for key, rows in (('durations', all_durations), ('distances', all_distances)):
+            part = resp.get(key) if resp is not None else None
+            for r_idx, row in enumerate(rows):
+                row.extend(part[r_idx] if part else [None] * len(chunk))
+
+    result = {
+        'durations': all_durations,
+        'distances': all_distances,
+        'sources': sources_idx,
+        'destinations': destinations_idx
+    }
+    if failed_destinations:
+        result['_partial'] = True
+        result['failed_destinations'] = failed_destinations
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Cell-level travel-time store.
+#
+# The matrix cache above only helps when the whole request repeats. Most
+# MATRIX_TABULAR traffic is overlapping fleet matrices instead: the same
+# depots against a shifting job set. Every successful matrix_tabular response
+# is therefore also split into origin -> destination (duration, distance)
+# cells, kept per (host, profile) and keyed by coordinates quantized to
+# MATRIX_CELL_PRECISION decimal places (5 ~= 1 m). A later row is assembled
+# from known cells, and ORS is asked only for the sub-block of rows x columns
+# that still has gaps. The per-location `sources` / `destinations` entries
+# (snapped location, snapped_distance) are stored alongside, because SQL
+# callers filter on snapped_distance.
+#
+# Like the matrix cache, a store is bound to the profile's graph_build_date
+# and is dropped when the graph is rebuilt or the build date is unknown.
+# Rows are evicted LRU once a store exceeds MATRIX_CELL_STORE_MAX_CELLS.
+# A failed sub-block call falls back to the plain full-matrix path, so the
+# 6099 chunked retry and its _partial contract are unchanged.
+#
+# Rows served, cells requested and cells fetched from ORS are counted per
+# worker and flushed as a `matrix_cells` event every
+# MATRIX_CELL_STORE_METRIC_INTERVAL_S (not one event per row: a 1000-row
+# MATRIX_TABULAR batch would otherwise print 1000 lines).
+# ---------------------------------------------------------------------------
+MATRIX_CELL_PRECISION = int(os.getenv('MATRIX_CELL_PRECISION', '5'))
+MATRIX_CELL_STORE_MAX_CELLS = int(os.getenv('MATRIX_CELL_STORE_MAX_CELLS', '250000'))
+MATRIX_CELL_STORE_METRIC_INTERVAL_S = int(os.getenv('MATRIX_CELL_STORE_METRIC_INTERVAL_S', '60'))
+
+_CELL_STORES = {}  # (host, profile) -> {lock, stamp, rows: OrderedDict(src -> {dst: (dur, dist)}), snaps, cells, metadata}
+_CELL_STORES_LOCK = threading.Lock()
+_CELL_STORE_STATE = {'rows': 0, 'cells_total': 0, 'cells_fetched': 0, 'last_emit': time.monotonic()}
+
+
+def _count_cell_store_row(cells_total, cells_fetched):
+    now = time.monotonic()
+    with _CELL_STORES_LOCK:
+        st = _CELL_STORE_STATE
+        st['rows'] += 1
+        st['cells_total'] += cells_total
+        st['cells_fetched'] += cells_fetched
+        if now - st['last_emit'] < MATRIX_CELL_STORE_METRIC_INTERVAL_S:
+            return
+        counts = {
+            'rows': st['rows'],
+            'cells_total': st['cells_total'],
+            'cells_fetched': st['cells_fetched'],
+            'cells_hit_rate': round(1 - st['cells_fetched'] / st['cells_total'], 4) if st['cells_total'] else None,
+            'stores': len(_CELL_STORES),
+        }
+        st['rows'] = st['cells_total'] = st['cells_fetched'] = 0
+        st['last_emit'] = now
+    _emit_metric('matrix', None, None, 200, 0, None, None, caller='matrix_cells', extra=counts)
+
+
+def _quantize(location):
+    return (round(float(location[0]), MATRIX_CELL_PRECISION), round(float(location[1]), MATRIX_CELL_PRECISION))
+
+
+def _cell_store(host, profile, stamp):
+    with _CELL_STORES_LOCK:
+        store = _CELL_STORES.get((host, profile))
+        if store is None or store['stamp'] != stamp:
+            store = {
+                'lock': threading.Lock(),
+                'stamp': stamp,
+                'rows': OrderedDict(),
+                'snaps': OrderedDict(),
+                'cells': 0,
+                'metadata': None,
+            }
+            _CELL_STORES[(host, profile)] = store
+    return store
+
+
+def _cell_store_put(store, src_keys, dst_keys, resp):
+    """Record every cell of an ORS matrix response whose rows/columns map to
+    src_keys / dst_keys."""
+    durations = resp['durations']
+    distances = resp['distances']
+    snap_cap = max(1000, MATRIX_CELL_STORE_MAX_CELLS // 5)
+    with store['lock']:
+        for keys, entries in ((src_keys, resp['sources']), (dst_keys, resp['destinations'])):
+            for key, entry in zip(keys, entries):
+                store['snaps'][key] = entry
+                store['snaps'].move_to_end(key)
+        while len(store['snaps']) > snap_cap:
+            store['snaps'].popitem(last=False)
+        for i, src in enumerate(src_keys):
+            row = store['rows'].get(src)
+            if row is None:
+                row = store['rows'][src] = {}
+            before = len(row)
+            for j, dst in enumerate(dst_keys):
+                row[dst] = (durations[i][j], distances[i][j])
+            store['cells'] += len(row) - before
+            store['rows'].move_to_end(src)
+        while store['cells'] > MATRIX_CELL_STORE_MAX_CELLS and store['rows']:
+            _, evicted = store['rows'].popitem(last=False)
+            store['cells'] -= len(evicted)
+        metadata = resp.get('metadata')
+        if isinstance(metadata, dict):
+            store['metadata'] = {k: v for k, v in metadata.items() if k != 'query'}
+
+
+def _matrix_from_cell_store(method, row_data, has_destinations, format, ors_host, use_cache=True):
+    """Assemble a matrix_tabular row from the cell store, calling ORS only for
+    the missing sub-block. Returns None when the caller should take the plain
+    full-matrix path instead."""
+    if MATRIX_CELL_STORE_MAX_CELLS <= 0:
+        return None
+    if has_destinations:
+        origins, destinations = row_data[0], row_data[1]
+        if origins and not isinstance(origins[0], list):
+            origins = [origins]
+    else:
+        origins = destinations = row_data[0]
+    if not origins or not destinations:
+        return None
+    try:
+        src_keys = [_quantize(loc) for loc in origins]
+        dst_keys = [_quantize(loc) for loc in destinations]
+    except (TypeError, ValueError, IndexError):
+        return None
+    stamp = _graph_build_stamp(ors_host, method)
+    if stamp is None:
+        return None
+    store = _cell_store(ors_host, method, stamp)
+
+    n_src, n_dst = len(src_keys), len(dst_keys)
+    known = [[None] * n_dst for _ in range(n_src)]
+    missing_rows, missing_cols = set(), set()
+    with store['lock']:
+        metadata = store['metadata']
+        snaps = store['snaps']
+        if use_cache:
+            for i, src in enumerate(src_keys):
+                row = store['rows'].get(src) or {}
+                if src not in snaps:
+                    missing_rows.add(i)
+                for j, dst in enumerate(dst_keys):
+                    cell = row.get(dst)
+                    if cell is None:
+                        missing_rows.add(i)
+                        missing_cols.add(j)
+                    else:
+                        known[i][j] = cell
+            missing_cols.update(j for j, dst in enumerate(dst_keys) if dst not in snaps)
+            src_entries = [snaps.get(k) for k in src_keys]
+            dst_entries = [snaps.get(k) for k in dst_keys]
+        else:
+            missing_rows, missing_cols = set(range(n_src)), set(range(n_dst))
+    # The fetched block must cover every gap; a row- or column-only gap
+    # (unknown snap entry) still needs one partner on the other axis.
+    if missing_rows and not missing_cols:
+        missing_cols = {0}
+    if missing_cols and not missing_rows:
+        missing_rows = {0}
+    sub_rows, sub_cols = sorted(missing_rows), sorted(missing_cols)
+    whole = len(sub_rows) == n_src and len(sub_cols) == n_dst
+
+    fetched = None
+    if sub_rows:
+        if whole:
+            body = _build_matrix_body(method, row_data, has_destinations)
+        else:
+            sub_origins = [origins[i] for i in sub_rows]
+            sub_destinations = [destinations[j] for j in sub_cols]
+            body = _build_matrix_body(method, [sub_origins, sub_destinations], True)
+        fetched = get_ors_response('matrix', method, body, format, ors_host, use_cache=use_cache)
+        ok = (isinstance(fetched, dict) and 'error' not in fetched
+              and isinstance(fetched.get('durations'), list) and isinstance(fetched.get('distances'), list)
+              and len(fetched.get('sources') or []) == len(sub_rows)
+              and len(fetched.get('destinations') or []) == len(sub_cols))
+        if not ok:
+            return fetched if whole else None
+        _cell_store_put(store, [src_keys[i] for i in sub_rows], [dst_keys[j] for j in sub_cols], fetched)
+        if whole:
+            _count_cell_store_row(n_src * n_dst, n_src * n_dst)
+            return fetched
+        for a, i in enumerate(sub_rows):
+            src_entries[i] = fetched['sources'][a]
+            for b, j in enumerate(sub_cols):
+                known[i][j] = (fetched['durations'][a][b], fetched['distances'][a][b])
+        for b, j in enumerate(sub_cols):
+            dst_entries[j] = fetched['destinations'][b]
+        metadata = store['metadata']
+
+    _count_cell_store_row(n_src * n_dst, len(sub_rows) * len(sub_cols))
+    resp = {
+        'durations': [[cell[0] for cell in row] for row in known],
+        'distances': [[cell[1] for cell in row] for row in known],
+        'sources': src_entries,
+        'destinations': dst_entries,
+    }
+    if metadata is not None:
+        resp['metadata'] = metadata
+    return resp
+
+
+@app.post("/matrix_tabular")
+@app.post("/matrix_tabular/<format>")
+@_traced('matrix_tabular')
+@_request_lane('matrix')
+def post_matrix_tabular(format="json"):
+    """
+    row = [id, method, origin, destinations, region]  (MATRIX_TABULAR 3-arg)
+    row = [id, method, locations, region]              (MATRIX 2-arg)
+    region is the LAST column and can be NULL.
+    format `binary` returns durations/distances packed (see _pack_matrix).
+    """
+    message = request.json
+    logger.debug(f'Received request: {message}')
+    input_rows = _parse_rows(message)
+    if not input_rows:
+        return {}
+    use_cache = not _cache_bypass_requested()
+    tiled = _matrix_tiling_requested()
+    pack = format == MATRIX_BINARY_FORMAT
+    format = _ors_matrix_format(format)
+
+    def _process_row(row):
+        region = _extract_region(row, -1)
+        ors_host = resolve_ors_host(region)
+        data_cols = row[1:-1]
+        method = data_cols[0]
+        has_dest = len(data_cols) == 3
+        if tiled:
+            body = _build_matrix_body(method, data_cols[1:], has_dest)
+            if _matrix_needs_tiling(body):
+                resp = _tiled_matrix(method, body, format, ors_host, use_cache)
+                return [row[0], _pack_matrix(resp) if pack else resp]
+        resp = _matrix_from_cell_store(method, data_cols[1:], has_dest, format, ors_host, use_cache)
+        if resp is None:
+            body = _build_matrix_body(method, data_cols[1:], has_dest)
+            resp = get_ors_response('matrix', method, body, format, ors_host, use_cache=use_cache)
+        error_obj = resp.get('error') if isinstance(resp, dict) else None
+        if isinstance(error_obj, dict) and error_obj.get('code') == 6099 and has_dest:
+            origin = data_cols[1]
+            destinations = data_cols[2]
+            if origin and not isinstance(origin[0], list):
+                origin = [origin]
+            locations = origin + destinations
+            sources_idx = list(range(len(origin)))
+            destinations_idx = list(range(len(origin), len(locations)))
+            resp = _retry_matrix_chunked(method, locations, sources_idx, destinations_idx, format, ors_host,
+                                         use_cache=use_cache)
+        return [row[0], _pack_matrix(resp) if pack else resp]
+
+    output_rows = _map_rows('matrix', input_rows, _process_row,
+                            lambda row: resolve_ors_host(_extract_region(row, -1)))
+
+    logger.info(f'Produced {len(output_rows)} rows')
+    return _make_response(output_rows)
+
+
+@app.post("/matrix")
+@app.post("/matrix/<format>")
+@_request_lane('matrix')
+def post_matrix(format="json"):
+    """
+    row = [id, method, options, region]
+    region is the LAST column and can be NULL.
+    options.cache=false skips the gateway matrix cache for that row, and
+    options.tiled=true (or ?tiled=true) runs a matrix above the location
+    guardrail as parallel tiles; both keys are gateway-only and are not
+    forwarded to ORS. format `binary` returns durations/distances packed
+    (see _pack_matrix).
+    """
+    message = request.json
+    logger.debug(f'Received request: {message}')
+    input_rows = _parse_rows(message)
+    if not input_rows:
+        return {}
+    bypass = _cache_bypass_requested()
+    tiled_requested = _matrix_tiling_requested()
+    pack = format == MATRIX_BINARY_FORMAT
+    format = _ors_matrix_format(format)
+
+    def _process_row(row):
+        region = _extract_region(row, 3)
+        ors_host = resolve_ors_host(region)
+        body = row[2]
+        use_cache = not bypass
+        tiled = tiled_requested
+        if isinstance(body, list):
+            body = {
+                'locations': body,
+                'metrics': ['distance', 'duration'],
+                'resolve_locations': True
+            }
+        elif isinstance(body, dict) and ('cache' in body or 'tiled' in body):
+            body = dict(body)
+            use_cache = use_cache and bool(body.pop('cache', True))
+            tiled = bool(body.pop('tiled', tiled))
+        if tiled and _matrix_needs_tiling(body):
+            resp = _tiled_matrix(row[1], body, format, ors_host, use_cache)
+        else:
+            resp = get_ors_response('matrix', row[1], body, format, ors_host, use_cache=use_cache)
+        return [row[0], _pack_matrix(resp) if pack else resp]
+
+    output_rows = _map_rows('matrix', input_rows, _process_row,
+                            lambda row: resolve_ors_host(_extract_region(row, 3)))
+
+    logger.info(f'Produced {len(output_rows)} rows')
+    return _make_response(output_rows)
+
+
+# ---------------------------------------------------------------------------
+# Bulk jobs: submit / status / fetch / cancel / resume.
+#
+# Sweeps like thousands of POI isochrones or a region-wide matrix do not fit
+# one service-function call: the response cap (20MB, see
+# _handle_optimization_tabular) and the per-call timeouts forced callers to
+# chunk on the client side and retry pieces by hand. BULK_JOB_SUBMIT hands the
+# whole sweep to the gateway, which runs it in the background and writes the
+# result as pages that BULK_JOB_FETCH returns one at a time:
+#   isochrones -- spec {profile, locations, range, range_type?, smoothing?};
+#                 one item per location, BULK_JOB_PAGE_ITEMS per page, batched
+#                 and cached like ISOCHRONES_TABULAR;
+#   matrix     -- spec {profile, locations, sources?, destinations?}; one item
+#                 per source row, as many rows per page as fit in
+#                 BULK_JOB_PAGE_CELLS, each page computed as a tiled matrix.
+# Items are [index, result]; a failed item carries its error and does not
+# fail the job. Job traffic uses the bulk lanes of the per-host limit, so it
+# yields to interactive calls, and each page runs under a BATCH_DEADLINE_S
+# deadline.
+#
+# Progress is checkpointed under BULK_JOB_DIR/<job_id>/: job.json (the plan,
+# written at submit), one page-NNNNN.json per finished page followed by its
+# page-NNNNN.done marker, a `lease` heartbeat written by the runner before
+# each page, the `claim` naming the runner that owns the job, and
+# `cancelled` / `failed` markers. Files are written whole and never renamed
+# or appended, so the directory may be a stage volume shared by all gateway
+# instances (the service spec mounts one). A page only counts as done, and
+# is only served, once its marker exists: a page file still being written
+# is never listed or fetched half-written.
+#
+# Without such a volume (the /tmp default) jobs are instance-local: a
+# status or fetch call that lands on another instance does not find them.
+# /health reports `bulk_jobs.shared`, and each worker logs a warning the
+# first time it handles a bulk job on an unmounted BULK_JOB_DIR.
+#
+# Each worker runs at most BULK_JOB_MAX_ACTIVE jobs. A job whose lease is
+# older than BULK_JOB_LEASE_S (never started, or its worker died or was
+# recycled) is adopted by the job sweeper of a worker with room, a daemon
+# thread that every bulk call starts and that scans BULK_JOB_DIR every
+# BULK_JOB_SWEEP_S until no unfinished job is left; status and fetch only
+# read and report such a job as `queued`. The job resumes at its first page
+# without a marker. Two instances can see the same stale lease, so an
+# adopter writes its claim, waits BULK_JOB_CLAIM_SETTLE_S and only resumes if
+# the claim is still its own; the last claim wins. A runner also re-reads
+# the claim before each page and stops once another runner has taken the
+# job over. A `failed` or `cancelled` job stays so until BULK_JOB_RESUME
+# clears its marker; it then resumes like a stale one.
+# The sweeper also deletes jobs older than BULK_JOB_TTL_S, at most once per
+# BULK_JOB_REAP_INTERVAL_S.
+# ---------------------------------------------------------------------------
+BULK_JOB_DIR = os.getenv('BULK_JOB_DIR', '/tmp/routing-gateway-jobs')
+BULK_JOB_MAX_ACTIVE = int(os.getenv('BULK_JOB_MAX_ACTIVE', '2'))
+BULK_JOB_MAX_ITEMS = int(os.getenv('BULK_JOB_MAX_ITEMS', '100000'))
+BULK_JOB_PAGE_ITEMS = int(os.getenv('BULK_JOB_PAGE_ITEMS', '50'))
+BULK_JOB_PAGE_CELLS = int(os.getenv('BULK_JOB_PAGE_CELLS', '250000'))
+BULK_JOB_LEASE_S = int(os.getenv('BULK_JOB_LEASE_S', str(2 * BATCH_DEADLINE_S)))
+BULK_JOB_TTL_S = int(os.getenv('BULK_JOB_TTL_S', '86400'))
+BULK_JOB_CLAIM_SETTLE_S = float(os.getenv('BULK_JOB_CLAIM_SETTLE_S', '2'))
+BULK_JOB_SWEEP_S = float(os.getenv('BULK_JOB_SWEEP_S', '30'))
+BULK_JOB_REAP_INTERVAL_S = int(os.getenv('BULK_JOB_REAP_INTERVAL_S', '3600'))
+
+_BULK_JOBS = {'pid': None, 'pool': None, 'active': set(), 'sweeper': None, 'last_reap': 0.0}
+_BULK_JOBS_LOCK = threading.Lock()
+_BULK_JOB_ISOCHRONE_KEYS = ('range', 'range_type', 'location_type', 'smoothing', 'attributes', 'units')
+
+
+def _job_dir(job_id):
+    if not isinstance(job_id, str) or len(job_id) != 32 or any(c not in '0123456789abcdef' for c in job_id):
+        return None
+    return os.path.join(BULK_JOB_DIR, job_id)
+
+
+def _job_read(job_id, name):
+    """Decoded BULK_JOB_DIR/<job_id>/<name>; None if absent or still being written."""
+    try:
+        with open(os.path.join(_job_dir(job_id), name), 'rb') as f:
+            return _json_decode(f.read())
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _job_write(job_id, name, obj):
+    with open(os.path.join(_job_dir(job_id), name), 'wb') as f:
+        f.write(_json_encode(obj))
+
+
+def _job_page_name(page):
+    return f'page-{page:05d}.json'
+
+
+def _job_page_marker(page):
+    return f'page-{page:05d}.done'
+
+
+def _job_page_done(job_id, page):
+    return os.path.exists(os.path.join(_job_dir(job_id), _job_page_marker(page)))
+
+
+def _job_owner():
+    return f'{os.uname().nodename}:{os.getpid()}'
+
+
+def _job_claimed(job_id, owner):
+    claim = _job_read(job_id, 'claim')
+    return claim is not None and claim.get('owner') == owner
+
+
+def _job_plan(kind, spec, region):
+    """The job.json manifest for a submitted spec; raises ValueError on a bad spec."""
+    if kind not in ('isochrones', 'matrix'):
+        raise ValueError("kind must be 'isochrones' or 'matrix'")
+    if not isinstance(spec, dict) or not isinstance(spec.get('locations'), list) or not spec['locations']:
+        raise ValueError('spec.locations must be a non-empty array of [lon, lat]')
+    locations = spec['locations']
+    plan = {
+        'kind': kind,
+        'profile': spec.get('profile') or 'driving-car',
+        'region': region,
+        'ors_host': resolve_ors_host(region),
+        'created_at': time.time(),
+    }
+    if kind == 'isochrones':
+        if not spec.get('range'):
+            raise ValueError('spec.range is required for isochrones')
+        items = len(locations)
+        page_items = max(1, BULK_JOB_PAGE_ITEMS)
+        plan['body'] = {k: spec[k] for k in _BULK_JOB_ISOCHRONE_KEYS if k in spec}
+        plan['body'].setdefault('range_type', 'time')
+        plan['body'].setdefault('location_type', 'start')
+    else:
+        sources = spec.get('sources') if isinstance(spec.get('sources'), list) else list(range(len(locations)))
+        destinations = (spec.get('destinations') if isinstance(spec.get('destinations'), list)
+                        else list(range(len(locations))))
+        if not sources or not destinations:
+            raise ValueError('spec.sources and spec.destinations must not be empty')
+        items = len(sources)
+        page_items = max(1, BULK_JOB_PAGE_CELLS // len(destinations))
+        plan['sources'] = sources
+        plan['destinations'] = destinations
+    if items > BULK_JOB_MAX_ITEMS:
+        raise ValueError(f'{items} items exceed BULK_JOB_MAX_ITEMS ({BULK_JOB_MAX_ITEMS})')
+    plan.update({
+        'locations': locations,
+        'items_total': items,
+        'page_items': page_items,
+        'pages': (items + page_items - 1) // page_items,
+    })
+    return plan
+
+
+def _job_run_page(plan, page):
+    """[[item_index, result], ...] for one page of a job."""
+    first = page * plan['page_items']
+    last = min(plan['items_total'], first + plan['page_items'])
+    host = plan['ors_host']
+    if plan['kind'] == 'isochrones':
+        rows = [(i, plan['region'], host, plan['profile'], dict(plan['body'], locations=[plan['locations'][i]]))
+                for i in range(first, last)]
+        return _isochrones_tabular_rows(rows, 'geojson')
+    sources = plan['sources'][first:last]
+    body = {
+        'locations': plan['locations'],
+        'sources': sources,
+        'destinations': plan['destinations'],
+        'metrics': ['distance', 'duration'],
+        'resolve_locations': True,
+    }
+    resp = _tiled_matrix(plan['profile'], body, 'json', host, timeout_s=BATCH_DEADLINE_S)
+    if not isinstance(resp, dict) or 'durations' not in resp:
+        return [[first + a, resp] for a in range(len(sources))]
+    return [[first + a, {
+        'source': (resp.get('sources') or [None] * len(sources))[a],
+        'durations': resp['durations'][a],
+        'distances': resp['distances'][a],
+    }] for a in range(len(sources))]
+
+
+def _job_runner(job_id, adopting=False):
+    plan = _job_read(job_id, 'job.json')
+    owner = _job_owner()
+    try:
+        _job_write(job_id, 'claim', {'owner': owner, 'at': time.time()})
+        if adopting:
+            # Another instance may be adopting the same stale job: last claim wins.
+            time.sleep(BULK_JOB_CLAIM_SETTLE_S)
+        for page in range(plan['pages']):
+            if os.path.exists(os.path.join(_job_dir(job_id), 'cancelled')):
+                logger.info(f'bulk job {job_id} cancelled at page {page}/{plan["pages"]}')
+                return
+            if not _job_claimed(job_id, owner):
+                logger.info(f'bulk job {job_id} claimed by another runner; leaving it at page {page}')
+                return
+            if _job_page_done(job_id, page):
+                continue
+            _job_write(job_id, 'lease', {'owner': owner, 'at': time.time(), 'page': page})
+            t0 = time.monotonic()
+            with _deadline(BATCH_DEADLINE_S):
+                items = _job_run_page(plan, page)
+            failed = sum(1 for _, result in items if not isinstance(result, dict) or 'error' in result)
+            _job_write(job_id, _job_page_name(page), {'page': page, 'items': items, 'failed': failed})
+            _job_write(job_id, _job_page_marker(page), {'page': page, 'at': time.time()})
+            _emit_metric(f'bulk_{plan["kind"]}', plan['profile'], plan['ors_host'], 200,
+                         int((time.monotonic() - t0) * 1000), None, None, caller='bulk_job',
+                         region=plan['region'], extra={'items': len(items), 'items_failed': failed})
+        logger.info(f'bulk job {job_id} finished ({plan["pages"]} pages)')
+    except Exception as e:
+        logger.error(f'bulk job {job_id} failed: {e}')
+        _job_write(job_id, 'failed', {'error': 'job_failed', 'message': str(e), 'at': time.time()})
+    finally:
+        with _BULK_JOBS_LOCK:
+            _BULK_JOBS['active'].discard(job_id)
+
+
+def _job_pool():
+    # Pools and the sweeper are per pid: threads do not survive the gunicorn fork.
+    # Caller holds _BULK_JOBS_LOCK.
+    if _BULK_JOBS['pid'] != os.getpid():
+        _BULK_JOBS.update({'pid': os.getpid(), 'active': set(), 'sweeper': None, 'pool': ThreadPoolExecutor(
+            max_workers=max(1, BULK_JOB_MAX_ACTIVE), thread_name_prefix='bulk-job')})
+        if not os.path.ismount(BULK_JOB_DIR):
+            logger.warning(f'BULK_JOB_DIR {BULK_JOB_DIR} is not a mounted volume: bulk jobs are only '
+                           f'visible to this gateway instance')
+    return _BULK_JOBS['pool']
 
-    for i in range(0, len(destinations_idx), chunk_size):
-        chunk_dests = destinations_idx[i:i + chunk_size]
-        body = {
-            'locations': locations,
-            'sources': sources_idx,
-            'destinations': chunk_dests,
-            'metrics': ['distance', 'duration'],
-            'resolve_locations': True
-        }
-        resp = get_ors_response('matrix', profile, body, format, ors_host)
-        if 'error' in resp:
-            if chunk_size > 10 and _depth < MAX_DEPTH:
-                partial = _retry_matrix_chunked(
-                    profile, locations, sources_idx, chunk_dests, format, ors_host, 10,
-                    _depth=_depth + 1,
-                )
-                if partial and 'error' not in partial:
-                    if all_durations is None:
-                        all_durations = [[] for _ in partial.get('durations', [])]
-                        all_distances = [[] for _ in partial.get('distances', [])]
-                    for r_idx, dur_row in enumerate(partial.get('durations', [])):
-                        all_durations[r_idx].extend(dur_row)
-                    for r_idx, dist_row in enumerate(partial.get('distances', [])):
-                        all_distances[r_idx].extend(dist_row)
-                    # Propagate any partial markers from the inner call.
-                    if partial.get('_partial'):
-                        failed_destinations.extend(partial.get('failed_destinations', []))
-                    continue
-            # Either we are at the smallest chunk_size or recursion is
-            # exhausted: record the failed destination indices instead of
-            # silently dropping them.
-            failed_destinations.extend(chunk_dests)
+
+def _job_start(job_id, adopting=False):
+    """Run the job on this worker unless it is busy; True if started.
+    `adopting` takes over a stale job another instance may also be adopting."""
+    with _BULK_JOBS_LOCK:
+        pool = _job_pool()
+        if job_id in _BULK_JOBS['active'] or len(_BULK_JOBS['active']) >= BULK_JOB_MAX_ACTIVE:
+            return False
+        _BULK_JOBS['active'].add(job_id)
+        _job_write(job_id, 'lease', {'owner': _job_owner(), 'at': time.time(), 'page': None})
+        pool.submit(_job_runner, job_id, adopting)
+    return True
+
+
+def _job_reap():
+    cutoff = time.time() - BULK_JOB_TTL_S
+    try:
+        names = os.listdir(BULK_JOB_DIR)
+    except OSError:
+        return
+    for name in names:
+        plan = _job_read(name, 'job.json') if _job_dir(name) else None
+        if plan is not None and plan['created_at'] < cutoff:
+            shutil.rmtree(_job_dir(name), ignore_errors=True)
+
+
+def _job_sweep():
+    """Adopt the stale jobs this worker has room for; True while any job is
+    unfinished. Deletes expired jobs at most once per BULK_JOB_REAP_INTERVAL_S."""
+    now = time.time()
+    if now - _BULK_JOBS['last_reap'] >= BULK_JOB_REAP_INTERVAL_S:
+        _BULK_JOBS['last_reap'] = now
+        _job_reap()
+    try:
+        names = os.listdir(BULK_JOB_DIR)
+    except OSError:
+        return False
+    unfinished = False
+    for name in names:
+        status = _job_status(name) if _job_dir(name) else None
+        if status is None or status['status'] not in ('queued', 'running'):
             continue
+        unfinished = True
+        if status['status'] == 'queued':
+            _job_start(name, adopting=True)
+    return unfinished
 
-        if all_durations is None:
-            all_durations = [[] for _ in resp.get('durations', [])]
-            all_distances = [[] for _ in resp.get('distances', [])]
-        for r_idx, dur_row in enumerate(resp.get('durations', [])):
-            all_durations[r_idx].extend(dur_row)
-        for r_idx, dist_row in enumerate(resp.get('distances', [])):
-            all_distances[r_idx].extend(dist_row)
 
-    if all_durations is None:
-        return {'error': 'all_chunks_failed', 'message': 'All matrix chunks failed'}
+def _job_sweeper_loop():
+    while True:
+        time.sleep(BULK_JOB_SWEEP_S)
+        try:
+            if _job_sweep():
+                continue
+        except Exception as e:
+            logger.error(f'bulk job sweep failed: {e}')
+            continue
+        with _BULK_JOBS_LOCK:
+            # Re-checked by the next bulk call, which starts a new sweeper.
+            _BULK_JOBS['sweeper'] = None
+            return
 
-    result = {
-        'durations': all_durations,
-        'distances': all_distances,
-        'sources': sources_idx,
-        'destinations': destinations_idx
+
+def _ensure_job_sweeper():
+    with _BULK_JOBS_LOCK:
+        _job_pool()
+        if _BULK_JOBS['sweeper'] is not None:
+            return
+        _BULK_JOBS['sweeper'] = threading.Thread(target=_job_sweeper_loop, name='bulk-job-sweeper', daemon=True)
+        _BULK_JOBS['sweeper'].start()
+
+
+def _job_status(job_id):
+    """Status of a job as stored; never starts or adopts it. A job whose
+    runner's lease has expired is `queued` until a sweeper adopts it."""
+    plan = _job_read(job_id, 'job.json') if _job_dir(job_id) else None
+    if plan is None:
+        return {'error': 'unknown_job', 'job_id': job_id,
+                'message': f'No bulk job {job_id} (never submitted, or older than {BULK_JOB_TTL_S}s).'}
+    try:
+        done = sum(1 for name in os.listdir(_job_dir(job_id)) if name.startswith('page-') and name.endswith('.done'))
+    except OSError:
+        done = 0
+    failed = _job_read(job_id, 'failed')
+    if done >= plan['pages']:
+        status = 'done'
+    elif os.path.exists(os.path.join(_job_dir(job_id), 'cancelled')):
+        status = 'cancelled'
+    elif failed is not None:
+        status = 'failed'
+    else:
+        lease = _job_read(job_id, 'lease')
+        if lease is None:
+            # No lease yet: never started. Present but unreadable: being rewritten.
+            stale = not os.path.exists(os.path.join(_job_dir(job_id), 'lease'))
+        else:
+            stale = time.time() - lease.get('at', 0) > BULK_JOB_LEASE_S
+        status = 'queued' if stale else 'running'
+    out = {
+        'job_id': job_id,
+        'kind': plan['kind'],
+        'status': status,
+        'region': plan['region'],
+        'pages': plan['pages'],
+        'pages_done': min(done, plan['pages']),
+        'items_total': plan['items_total'],
+        'items_done': min(plan['items_total'], done * plan['page_items']),
+        'page_items': plan['page_items'],
+        'created_at': datetime.fromtimestamp(plan['created_at'], timezone.utc).isoformat(),
     }
-    if failed_destinations:
-        result['_partial'] = True
-        result['failed_destinations'] = failed_destinations
-    return result
+    if status == 'failed':
+        out['message'] = failed.get('message')
+    return out
 
 
-@app.post("/matrix_tabular")
-@app.post("/matrix_tabular/<format>")
-def post_matrix_tabular(format="json"):
+def _job_submit(kind, spec, region):
+    try:
+        plan = _job_plan(kind, spec, region)
+    except ValueError as e:
+        return {'error': 'invalid_job', 'message': str(e)}
+    job_id = uuid.uuid4().hex
+    os.makedirs(_job_dir(job_id), exist_ok=True)
+    _job_write(job_id, 'job.json', plan)
+    _job_start(job_id)
+    logger.info(f'bulk job {job_id} submitted: {kind}, {plan["items_total"]} items in {plan["pages"]} pages')
+    return _job_status(job_id)
+
+
+def _job_resume(job_id):
+    """Clear a job's `failed` / `cancelled` marker and expire its lease, so it
+    resumes at its first unfinished page: here if this worker has room,
+    otherwise on the next sweep of any worker."""
+    status = _job_status(job_id)
+    if 'error' in status or status['status'] == 'done':
+        return status
+    if status['status'] in ('failed', 'cancelled'):
+        for name in ('failed', 'cancelled', 'lease'):
+            try:
+                os.remove(os.path.join(_job_dir(job_id), name))
+            except FileNotFoundError:
+                pass
+        logger.info(f'bulk job {job_id} resumed after {status["status"]} at page {status["pages_done"]}')
+    if status['status'] != 'running':
+        _job_start(job_id, adopting=True)
+    return _job_status(job_id)
+
+
+@app.post("/bulk_jobs_submit")
+def post_bulk_jobs_submit():
     """
-    row = [id, method, origin, destinations, region]  (MATRIX_TABULAR 3-arg)
-    row = [id, method, locations, region]              (MATRIX 2-arg)
-    region is the LAST column and can be NULL.
+    row = [id, kind, spec, region]
+    kind is 'isochrones' or 'matrix'; region is the LAST column and can be NULL.
     """
-    message = request.json
-    logger.debug(f'Received request: {message}')
-    input_rows = _parse_rows(message)
+    input_rows = _parse_rows(request.json)
     if not input_rows:
         return {}
+    _ensure_job_sweeper()
+    output_rows = [[row[0], _job_submit(row[1], row[2], _extract_region(row, 3))] for row in input_rows]
+    return _make_response(output_rows)
 
-    def _process_row(row):
-        region = _extract_region(row, -1)
-        ors_host = resolve_ors_host(region)
-        data_cols = row[1:-1]
-        method = data_cols[0]
-        has_dest = len(data_cols) == 3
-        body = _build_matrix_body(method, data_cols[1:], has_dest)
-        resp = get_ors_response('matrix', method, body, format, ors_host)
-        error_obj = resp.get('error') if isinstance(resp, dict) else None
-        if isinstance(error_obj, dict) and error_obj.get('code') == 6099 and has_dest:
-            origin = data_cols[1]
-            destinations = data_cols[2]
-            if origin and not isinstance(origin[0], list):
-                origin = [origin]
-            locations = origin + destinations
-            sources_idx = list(range(len(origin)))
-            destinations_idx = list(range(len(origin), len(locations)))
-            resp = _retry_matrix_chunked(method, locations, sources_idx, destinations_idx, format, ors_host)
-        return [row[0], resp]
-
-    with ThreadPoolExecutor(max_workers=MATRIX_CONCURRENCY) as executor:
-        output_rows = list(executor.map(_process_row, input_rows))
 
-    logger.info(f'Produced {len(output_rows)} rows')
-    return _make_response(output_rows)
+@app.post("/bulk_jobs_status")
+def post_bulk_jobs_status():
+    """row = [id, job_id]"""
+    input_rows = _parse_rows(request.json)
+    if not input_rows:
+        return {}
+    _ensure_job_sweeper()
+    return _make_response([[row[0], _job_status(row[1])] for row in input_rows])
 
 
-@app.post("/matrix")
-@app.post("/matrix/<format>")
-def post_matrix(format="json"):
+@app.post("/bulk_jobs_fetch")
+def post_bulk_jobs_fetch():
     """
-    row = [id, method, options, region]
-    region is the LAST column and can be NULL.
+    row = [id, job_id, page]
+    Returns the page's items plus next_page (NULL after the last page).
+    Pages can be fetched as soon as they finish, in any order.
     """
-    message = request.json
-    logger.debug(f'Received request: {message}')
-    input_rows = _parse_rows(message)
+    input_rows = _parse_rows(request.json)
     if not input_rows:
         return {}
-
+    _ensure_job_sweeper()
     output_rows = []
     for row in input_rows:
-        region = _extract_region(row, 3)
-        ors_host = resolve_ors_host(region)
-        body = row[2]
-        if isinstance(body, list):
-            body = {
-                'locations': body,
-                'metrics': ['distance', 'duration'],
-                'resolve_locations': True
-            }
-        output_rows.append([row[0], get_ors_response('matrix', row[1], body, format, ors_host)])
+        job_id, page = row[1], row[2] or 0
+        status = _job_status(job_id)
+        if 'error' in status:
+            output_rows.append([row[0], status])
+            continue
+        valid = isinstance(page, int) and 0 <= page < status['pages']
+        data = _job_read(job_id, _job_page_name(page)) if valid and _job_page_done(job_id, page) else None
+        if data is None:
+            output_rows.append([row[0], dict(status, error='page_not_ready', page=page,
+                                             message=f'Page {page} of {status["pages"]} is not available '
+                                                     f'(job {status["status"]}).')])
+            continue
+        output_rows.append([row[0], {
+            'job_id': job_id,
+            'status': status['status'],
+            'page': page,
+            'pages': status['pages'],
+            'next_page': page + 1 if page + 1 < status['pages'] else None,
+            'items_failed': data['failed'],
+            'items': data['items'],
+        }])
+    return _make_response(output_rows)
 
-    logger.info(f'Produced {len(output_rows)} rows')
+
+@app.post("/bulk_jobs_cancel")
+def post_bulk_jobs_cancel():
+    """row = [id, job_id]; the running page finishes, later pages are skipped."""
+    input_rows = _parse_rows(request.json)
+    if not input_rows:
+        return {}
+    output_rows = []
+    for row in input_rows:
+        if _job_dir(row[1]) and _job_read(row[1], 'job.json') is not None:
+            _job_write(row[1], 'cancelled', {'at': time.time()})
+        output_rows.append([row[0], _job_status(row[1])])
     return _make_response(output_rows)
 
 
-def get_vroom_response(payload, vroom_host=None):
-    logger.info(payload)
+@app.post("/bulk_jobs_resume")
+def post_bulk_jobs_resume():
+    """row = [id, job_id]; restarts a failed, cancelled or stalled job at its
+    first unfinished page."""
+    input_rows = _parse_rows(request.json)
+    if not input_rows:
+        return {}
+    _ensure_job_sweeper()
+    return _make_response([[row[0], _job_resume(row[1])] for row in input_rows])
+
+
+# ---------------------------------------------------------------------------
+# Single-flight coalescing of identical in-flight downstream calls.
+#
+# When a Snowflake query fans out, several gateway threads ask for the same
+# directions / matrix / isochrones body at the same moment, and the agent
+# retries while the first call is still running. get_ors_response and
+# get_vroom_response now key each call by (host, endpoint, hash of the
+# canonical body) -- the body is encoded once with sorted keys and those
+# bytes are both hashed and sent. While a call with that key is in flight,
+# identical calls wait for it instead of going downstream, then get their
+# own copy of its result (decoded from one encoding of it, since callers
+# mutate the response dicts). Exceptions propagate to every waiter, except
+# the leader's own DeadlineExceeded or cancellation: those say nothing about
+# the call, only about the leader's budget, so a waiter then retries it
+# within its own deadline (as the new leader unless another waiter already
+# took over). A cache-bypass call (?cache=bypass) is keyed apart from the
+# others, so it never receives a cached answer through a leader that was
+# allowed to read the cache.
+#
+# Coalescing is per worker process (gunicorn workers do not share memory);
+# the caches above cover repeats across time. ORS_SINGLE_FLIGHT=0 disables
+# it. Leader / coalesced counts are flushed as a `single_flight` event every
+# ORS_SINGLE_FLIGHT_METRIC_INTERVAL_S.
+# ---------------------------------------------------------------------------
+ORS_SINGLE_FLIGHT = int(os.getenv('ORS_SINGLE_FLIGHT', '1'))
+ORS_SINGLE_FLIGHT_METRIC_INTERVAL_S = int(os.getenv('ORS_SINGLE_FLIGHT_METRIC_INTERVAL_S', '60'))
+
+_IN_FLIGHT = {}  # key -> {done: Event, followers: int, result, raw, error}
+_IN_FLIGHT_STATE = {'leaders': 0, 'coalesced': 0, 'last_emit': time.monotonic()}
+_IN_FLIGHT_LOCK = threading.Lock()
+
+
+def _flight_key(host, endpoint, body, use_cache=True):
+    digest = hashlib.sha256(f'{host}|{endpoint}|{"" if use_cache else "bypass"}|'.encode('utf-8'))
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def _flush_single_flight_metric():
+    now = time.monotonic()
+    with _IN_FLIGHT_LOCK:
+        st = _IN_FLIGHT_STATE
+        if now - st['last_emit'] < ORS_SINGLE_FLIGHT_METRIC_INTERVAL_S:
+            return
+        counts = {'flight_leaders': st['leaders'], 'flight_coalesced': st['coalesced'],
+                  'flight_in_progress': len(_IN_FLIGHT)}
+        st['leaders'] = st['coalesced'] = 0
+        st['last_emit'] = now
+    _emit_metric('single_flight', None, None, 200, 0, None, None,
+                 caller='single_flight', extra=counts)
+
+
+def _flight_error_unshared(error):
+    """True for a leader's error that belongs to the leader, not the call:
+    its own deadline, or cancellation (GreenletExit and the like)."""
+    return isinstance(error, DeadlineExceeded) or not isinstance(error, Exception)
+
+
+def _single_flight(key, call):
+    """call() once per key at a time; concurrent callers with the same key
+    wait (until their own deadline at most) and receive a copy of its result."""
+    if not ORS_SINGLE_FLIGHT:
+        return call()
+    while True:
+        with _IN_FLIGHT_LOCK:
+            flight = _IN_FLIGHT.get(key)
+            leader = flight is None
+            if leader:
+                flight = {'done': threading.Event(), 'followers': 0, 'result': None, 'raw': None, 'error': None}
+                _IN_FLIGHT[key] = flight
+                _IN_FLIGHT_STATE['leaders'] += 1
+            else:
+                flight['followers'] += 1
+                _IN_FLIGHT_STATE['coalesced'] += 1
+        _flush_single_flight_metric()
+        if leader:
+            break
+        with _span('single_flight_wait'):
+            remaining = _deadline_remaining()
+            if not flight['done'].wait(None if remaining is None else max(0.0, remaining)):
+                raise DeadlineExceeded()
+        error = flight['error']
+        if error is None:
+            return _json_decode(flight['raw'])
+        if not _flight_error_unshared(error):
+            raise error
+    try:
+        flight['result'] = call()
+        return flight['result']
+    except BaseException as e:
+        flight['error'] = e
+        raise
+    finally:
+        with _IN_FLIGHT_LOCK:
+            _IN_FLIGHT.pop(key, None)
+            followers = flight['followers']
+        if followers and flight['error'] is None:
+            flight['raw'] = _json_encode(flight['result'])
+        flight['done'].set()
+
+
+# ---------------------------------------------------------------------------
+# VROOM route geometry: vectorized decode, optional encoded passthrough.
+#
+# VROOM returns each route's geometry as an encoded polyline (precision 5)
+# and the gateway expands it to [[lon, lat], ...]. polyline.decode walks the
+# string a character at a time in Python and builds a tuple per point; on a
+# large solve that was the biggest CPU cost of the row, and the expanded
+# lists are what push OPTIMIZATION responses toward the 20MB cap.
+# _decode_polyline does the same decode as array operations (group
+# boundaries, 5-bit chunks, zigzag, running sum) and yields the same floats;
+# a malformed string falls back to polyline.decode.
+#
+# Callers that decode polylines themselves can skip the expansion with
+# options.polyline=true in the OPTIMIZATION challenge, or ?polyline=true on
+# /optimization and /optimization_tabular: route geometry then stays the
+# encoded string. Routes whose geometry the gateway rebuilds from ORS are
+# encoded too (precision 5, ~1m), so every route comes back in one shape.
+# The flag is gateway-only and is not forwarded to VROOM. Decoding happens
+# after single-flight, so both modes share one solve.
+# ---------------------------------------------------------------------------
+def _polyline_requested():
+    return (request.args.get('polyline') or '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _pop_polyline_option(challenge, default=False):
+    """options.polyline of a VROOM challenge (removed from it), else default."""
+    options = challenge.get('options') if isinstance(challenge, dict) else None
+    if not isinstance(options, dict) or 'polyline' not in options:
+        return default
+    options = dict(options)
+    flag = bool(options.pop('polyline'))
+    challenge['options'] = options
+    return flag
+
+
+def _decode_polyline(encoded, precision=5):
+    """Encoded polyline -> [[lon, lat], ...], same values as polyline.decode."""
+    if not encoded:
+        return []
+    try:
+        b = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    except UnicodeEncodeError:
+        b = None
+    if b is None or b.min() < 0 or b.max() > 63 or b[-1] >= 0x20:
+        return [[lon, lat] for lat, lon in decode(encoded, precision)]
+    ends = np.flatnonzero(b < 0x20)
+    if len(ends) % 2:
+        return [[lon, lat] for lat, lon in decode(encoded, precision)]
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shift = 5 * (np.arange(len(b)) - np.repeat(starts, ends - starts + 1))
+    values = np.add.reduceat((b & 0x1f) << shift, starts)
+    values = (values >> 1) ^ -(values & 1)
+    latlon = np.cumsum(values.reshape(-1, 2), axis=0) / float(10 ** precision)
+    return latlon[:, ::-1].tolist()
+
+
+def _encode_polyline(line, precision=5):
+    if not line:
+        return ''
+    return encode([(point[1], point[0]) for point in line], precision)
+
+
+def _decode_route_geometry(resp):
+    if not isinstance(resp, dict) or not isinstance(resp.get('routes'), list):
+        return
+    with _span('polyline_decode'):
+        for route in resp['routes']:
+            if isinstance(route, dict) and isinstance(route.get('geometry'), str):
+                route['geometry'] = _decode_polyline(route['geometry'])
+
+
+def get_vroom_response(payload, vroom_host=None, encoded_geometry=False):
+    host = vroom_host or resolve_vroom_host(None)
+    with _span('vroom.encode'):
+        body = _json_encode(payload, sort_keys=True)
+    try:
+        resp = _single_flight(_flight_key(host, 'vroom', body), lambda: _get_vroom_response(body, host))
+        if not encoded_geometry:
+            _decode_route_geometry(resp)
+        return resp
+    except DeadlineExceeded:
+        logger.error(f'VROOM solve on {host} abandoned at the request deadline')
+        return {'error': 'deadline_exceeded',
+                'message': f'VROOM optimization on {host} did not finish before the request deadline '
+                           f'({BATCH_DEADLINE_S}s per batch)'}
+
+
+def _post_vroom(host, body):
+    timeout_s, bound = _deadline_timeout(300)
+    try:
+        with _host_slot(host) as slot, _pooled_session(host) as session, _span('vroom.http', host=host):
+            slot['deadline_bound'] = bound
+            r = session.post(url=f'http://{host}:{VROOM_PORT}', headers=JSON_HEADERS, data=body, timeout=timeout_s)
+            raw = r.content
+            slot['overloaded'] = r.status_code >= 500
+    except requests.exceptions.Timeout:
+        if bound:
+            raise DeadlineExceeded()
+        raise
+    return raw
+
+
+def _get_vroom_response(body, host):
     default_vroom_host = resolve_vroom_host(None)
-    host = vroom_host or default_vroom_host
     downstream_url = f'http://{host}:{VROOM_PORT}'
-    downstream_headers = {"Content-Type": "application/json"}
+    logger.info(f'Calling VROOM: {downstream_url} ({len(body)} bytes)')
     try:
-        r = requests.post(url=downstream_url, headers=downstream_headers, json=payload, timeout=300)
-        vroom_r = r.json()
+        raw = _post_vroom(host, body)
+        with _span('vroom.decode'):
+            vroom_r = _json_decode(raw)
     except requests.exceptions.ConnectionError:
         # Per-region VROOM unreachable. Fall back to the default-region VROOM service.
         if host != default_vroom_host:
             logger.warning(f'Per-region VROOM at {host} unreachable; falling back to default {default_vroom_host}')
             try:
-                r = requests.post(url=f'http://{default_vroom_host}:{VROOM_PORT}',
-                                  headers=downstream_headers, json=payload, timeout=300)
-                vroom_r = r.json()
+                raw = _post_vroom(default_vroom_host, body)
+                with _span('vroom.decode'):
+                    vroom_r = _json_decode(raw)
             except requests.exceptions.ConnectionError:
                 logger.error(f'Cannot connect to VROOM at {default_vroom_host}:{VROOM_PORT} (fallback)')
                 return {'error': 'connection_failed', 'message': f'Cannot connect to VROOM service at {host} or fallback {default_vroom_host}:{VROOM_PORT}'}
+            except requests.exceptions.Timeout:
+                logger.error(f'VROOM request timed out at {default_vroom_host} (fallback)')
+                return {'error': 'timeout', 'message': 'VROOM optimization request timed out'}
         else:
             logger.error(f'Cannot connect to VROOM at {host}:{VROOM_PORT}')
             return {'error': 'connection_failed', 'message': f'Cannot connect to VROOM service at {host}:{VROOM_PORT}'}
     except requests.exceptions.Timeout:
         logger.error(f'VROOM request timed out at {host}')
         return {'error': 'timeout', 'message': 'VROOM optimization request timed out'}
-    logger.debug(f'VROOM response from {host}: {vroom_r}')
-    if 'routes' in vroom_r:
-        for route in vroom_r['routes']:
-            if 'geometry' in route:
-                decoded_geometry = decode(route['geometry'])
-                route['geometry'] = [[lon, lat] for lat, lon in decoded_geometry]
+    logger.debug(f'VROOM response from {host}: {len(raw)} bytes')
     return vroom_r
 
 
@@ -945,7 +3999,7 @@ def _annotate_engine_error(resp, host, payload):
 
 
 # ---------------------------------------------------------------------------
-# Circuit breaker around per-host ORS calls (#50).
+# Circuit breaker around per-host, per-lane ORS calls (#50).
 #
 # State machine:
 #   CLOSED    -- normal, all calls pass through.
@@ -962,9 +4016,16 @@ def _annotate_engine_error(resp, host, payload):
 #                                              accumulates over
 #   ORS_BREAKER_COOLDOWN_S          default 30 seconds OPEN -> HALF_OPEN
 #
-# Per-host -- a single bad region cannot drag down the gateway for healthy
-# regions. Counters held in-process; on container restart we start clean
-# (acceptable; the gateway is stateless by design).
+# Per (host, lane) -- a single bad region cannot drag down the gateway for
+# healthy regions, and isochrones timing out on a continental graph do not
+# cut off interactive directions or matrix calls to the same host (lanes as
+# in "Adaptive per-host concurrency limit"). Opening a breaker no longer
+# drops the host's shared limit to the floor, which would throttle the other
+# lanes too; the limit has already backed off on the failures themselves.
+# State is shared by all gunicorn workers on the container through
+# the gateway state db, so every worker opens, half-opens and closes together;
+# on container restart we start clean (acceptable; the gateway is stateless
+# by design).
 # ---------------------------------------------------------------------------
 ORS_BREAKER_FAILURE_THRESHOLD = int(os.getenv('ORS_BREAKER_FAILURE_THRESHOLD', '5'))
 ORS_BREAKER_ROLLING_WINDOW_S = int(os.getenv('ORS_BREAKER_ROLLING_WINDOW_S', '30'))
@@ -1024,8 +4085,9 @@ def _validate_request(endpoint, payload, host=None):
             return False, _guardrail_response(
                 endpoint, host,
                 f'Matrix payload has {len(locations)} locations; gateway cap is '
-                f'{GUARDRAIL_MATRIX_MAX_LOCATIONS}. Reduce the request, or chunk via '
-                f'OPTIMIZATION_TABULAR / _retry_matrix_chunked which already splits.',
+                f'{GUARDRAIL_MATRIX_MAX_LOCATIONS}. Reduce the request, resend with '
+                f'?tiled=true (options.tiled=true on MATRIX) to have the gateway split it '
+                f'into tiles, or chunk via OPTIMIZATION_TABULAR / _retry_matrix_chunked.',
                 {'max_locations': GUARDRAIL_MATRIX_MAX_LOCATIONS, 'observed_locations': len(locations)},
             )
     elif endpoint == 'isochrones':
@@ -1064,85 +4126,521 @@ def _validate_request(endpoint, payload, host=None):
             )
     return True, None
 
-_BREAKER_STATE = {}  # host -> {failures: [ts...], open_until: float, state: 'CLOSED'|'OPEN'|'HALF_OPEN'}
+# Each worker keeps its breakers in _BREAKERS and merges them with the
+# shared rows on every _state_sync (see "Container-shared gateway state"):
+# 'host/lane' -> state 'CLOSED'|'OPEN'|'HALF_OPEN', open_until (wall clock),
+# failures (wall-clock timestamps inside the rolling window), and the
+# successes / failures not yet merged. HALF_OPEN is only ever local: the
+# shared row stays OPEN with an expired open_until.
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def _breaker_step(state, open_until, failures, event, now):
+    """(state, open_until, failures) after a 'success' or 'failure' at `now`;
+    applied to the local copy at once and replayed on the shared row."""
+    if event == 'success':
+        # A call that finished before the breaker tripped cannot close it.
+        if state != 'CLOSED' and now < open_until - ORS_BREAKER_COOLDOWN_S:
+            return state, open_until, failures
+        return 'CLOSED', 0.0, []
+    # Drop failures outside the rolling window.
+    cutoff = now - ORS_BREAKER_ROLLING_WINDOW_S
+    failures = [t for t in failures if t >= cutoff] + [now]
+    half_open = state == 'HALF_OPEN' or (state == 'OPEN' and now >= open_until)
+    if half_open or len(failures) >= ORS_BREAKER_FAILURE_THRESHOLD:
+        return 'OPEN', max(open_until, now + ORS_BREAKER_COOLDOWN_S), failures
+    return state, open_until, failures
+
+
+def _breaker_record(b, event, now):
+    b['state'], b['open_until'], b['failures'] = _breaker_step(
+        b['state'], b['open_until'], b['failures'], event, now)
+    b['events'].append((event, now))
 
 
-def _breaker_check(host):
+def _breaker_check(host, lane):
     """Returns (allow, reason). allow=False means fail fast without calling ORS."""
-    st = _BREAKER_STATE.get(host)
-    if not st:
-        return True, None
-    now = time.monotonic()
-    if st['state'] == 'OPEN':
-        if now >= st.get('open_until', 0):
-            st['state'] = 'HALF_OPEN'
-            logger.warning(f'circuit-breaker HALF_OPEN for {host} after cooldown')
+    now = time.time()
+    with _BREAKERS_LOCK:
+        b = _BREAKERS.get(f'{host}/{lane}')
+        if not b or b['state'] != 'OPEN':
             return True, None
-        return False, 'circuit_open'
+        if now < b['open_until']:
+            return False, 'circuit_open'
+        b['state'] = 'HALF_OPEN'
+    logger.warning(f'circuit-breaker HALF_OPEN for {host} ({lane}) after cooldown')
     return True, None
 
 
-def _breaker_on_success(host):
-    st = _BREAKER_STATE.get(host)
-    if not st:
-        return
-    if st['state'] != 'CLOSED':
-        logger.warning(f'circuit-breaker CLOSED for {host}')
-    st['state'] = 'CLOSED'
-    st['failures'] = []
-    st['open_until'] = 0
+def _breaker_on_success(host, lane):
+    with _BREAKERS_LOCK:
+        b = _BREAKERS.get(f'{host}/{lane}')
+        if not b or (b['state'] == 'CLOSED' and not b['failures']):
+            return
+        was = b['state']
+        _breaker_record(b, 'success', time.time())
+        closed = was != 'CLOSED' and b['state'] == 'CLOSED'
+    if closed:
+        logger.warning(f'circuit-breaker CLOSED for {host} ({lane})')
 
 
-def _breaker_on_failure(host):
-    now = time.monotonic()
-    st = _BREAKER_STATE.setdefault(host, {'failures': [], 'open_until': 0, 'state': 'CLOSED'})
-    # Drop failures outside the rolling window.
-    cutoff = now - ORS_BREAKER_ROLLING_WINDOW_S
-    st['failures'] = [t for t in st['failures'] if t >= cutoff]
-    st['failures'].append(now)
-    if st['state'] == 'HALF_OPEN' or len(st['failures']) >= ORS_BREAKER_FAILURE_THRESHOLD:
-        st['state'] = 'OPEN'
-        st['open_until'] = now + ORS_BREAKER_COOLDOWN_S
-        logger.error(f'circuit-breaker OPEN for {host} (failures={len(st["failures"])}, cooldown={ORS_BREAKER_COOLDOWN_S}s)')
+def _breaker_on_failure(host, lane):
+    now = time.time()
+    with _BREAKERS_LOCK:
+        b = _BREAKERS.setdefault(f'{host}/{lane}', {
+            'state': 'CLOSED', 'open_until': 0.0, 'failures': [], 'events': []})
+        was_open = b['state'] == 'OPEN' and now < b['open_until']
+        _breaker_record(b, 'failure', now)
+        opened = b['state'] == 'OPEN' and not was_open
+        failures = len(b['failures'])
+    _ensure_metric_flusher()
+    if opened:
+        logger.error(f'circuit-breaker OPEN for {host} ({lane}) (failures={failures}, cooldown={ORS_BREAKER_COOLDOWN_S}s)')
+
+
+def _breaker_snapshot():
+    """Take the successes / failures not yet merged, per breaker, for _state_sync."""
+    with _BREAKERS_LOCK:
+        events = {key: b['events'] for key, b in _BREAKERS.items() if b['events']}
+        for key in events:
+            _BREAKERS[key]['events'] = []
+    return events
+
+
+def _breaker_restore(events):
+    """Put back the events of a sync that did not reach the db."""
+    with _BREAKERS_LOCK:
+        for key, evs in events.items():
+            if key in _BREAKERS:
+                _BREAKERS[key]['events'] = evs + _BREAKERS[key]['events']
+
+
+def _breaker_sync_db(conn, events):
+    """Replay the events on the shared rows; returns every shared row as
+    {key: (state, open_until, failures)}."""
+    for key, evs in events.items():
+        row = conn.execute('SELECT state, open_until, failures FROM breaker WHERE host = ?', (key,)).fetchone()
+        state, open_until, failures = (row[0], row[1], json.loads(row[2])) if row else ('CLOSED', 0.0, [])
+        for event, t in evs:
+            state, open_until, failures = _breaker_step(state, open_until, failures, event, t)
+        conn.execute('INSERT OR REPLACE INTO breaker (host, state, open_until, failures) VALUES (?, ?, ?, ?)',
+                     (key, state, open_until, json.dumps(failures)))
+    return {key: (state, open_until, json.loads(failures)) for key, state, open_until, failures in conn.execute(
+        'SELECT host, state, open_until, failures FROM breaker')}
+
+
+def _breaker_merge(shared):
+    with _BREAKERS_LOCK:
+        for key, (state, open_until, failures) in shared.items():
+            b = _BREAKERS.setdefault(key, {'state': 'CLOSED', 'open_until': 0.0, 'failures': [], 'events': []})
+            if b['state'] == 'HALF_OPEN' and state == 'OPEN' and open_until == b['open_until']:
+                state = 'HALF_OPEN'
+            b['state'], b['open_until'], b['failures'] = state, open_until, failures
+            # Events recorded while the sync ran apply on top.
+            for event, t in b['events']:
+                b['state'], b['open_until'], b['failures'] = _breaker_step(
+                    b['state'], b['open_until'], b['failures'], event, t)
+
+
+# ---------------------------------------------------------------------------
+# Buffered metric emission and latency histograms.
+#
+# _emit_metric used to build, serialize, write and flush one [ORS_METRIC]
+# line on the request thread for every downstream call and every retry. At
+# matrix-build rates that was thousands of stdout syscalls a minute, and the
+# ingest procedure only reads the last 1000 log lines per run, so most
+# events never reached ORS_REQUEST_LOG anyway.
+#
+# Per-call events are now folded into in-process aggregates keyed by
+# (endpoint, profile, region, ors_host, status, error, caller): a count,
+# latency / byte sums and an HDR-style log-linear latency histogram (exact
+# below 32 ms, then 16 sub-buckets per power of two, i.e. <= 6.25% error).
+# A daemon thread writes one [ORS_METRIC] line per key every
+# METRIC_FLUSH_INTERVAL_S, all lines in one write. Each line keeps the
+# per-call fields INGEST_ORS_METRICS maps (latency_ms / req_bytes /
+# resp_bytes are per-call means) and adds `count`, `latency_max_ms`,
+# p50/p95/p99 and the sparse histogram `hist` ({bucket_ms: count}), which
+# the ingest stores so V_ORS_METRICS_SUMMARY merges percentiles exactly
+# across lines. The counter flushes of the pools, caches and limiters
+# (_PERIODIC_METRIC_CALLERS) are emitted once per interval by their owners;
+# they keep one line each, with their `extra` fields, but are written with
+# the batch. Any other event's numeric `extra` fields are summed into its
+# series (e.g. items per bulk-job page), so no caller can emit a line per
+# call.
+#
+# Every flush also records its aggregates in the shared state db, so
+# GET /metrics reports live p50/p95/p99 over the last METRIC_SCRAPE_WINDOW_S
+# for all gunicorn workers on the container (plus this worker's unflushed
+# interval), without a Snowflake round trip. The same thread runs the
+# gateway state sync (_state_sync) every GATEWAY_STATE_SYNC_S.
+# ---------------------------------------------------------------------------
+METRIC_FLUSH_INTERVAL_S = float(os.getenv('METRIC_FLUSH_INTERVAL_S', '10'))
+METRIC_SCRAPE_WINDOW_S = int(os.getenv('METRIC_SCRAPE_WINDOW_S', '300'))
+_HIST_SUB_BUCKET_BITS = 4
+
+_METRICS = {'series': {}, 'events': [], 'pid': None}
+_METRICS_LOCK = threading.Lock()
+_METRIC_KEY_FIELDS = ('endpoint', 'profile', 'region', 'ors_host', 'status', 'error', 'caller')
+# Callers that flush their own counters at most once per interval.
+_PERIODIC_METRIC_CALLERS = frozenset({
+    'session_pool', 'host_limit', 'matrix_cache', 'leg_cache', 'isochrone_cache', 'single_flight', 'matrix_cells',
+})
+
+
+def _hist_bucket(ms):
+    """Highest latency (ms) sharing `ms`'s histogram bucket."""
+    ms = max(0, int(ms))
+    if ms < 1 << (_HIST_SUB_BUCKET_BITS + 1):
+        return ms
+    shift = ms.bit_length() - 1 - _HIST_SUB_BUCKET_BITS
+    return (((ms >> shift) + 1) << shift) - 1
+
+
+def _hist_percentile(hist, q):
+    total = sum(hist.values())
+    if not total:
+        return None
+    target = q * total
+    seen = 0
+    for bucket in sorted(hist):
+        seen += hist[bucket]
+        if seen >= target:
+            return bucket
+    return max(hist)
+
+
+def _new_series():
+    return {'count': 0, 'latency_sum': 0, 'latency_n': 0, 'latency_max': None,
+            'req_sum': 0, 'req_n': 0, 'resp_sum': 0, 'resp_n': 0, 'hist': {}, 'extra': {}}
+
+
+def _merge_series(into, s):
+    into['count'] += s['count']
+    for field in ('latency_sum', 'latency_n', 'req_sum', 'req_n', 'resp_sum', 'resp_n'):
+        into[field] += s[field]
+    if s['latency_max'] is not None:
+        into['latency_max'] = max(into['latency_max'] or 0, s['latency_max'])
+    for bucket, n in s['hist'].items():
+        into['hist'][bucket] = into['hist'].get(bucket, 0) + n
+    for field, total in s.get('extra', {}).items():
+        into['extra'][field] = into['extra'].get(field, 0) + total
+
+
+def _series_summary(s):
+    def mean(total, n):
+        return round(total / n) if n else None
+    return {
+        **s.get('extra', {}),
+        'count': s['count'],
+        'latency_ms': mean(s['latency_sum'], s['latency_n']),
+        'req_bytes': mean(s['req_sum'], s['req_n']),
+        'resp_bytes': mean(s['resp_sum'], s['resp_n']),
+        'latency_max_ms': s['latency_max'],
+        'latency_p50_ms': _hist_percentile(s['hist'], 0.50),
+        'latency_p95_ms': _hist_percentile(s['hist'], 0.95),
+        'latency_p99_ms': _hist_percentile(s['hist'], 0.99),
+    }
+
+
+def _metric_ts():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _flush_metrics():
+    """Write the pending aggregates and events to stdout in one write and
+    record the aggregates for /metrics. Never raises."""
+    try:
+        with _METRICS_LOCK:
+            series, events = _METRICS['series'], _METRICS['events']
+            _METRICS['series'], _METRICS['events'] = {}, []
+        if not series and not events:
+            return
+        ts = _metric_ts()
+        lines = events
+        for key, agg in series.items():
+            payload = dict(zip(_METRIC_KEY_FIELDS, key))
+            payload.update(_series_summary(agg))
+            payload.update({'ts': ts, 'request_id': uuid.uuid4().hex,
+                            'interval_s': METRIC_FLUSH_INTERVAL_S,
+                            'hist': {str(b): n for b, n in sorted(agg['hist'].items())}})
+            lines.append(('[ORS_METRIC]', payload))
+        # Single-line objects so SPLIT_TO_TABLE works cleanly in the ingest proc.
+        sys.stdout.write(''.join(f'{marker} {_json_encode(line).decode("utf-8")}\n' for marker, line in lines))
+        sys.stdout.flush()
+        if series:
+            _state_call(_record_metric_series, [(json.dumps(list(key)), json.dumps(agg))
+                                                for key, agg in series.items()])
+    except Exception:
+        pass
+
+
+def _record_metric_series(rows):
+    now = time.time()
+    with _state_txn() as conn:
+        conn.executemany('INSERT INTO metric_series (pid, flushed_at, series_key, agg) VALUES (?, ?, ?, ?)',
+                         [(os.getpid(), now, key, agg) for key, agg in rows])
+        conn.execute('DELETE FROM metric_series WHERE flushed_at < ?', (now - METRIC_SCRAPE_WINDOW_S,))
+
+
+def _read_metric_series(window_s):
+    with _state_txn(write=False) as conn:
+        return conn.execute('SELECT series_key, agg FROM metric_series WHERE flushed_at >= ?',
+                            (time.time() - window_s,)).fetchall()
+
+
+def _metric_flusher_loop():
+    # Also runs the gateway state sync, every GATEWAY_STATE_SYNC_S.
+    flush_at = time.monotonic() + METRIC_FLUSH_INTERVAL_S
+    while True:
+        time.sleep(max(0.0, min(GATEWAY_STATE_SYNC_S, flush_at - time.monotonic())))
+        if time.monotonic() >= flush_at:
+            flush_at = time.monotonic() + METRIC_FLUSH_INTERVAL_S
+            _flush_metrics()
+        _state_sync()
+
+
+def _ensure_metric_flusher():
+    # Started lazily, once per process: a thread does not survive a fork.
+    if _METRICS['pid'] == os.getpid():
+        return
+    with _METRICS_LOCK:
+        if _METRICS['pid'] == os.getpid():
+            return
+        _METRICS['pid'] = os.getpid()
+    atexit.register(_flush_metrics)
+    threading.Thread(target=_metric_flusher_loop, name='metric-flusher', daemon=True).start()
 
 
 def _emit_metric(endpoint, profile, host, status, latency_ms, req_bytes, resp_bytes,
-                 error_code=None, caller=None, region=None, request_id=None):
-    """Stream one `[ORS_METRIC] {json}` line to stdout. Picked up by the
-    INGEST_ORS_METRICS Snowflake procedure on a 1-minute schedule (see
+                 error_code=None, caller=None, region=None, request_id=None, extra=None):
+    """Record one `[ORS_METRIC]` event for the next batch flush. Picked up by
+    the INGEST_ORS_METRICS Snowflake procedure on a 1-minute schedule (see
     08_observability.sql). Never raise from here -- a logging failure must
     never break a routing call. (#56)
+
+    `extra` adds event-specific fields; the ingest procedure ignores keys it
+    does not map to a column. A periodic counter flush (caller in
+    _PERIODIC_METRIC_CALLERS) keeps its own line; every other event is
+    aggregated per key, its numeric `extra` fields summed.
     """
     try:
-        payload = {
-            'ts': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
-            'request_id': request_id or uuid.uuid4().hex,
-            'endpoint': endpoint,
-            'profile': profile,
-            'region': region,
-            'ors_host': host,
-            'status': status,
-            'error': error_code,
-            'latency_ms': latency_ms,
-            'req_bytes': req_bytes,
-            'resp_bytes': resp_bytes,
-            'caller': caller,
-        }
-        # Single-line emission so SPLIT_TO_TABLE works cleanly in the ingest proc.
-        sys.stdout.write('[ORS_METRIC] ' + json.dumps(payload, separators=(',', ':')) + '\n')
-        sys.stdout.flush()
+        _ensure_metric_flusher()
+        if extra and caller in _PERIODIC_METRIC_CALLERS:
+            payload = {
+                'ts': _metric_ts(),
+                'request_id': request_id or uuid.uuid4().hex,
+                'endpoint': endpoint,
+                'profile': profile,
+                'region': region,
+                'ors_host': host,
+                'status': status,
+                'error': error_code,
+                'latency_ms': latency_ms,
+                'req_bytes': req_bytes,
+                'resp_bytes': resp_bytes,
+                'caller': caller,
+            }
+            payload.update(extra)
+            with _METRICS_LOCK:
+                _METRICS['events'].append(('[ORS_METRIC]', payload))
+            return
+        key = (endpoint, profile, region, host, status, None if error_code is None else str(error_code), caller)
+        bucket = _hist_bucket(latency_ms) if latency_ms is not None else None
+        with _METRICS_LOCK:
+            agg = _METRICS['series'].get(key)
+            if agg is None:
+                agg = _METRICS['series'][key] = _new_series()
+            agg['count'] += 1
+            if latency_ms is not None:
+                agg['latency_sum'] += latency_ms
+                agg['latency_n'] += 1
+                agg['latency_max'] = max(agg['latency_max'] or 0, latency_ms)
+                agg['hist'][bucket] = agg['hist'].get(bucket, 0) + 1
+            if req_bytes is not None:
+                agg['req_sum'] += req_bytes
+                agg['req_n'] += 1
+            if resp_bytes is not None:
+                agg['resp_sum'] += resp_bytes
+                agg['resp_n'] += 1
+            for field, value in (extra or {}).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    agg['extra'][field] = agg['extra'].get(field, 0) + value
+    except Exception:
+        pass
+
+
+def _emit_trace(line):
+    """Queue one `[GATEWAY_TRACE]` line for the next batch flush."""
+    try:
+        _ensure_metric_flusher()
+        with _METRICS_LOCK:
+            _METRICS['events'].append(('[GATEWAY_TRACE]', line))
     except Exception:
         pass
 
 
-def get_ors_response(function, profile, payload, format, ors_host=None, region_hint=None, caller='request'):
+@app.get("/metrics")
+def get_metrics():
+    """Live latency percentiles per (endpoint, profile, region, ors_host,
+    status) over the last `window_s` (default METRIC_SCRAPE_WINDOW_S)."""
+    try:
+        window_s = min(float(request.args.get('window_s', METRIC_SCRAPE_WINDOW_S)), METRIC_SCRAPE_WINDOW_S)
+    except ValueError:
+        window_s = METRIC_SCRAPE_WINDOW_S
+    merged = {}
+
+    def add(key, agg):
+        agg = dict(agg, hist={int(b): n for b, n in agg['hist'].items()})
+        scrape_key = tuple(key[:5])
+        if scrape_key not in merged:
+            merged[scrape_key] = {'series': _new_series(), 'errors': 0}
+        _merge_series(merged[scrape_key]['series'], agg)
+        if key[5] is not None or (key[4] or 0) >= 400:
+            merged[scrape_key]['errors'] += agg['count']
+
+    try:
+        rows = _state_call(_read_metric_series, window_s)
+    except sqlite3.Error as e:
+        # Busy or unavailable: this worker's unflushed interval only.
+        logger.debug(f'/metrics without the shared series ({e})')
+        rows = []
+    for key, agg in rows:
+        add(json.loads(key), json.loads(agg))
+    with _METRICS_LOCK:
+        pending = [(list(key), json.loads(json.dumps(agg))) for key, agg in _METRICS['series'].items()]
+    for key, agg in pending:
+        add(key, agg)
+    series = []
+    for key, entry in sorted(merged.items(), key=lambda kv: [str(k) for k in kv[0]]):
+        summary = _series_summary(entry['series'])
+        summary.update(dict(zip(_METRIC_KEY_FIELDS, key)), errors=entry['errors'])
+        series.append(summary)
+    return {'window_s': window_s, 'flush_interval_s': METRIC_FLUSH_INTERVAL_S, 'series': series}
+
+
+# ---------------------------------------------------------------------------
+# On-demand sampling profiler.
+#
+# When gateway latency rises there was no way to see where the Python time
+# goes inside a live worker short of redeploying with instrumentation.
+# GET /admin/profile?seconds=N samples every thread's stack
+# (sys._current_frames) each interval_ms for N seconds (at most
+# PROFILE_MAX_S) and returns the aggregated samples as collapsed stacks --
+# `thread;outer (file:line);...;inner (file:line) count` per line -- which
+# flamegraph.pl, speedscope and inferno read as is. Frames are labelled by
+# function definition line (`lines=1` uses the executing line instead);
+# `idle=0` drops samples parked in stdlib waits (locks, queues, sockets).
+#
+# Nothing is installed or sampled until the endpoint is called, so it costs
+# nothing otherwise. It answers 404 unless GATEWAY_ADMIN_TOKEN is set and
+# the caller sends it as X-Gateway-Admin-Token. One profile runs per worker
+# at a time (409 otherwise); the response covers the worker that served it
+# (X-Profile-Pid). In gevent mode the sampler runs on a native hub thread,
+# so the greenlet running on the worker's loop is what gets sampled.
+# ---------------------------------------------------------------------------
+GATEWAY_ADMIN_TOKEN = os.getenv('GATEWAY_ADMIN_TOKEN', '')
+PROFILE_MAX_S = int(os.getenv('PROFILE_MAX_S', '60'))
+
+_PROFILER_LOCK = threading.Lock()
+_IDLE_MODULES = ('threading.py', 'selectors.py', 'queue.py', 'socket.py', 'ssl.py', 'socketserver.py',
+                 'connection.py', 'hub.py', 'thread.py')
+
+
+def _admin_authorized():
+    supplied = request.headers.get('X-Gateway-Admin-Token') or ''
+    return bool(GATEWAY_ADMIN_TOKEN) and hmac.compare_digest(supplied.encode('utf-8'),
+                                                             GATEWAY_ADMIN_TOKEN.encode('utf-8'))
+
+
+def _sample_stacks(seconds, interval_s, with_lines, include_idle):
+    """{collapsed stack: samples} over `seconds`, excluding the sampler."""
+    counts = {}
+    labels = {}
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        own = sys._getframe()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if frame is own:
+                continue
+            if not include_idle and os.path.basename(frame.f_code.co_filename) in _IDLE_MODULES:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                line = frame.f_lineno if with_lines else code.co_firstlineno
+                label = labels.get((code, line))
+                if label is None:
+                    label = labels[(code, line)] = \
+                        f'{code.co_name} ({os.path.basename(code.co_filename)}:{line})'.replace(';', ':')
+                stack.append(label)
+                frame = frame.f_back
+            stack.append(names.get(ident, f'thread-{ident}').replace(';', ':').replace(' ', '_'))
+            key = ';'.join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+        samples += 1
+        del own
+        time.sleep(interval_s)
+    return counts, samples
+
+
+@app.get("/admin/profile")
+def admin_profile():
+    if not _admin_authorized():
+        return {'error': 'not_found'}, 404
+    try:
+        seconds = min(max(float(request.args.get('seconds', '10')), 0.1), PROFILE_MAX_S)
+        interval_s = min(max(float(request.args.get('interval_ms', '10')), 1.0), 1000.0) / 1000.0
+    except ValueError:
+        return {'error': 'bad_request', 'message': 'seconds and interval_ms must be numbers'}, 400
+    with_lines = request.args.get('lines') == '1'
+    include_idle = request.args.get('idle', '1') != '0'
+    if not _PROFILER_LOCK.acquire(blocking=False):
+        return {'error': 'profile_in_progress', 'message': 'Another profile is running on this worker.'}, 409
+    try:
+        logger.warning(f'Profiling worker {os.getpid()} for {seconds}s every {interval_s * 1000:.0f}ms')
+        if ASYNC_MODE:
+            import gevent
+            counts, samples = gevent.get_hub().threadpool.apply(
+                _sample_stacks, (seconds, interval_s, with_lines, include_idle))
+        else:
+            counts, samples = _sample_stacks(seconds, interval_s, with_lines, include_idle)
+    finally:
+        _PROFILER_LOCK.release()
+    body = ''.join(f'{stack} {n}\n' for stack, n in sorted(counts.items(), key=lambda kv: -kv[1]))
+    response = make_response(body)
+    response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+    response.headers['X-Profile-Pid'] = str(os.getpid())
+    response.headers['X-Profile-Samples'] = str(samples)
+    return response
+
+
+def get_ors_response(function, profile, payload, format, ors_host=None, region_hint=None, caller='request',
+                     use_cache=True):
     host = ors_host or resolve_ors_host(None)
     endpoint = "/".join(filter(None, [ORS_API_PATH, function, profile, format]))
     if not endpoint.startswith('/'):
         endpoint = '/' + endpoint
+    # Encoded once, canonically: these exact bytes are the single-flight key,
+    # are sent on every attempt, and their length is req_bytes.
+    with _span('ors.encode'):
+        body = _json_encode(payload, sort_keys=True)
+    try:
+        return _single_flight(
+            _flight_key(host, endpoint, body, use_cache),
+            lambda: _get_ors_response(function, profile, payload, body, format, host, endpoint, region_hint, caller,
+                                      use_cache))
+    except DeadlineExceeded:
+        logger.error(f'ORS {function} on {host} abandoned at the request deadline')
+        _emit_metric(function, profile, host, 504, 0, len(body), None,
+                     error_code='deadline_exceeded', caller=caller, region=region_hint, request_id=uuid.uuid4().hex)
+        return _deadline_error(host)
+
 
+def _get_ors_response(function, profile, payload, body, format, host, endpoint, region_hint, caller, use_cache):
     downstream_url = f'http://{host}:{ORS_PORT}{endpoint}'
-    downstream_headers = {"Content-Type": "application/json"}
     # Isochrones on large graphs (e.g. USA driving-hgv) can take > 120 s because
     # fastisochrones preparation is not enabled. Use a longer per-endpoint
     # timeout for isochrones to avoid silent gateway-side cliffs.
@@ -1152,14 +4650,8 @@ def get_ors_response(function, profile, payload, format, ors_host=None, region_h
         timeout_s = ORS_TIMEOUT_MATRIX
     else:
         timeout_s = ORS_TIMEOUT_DEFAULT
-    logger.info(f'Calling: {downstream_url} (timeout={timeout_s}s)')
-    logger.info(f'Payload: {payload}')
-
-    # Pre-compute payload byte size once for observability.
-    try:
-        req_bytes = len(json.dumps(payload).encode('utf-8'))
-    except Exception:
-        req_bytes = None
+    req_bytes = len(body)
+    logger.info(f'Calling: {downstream_url} (timeout={timeout_s}s, {req_bytes} bytes)')
 
     # Request-size guardrails (#51). Fail fast with a structured 4xx-shape
     # before burning the gateway timeout budget on a request the engine
@@ -1171,15 +4663,28 @@ def get_ors_response(function, profile, payload, format, ors_host=None, region_h
                      error_code='request_too_large', caller=caller, region=region_hint, request_id=req_id)
         return guard_err
 
+    # Matrix result cache. Checked before the breaker: a hit never touches ORS.
+    cache_key = cache_stamp = None
+    if function == 'matrix':
+        t0 = time.monotonic()
+        with _span('ors.cache'):
+            cache_key, cache_stamp, cached = _matrix_cache_lookup(host, profile, format, payload, use_cache)
+            resp = _json_decode(cached) if cached is not None else None
+        if cached is not None:
+            _emit_metric(function, profile, host, 200, int((time.monotonic() - t0) * 1000), req_bytes, len(cached),
+                         caller=f'{caller}.cache_hit', region=region_hint, request_id=uuid.uuid4().hex)
+            return resp
+
     # Circuit breaker (#50). Fail fast without touching ORS while OPEN.
-    allow, breaker_reason = _breaker_check(host)
+    lane = _lane_of(function)
+    allow, breaker_reason = _breaker_check(host, lane)
     if not allow:
         req_id = uuid.uuid4().hex
         _emit_metric(function, profile, host, 503, 0, req_bytes, None,
                      error_code='circuit_open', caller=caller, region=region_hint, request_id=req_id)
         return {
             'error': 'circuit_open',
-            'message': f'Circuit breaker is OPEN for {host} after repeated failures. '
+            'message': f'Circuit breaker is OPEN for {function} calls to {host} after repeated failures. '
                        f'Calls will resume after the {ORS_BREAKER_COOLDOWN_S}s cooldown. '
                        f'See the Observability page for the failing endpoint history.',
             'ors_host': host,
@@ -1190,12 +4695,18 @@ def get_ors_response(function, profile, payload, format, ors_host=None, region_h
         req_id = uuid.uuid4().hex
         t0 = time.monotonic()
         retried_caller = caller if attempt == 1 else f'{caller}.retry{attempt - 1}'
+        call_timeout_s, bound = _deadline_timeout(timeout_s)
         try:
-            r = requests.post(url=downstream_url, headers=downstream_headers, json=payload, timeout=timeout_s)
+            with _host_slot(host, lane) as slot, _pooled_session(host) as session, \
+                    _span('ors.http', host=host, function=function, attempt=attempt):
+                slot['deadline_bound'] = bound
+                r = session.post(url=downstream_url, headers=JSON_HEADERS, data=body, timeout=call_timeout_s)
+                raw = r.content
+                slot['overloaded'] = r.status_code >= 500
             latency_ms = int((time.monotonic() - t0) * 1000)
-            resp_bytes = len(r.content) if r.content is not None else None
-            resp = r.json()
-            logger.debug(resp)
+            resp_bytes = len(raw)
+            with _span('ors.decode'):
+                resp = _json_decode(raw)
             annotated = _annotate_engine_error(resp, host, payload)
             engine_err = annotated.get('error') if isinstance(annotated, dict) else None
             err_code = (engine_err if isinstance(engine_err, str)
@@ -1206,23 +4717,30 @@ def get_ors_response(function, profile, payload, format, ors_host=None, region_h
             # 2xx/3xx are success-shaped, both end the loop here.
             if 500 <= r.status_code < 600 and attempt < ORS_RETRY_MAX_ATTEMPTS:
                 last_error_payload = annotated
-                _breaker_on_failure(host)
+                _breaker_on_failure(host, lane)
                 backoff_s = (ORS_RETRY_BACKOFF_BASE_MS * (2 ** (attempt - 1))) / 1000.0
                 # +/-25% jitter (full random distribution) so simultaneous
                 # callers do not synchronize retries. Using random.uniform
                 # avoids the previous deterministic-per-req_id pattern that
                 # only produced 3 distinct jitter values.
                 backoff_s *= random.uniform(0.75, 1.25)
+                remaining = _deadline_remaining()
+                if remaining is not None and remaining <= backoff_s:
+                    return annotated
                 logger.warning(f'ORS {r.status_code} on {host}; retry {attempt}/{ORS_RETRY_MAX_ATTEMPTS - 1} after {backoff_s:.2f}s')
-                time.sleep(backoff_s)
+                with _span('ors.backoff'):
+                    time.sleep(backoff_s)
                 continue
-            _breaker_on_success(host)
+            _breaker_on_success(host, lane)
+            if cache_key and r.status_code == 200 and engine_err is None:
+                _matrix_cache_store(cache_key, cache_stamp, raw)
             return annotated
         except requests.exceptions.ConnectionError:
             latency_ms = int((time.monotonic() - t0) * 1000)
             region_label = f' (host: {host})' if host != resolve_ors_host(None) else ''
-            # Differentiate warming-up vs suspended/unknown by probing /health separately.
-            state = _probe_ors_state(host)
+            # Differentiate warming-up vs suspended/unknown from a status
+            # fetched after this call started (one probe per failure burst).
+            state = _probe_ors_state(host, since=t0)
             if state == 'warming_up':
                 logger.info(f'ORS{region_label} is warming up - graph still loading')
                 _emit_metric(function, profile, host, 503, latency_ms, req_bytes, None,
@@ -1240,7 +4758,7 @@ def get_ors_response(function, profile, payload, format, ors_host=None, region_h
             logger.error(f'Cannot connect to ORS{region_label} (attempt {attempt}) - suspended or not provisioned')
             _emit_metric(function, profile, host, 502, latency_ms, req_bytes, None,
                          error_code='service_unreachable', caller=retried_caller, region=region_hint, request_id=req_id)
-            _breaker_on_failure(host)
+            _breaker_on_failure(host, lane)
             last_error_payload = {
                 'error': 'service_unreachable',
                 'graph_loading': False,
@@ -1252,6 +4770,9 @@ def get_ors_response(function, profile, payload, format, ors_host=None, region_h
             }
             if attempt < ORS_RETRY_MAX_ATTEMPTS:
                 backoff_s = (ORS_RETRY_BACKOFF_BASE_MS * (2 ** (attempt - 1))) / 1000.0
+                remaining = _deadline_remaining()
+                if remaining is not None and remaining <= backoff_s:
+                    return last_error_payload
                 logger.warning(f'service_unreachable on {host}; retry {attempt}/{ORS_RETRY_MAX_ATTEMPTS - 1} after {backoff_s:.2f}s')
                 time.sleep(backoff_s)
                 continue
@@ -1260,11 +4781,14 @@ def get_ors_response(function, profile, payload, format, ors_host=None, region_h
             # Do not retry on timeout. A timed-out call already burned the full
             # per-endpoint timeout budget; retrying would multiply load on a
             # likely-overloaded ORS without improving the outcome.
+            if bound:
+                # Cut short by the request deadline, not the host's fault.
+                raise DeadlineExceeded()
             latency_ms = int((time.monotonic() - t0) * 1000)
             logger.error(f'ORS request timed out on {host} after {timeout_s}s')
             _emit_metric(function, profile, host, 504, latency_ms, req_bytes, None,
                          error_code='timeout', caller=retried_caller, region=region_hint, request_id=req_id)
-            _breaker_on_failure(host)
+            _breaker_on_failure(host, lane)
             return {
                 'error': 'timeout',
                 'message': f'ORS request timed out on {host} after {timeout_s}s. '
@@ -0,0 +1,203 @@
+"""Shared fixtures: routing_service wired to an in-process fake ORS / VROOM.
+
+Every downstream call of the gateway goes through a pooled requests.Session
+(_new_session), so the tests swap that for FakeSession and never open a
+socket. The shared state db is the per-process in-memory fallback, synced
+only when a test calls _state_sync, and every cache, pool and limiter is
+reset around each test.
+
+Run from services/gateway:  python -m pytest tests
+"""
+import json
+import logging
+import math
+import os
+import sys
+import threading
+
+import polyline
+import pytest
+
+os.environ.setdefault('GATEWAY_STATE_DB', '')
+os.environ.setdefault('METRIC_FLUSH_INTERVAL_S', '3600')
+os.environ.setdefault('GATEWAY_STATE_SYNC_S', '3600')
+os.environ.setdefault('ORS_STATUS_REFRESH_S', '0.05')
+os.environ.setdefault('ORS_RETRY_BACKOFF_BASE_MS', '1')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import routing_service as rs  # noqa: E402
+
+rs.logger.setLevel(logging.WARNING)
+
+
+def distance(a, b):
+    return round(math.hypot(a[0] - b[0], a[1] - b[1]) * 100000.0, 2)
+
+
+class FakeResponse:
+    def __init__(self, status_code, obj):
+        self.status_code = status_code
+        self.content = json.dumps(obj).encode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeDownstream:
+    """ORS and VROOM behind every host.
+
+    `calls` records (kind, host, body) for every request. `matrix_max_cells`
+    answers larger matrices with ORS error 6099. `fail(kind, body)` may return
+    an exception to raise, a (status, body) pair to answer with, or None.
+    `gate` (a threading.Event), when set on the instance, holds POSTs until it
+    is set.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+        self.build_date = '2026-01-01'
+        self.matrix_max_cells = None
+        self.fail = None
+        self.gate = None
+
+    def count(self, kind):
+        with self.lock:
+            return sum(1 for k, _, _ in self.calls if k == kind)
+
+    def bodies(self, kind):
+        with self.lock:
+            return [body for k, _, body in self.calls if k == kind]
+
+    def handle(self, url, body):
+        host = url.split('//', 1)[1].split(':', 1)[0]
+        kind = next((k for k in ('health', 'status', 'matrix', 'directions', 'isochrones') if f'/{k}' in url),
+                    'vroom')
+        with self.lock:
+            self.calls.append((kind, host, body))
+        if body is not None and self.gate is not None:
+            self.gate.wait(5)
+        if self.fail is not None:
+            outcome = self.fail(kind, body)
+            if isinstance(outcome, BaseException):
+                raise outcome
+            if outcome is not None:
+                return FakeResponse(*outcome)
+        return FakeResponse(*getattr(self, f'_{kind}')(body))
+
+    def _health(self, body):
+        return 200, {'status': 'ready'}
+
+    def _status(self, body):
+        return 200, {'profiles': {'driving-car': {'graph_build_date': self.build_date}}}
+
+    def _matrix(self, body):
+        locations = body['locations']
+        sources = body.get('sources', list(range(len(locations))))
+        destinations = body.get('destinations', list(range(len(locations))))
+        if self.matrix_max_cells is not None and len(sources) * len(destinations) > self.matrix_max_cells:
+            return 400, {'error': {'code': 6099, 'message': 'Request exceeds the matrix size limit'}}
+        distances = [[distance(locations[i], locations[j]) for j in destinations] for i in sources]
+        return 200, {
+            'distances': distances,
+            'durations': [[round(d / 10.0, 2) for d in row] for row in distances],
+            'sources': [{'location': locations[i], 'snapped_distance': 0.0} for i in sources],
+            'destinations': [{'location': locations[j], 'snapped_distance': 0.0} for j in destinations],
+            'metadata': {'service': 'matrix', 'engine': {'graph_date': self.build_date}},
+        }
+
+    def _directions(self, body):
+        coords = body['coordinates']
+        line, way_points, segments = [coords[0]], [0], []
+        for a, b in zip(coords, coords[1:]):
+            start = len(line) - 1
+            line += [[(a[0] + b[0]) / 2, (a[1] + b[1]) / 2], b]
+            way_points.append(len(line) - 1)
+            d = distance(a, b)
+            segments.append({'distance': d, 'duration': round(d / 10, 1),
+                             'steps': [{'distance': d, 'duration': round(d / 10, 1),
+                                        'way_points': [start, len(line) - 1], 'instruction': 'go'}]})
+        summary = {'distance': round(sum(s['distance'] for s in segments), 1),
+                   'duration': round(sum(s['duration'] for s in segments), 1)}
+        return 200, {
+            'type': 'FeatureCollection',
+            'bbox': [0, 0, 0, 0],
+            'features': [{'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': line},
+                          'properties': {'segments': segments, 'way_points': way_points, 'summary': summary}}],
+            'metadata': {'service': 'routing', 'query': body, 'engine': {'build_date': self.build_date}},
+        }
+
+    def _isochrones(self, body):
+        features = [{'type': 'Feature',
+                     'properties': {'group_index': gi, 'value': r, 'center': loc},
+                     'geometry': {'type': 'Polygon',
+                                  'coordinates': [[loc, [loc[0] + .01, loc[1]], [loc[0], loc[1] + .01], loc]]}}
+                    for gi, loc in enumerate(body['locations']) for r in body['range']]
+        return 200, {'type': 'FeatureCollection', 'features': features, 'metadata': {'query': body}}
+
+    def _vroom(self, body):
+        routes = []
+        for vehicle in body.get('vehicles', []):
+            steps = ([{'type': 'start', 'location': vehicle.get('start')}]
+                     + [{'type': 'job', 'location': job['location']} for job in body.get('jobs', [])]
+                     + [{'type': 'end', 'location': vehicle.get('end', vehicle.get('start'))}])
+            route = {'vehicle': vehicle['id'], 'steps': steps}
+            if body.get('options', {}).get('g', True) and 'matrices' not in body:
+                route['geometry'] = polyline.encode([(s['location'][1], s['location'][0]) for s in steps])
+            routes.append(route)
+        return 200, {'code': 0, 'routes': routes, 'summary': {}}
+
+
+class FakeSession:
+    def __init__(self, downstream):
+        self.downstream = downstream
+
+    def get(self, url, timeout=None, **kwargs):
+        return self.downstream.handle(url, None)
+
+    def post(self, url, data=None, timeout=None, **kwargs):
+        return self.downstream.handle(url, json.loads(data))
+
+
+def reset_gateway_state():
+    rs._SESSION_POOLS.clear()
+    rs._STATUS_CACHE.clear()
+    rs._HOST_LIMITS.clear()
+    rs._IN_FLIGHT.clear()
+    rs._CELL_STORES.clear()
+    rs._CELL_STORE_STATE.update(rows=0, cells_total=0, cells_fetched=0)
+    for cache, state in ((rs._MATRIX_CACHE, rs._MATRIX_CACHE_STATE), (rs._LEG_CACHE, rs._LEG_CACHE_STATE),
+                         (rs._ISOCHRONE_CACHE, rs._ISOCHRONE_CACHE_STATE)):
+        cache.clear()
+        for key in state:
+            if key != 'last_emit':
+                state[key] = 0
+    rs._BREAKERS.clear()
+    if rs._STATE['keeper'] is not None:
+        rs._STATE['keeper'].close()
+    # A fresh in-memory state db; every thread reconnects to it.
+    rs._STATE.update(pid=None, keeper=None, generation=rs._STATE['generation'] + 1, last_reap=0.0)
+    with rs._METRICS_LOCK:
+        rs._METRICS['series'].clear()
+        rs._METRICS['events'].clear()
+
+
+@pytest.fixture
+def downstream(monkeypatch):
+    fake = FakeDownstream()
+    monkeypatch.setattr(rs, '_new_session', lambda: FakeSession(fake))
+    reset_gateway_state()
+    yield fake
+    if fake.gate is not None:
+        fake.gate.set()
+    reset_gateway_state()
+
+
+@pytest.fixture
+def client(downstream):
+    return rs.app.test_client()
+
+
+def metric_events(caller):
+    with rs._METRICS_LOCK:
+        return [line for marker, line in rs._METRICS['events'] if line.get('caller') == caller]
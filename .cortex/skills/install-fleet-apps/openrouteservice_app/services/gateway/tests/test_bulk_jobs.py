@@ -0,0 +1,102 @@
+import os
+import time
+
+import pytest
+
+import routing_service as rs
+
+LOCATIONS = [[-122.40 - i / 100, 37.70] for i in range(5)]
+SPEC = {'profile': 'driving-car', 'locations': LOCATIONS, 'range': [300]}
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch, downstream):
+    monkeypatch.setattr(rs, 'BULK_JOB_DIR', str(tmp_path))
+    monkeypatch.setattr(rs, 'BULK_JOB_PAGE_ITEMS', 2)
+    monkeypatch.setattr(rs, 'BULK_JOB_CLAIM_SETTLE_S', 0.3)
+    return tmp_path
+
+
+def _wait(job_id, predicate):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        status = rs._job_status(job_id)
+        if predicate(status):
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f'job {job_id} stuck at {status}')
+
+
+def _idle(job_id):
+    # The runner has returned once the job left this worker's active set.
+    _wait(job_id, lambda _: job_id not in rs._BULK_JOBS['active'])
+
+
+def test_a_page_without_its_marker_is_neither_counted_nor_served(jobs, client):
+    job_id = rs._job_submit('isochrones', SPEC, None)['job_id']
+    assert _wait(job_id, lambda s: s['status'] == 'done')['pages_done'] == 3
+    _idle(job_id)
+
+    # As seen while page 1 is still being written: the file is there, its marker is not.
+    os.remove(os.path.join(rs._job_dir(job_id), rs._job_page_marker(1)))
+    status = rs._job_status(job_id)
+    fetched = client.post('/bulk_jobs_fetch', json={'data': [[0, job_id, 1], [1, job_id, 2]]}).get_json()['data']
+
+    assert status['pages_done'] == 2
+    assert fetched[0][1]['error'] == 'page_not_ready'
+    assert len(fetched[1][1]['items']) == 1
+
+
+def test_an_adopter_whose_claim_is_overwritten_backs_off(jobs, downstream):
+    plan = rs._job_plan('isochrones', SPEC, None)
+    job_id = 'ab' * 16
+    os.makedirs(rs._job_dir(job_id))
+    rs._job_write(job_id, 'job.json', plan)
+
+    assert rs._job_status(job_id)['status'] == 'queued'
+    assert rs._job_sweep()
+    assert rs._job_status(job_id)['status'] == 'running'
+    time.sleep(0.1)
+    rs._job_write(job_id, 'claim', {'owner': 'other-instance:1', 'at': time.time()})
+    _idle(job_id)
+
+    assert downstream.count('isochrones') == 0
+    assert rs._job_status(job_id)['pages_done'] == 0
+
+
+def test_an_unchallenged_adopter_resumes_at_the_first_missing_page(jobs):
+    job_id = rs._job_submit('isochrones', SPEC, None)['job_id']
+    _wait(job_id, lambda s: s['status'] == 'done')
+    _idle(job_id)
+    os.remove(os.path.join(rs._job_dir(job_id), rs._job_page_marker(2)))
+    rs._job_write(job_id, 'lease', {'owner': 'gone:1', 'at': 0, 'page': 2})
+
+    # Status only reports the stale job; the sweep adopts it.
+    assert rs._job_status(job_id)['status'] == 'queued'
+    assert job_id not in rs._BULK_JOBS['active']
+    rs._job_sweep()
+
+    assert _wait(job_id, lambda s: s['status'] == 'done')['pages_done'] == 3
+    assert rs._job_read(job_id, 'claim')['owner'] == rs._job_owner()
+
+
+def test_a_failed_job_resumes_at_its_first_missing_page(jobs, client, downstream):
+    downstream.fail = lambda kind, body: RuntimeError('disk full') if kind == 'isochrones' else None
+    job_id = rs._job_submit('isochrones', SPEC, None)['job_id']
+    _idle(job_id)
+    assert rs._job_status(job_id)['status'] == 'failed'
+    downstream.fail = None
+
+    resumed = client.post('/bulk_jobs_resume', json={'data': [[0, job_id]]}).get_json()['data'][0][1]
+
+    assert resumed['status'] == 'running'
+    assert _wait(job_id, lambda s: s['status'] == 'done')['pages_done'] == 3
+
+
+def test_health_reports_instance_local_bulk_jobs(jobs, client):
+    assert client.get('/health').get_json()['bulk_jobs'] == {'dir': str(jobs), 'shared': False}
+
+
+@pytest.mark.parametrize('endpoint', ['submit', 'status', 'fetch', 'cancel', 'resume'])
+def test_missing_rows_answer_empty(jobs, client, endpoint):
+    assert client.post(f'/bulk_jobs_{endpoint}', json={}).get_json() == {}
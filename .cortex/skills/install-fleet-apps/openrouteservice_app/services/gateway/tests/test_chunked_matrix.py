@@ -0,0 +1,55 @@
+import base64
+
+import numpy as np
+
+import routing_service as rs
+from conftest import distance
+
+HOST = 'ors-service-sanfrancisco'
+LOCATIONS = [[-122.40 + 0.002 * k, 37.70 + 0.001 * k] for k in range(25)]
+DESTINATIONS = list(range(1, 25))
+
+
+def _no_route_through(index):
+    return lambda kind, body: ((400, {'error': {'code': 6010, 'message': 'no route'}})
+                               if kind == 'matrix' and index in body['destinations'] else None)
+
+
+def test_chunks_are_stitched_in_destination_order(downstream):
+    resp = rs._retry_matrix_chunked('driving-car', LOCATIONS, [0, 3], DESTINATIONS, 'json', HOST, chunk_size=12)
+
+    assert downstream.count('matrix') == 2
+    assert '_partial' not in resp
+    assert resp['distances'] == [[distance(LOCATIONS[i], LOCATIONS[j]) for j in DESTINATIONS] for i in (0, 3)]
+
+
+def test_failed_chunk_keeps_its_columns_as_none(downstream):
+    downstream.fail = _no_route_through(13)
+    resp = rs._retry_matrix_chunked('driving-car', LOCATIONS, [0], DESTINATIONS, 'json', HOST, chunk_size=12)
+
+    # 13..24 failed, was re-split into 13..22 (failed again) and 23..24.
+    assert resp['_partial'] is True
+    assert resp['failed_destinations'] == list(range(13, 23))
+    row = resp['durations'][0]
+    assert len(row) == len(DESTINATIONS)
+    assert [j for j, cell in zip(DESTINATIONS, row) if cell is None] == list(range(13, 23))
+    assert resp['distances'][0][-1] == distance(LOCATIONS[0], LOCATIONS[24])
+
+
+def test_packed_partial_result_has_the_full_shape(downstream):
+    downstream.fail = _no_route_through(13)
+    resp = rs._retry_matrix_chunked('driving-car', LOCATIONS, [0], DESTINATIONS, 'json', HOST, chunk_size=12)
+
+    packed = rs._pack_matrix(resp)
+
+    assert packed['shape'] == [1, len(DESTINATIONS)]
+    cells = np.frombuffer(base64.b64decode(packed['distances']), '<u4').reshape(packed['shape'])
+    missing = [j for j, cell in zip(DESTINATIONS, cells[0]) if cell == rs.MATRIX_BINARY_MISSING]
+    assert missing == list(range(13, 23))
+
+
+def test_all_chunks_failing_is_an_error(downstream):
+    downstream.fail = lambda kind, body: (400, {'error': {'code': 6010, 'message': 'no route'}})
+
+    assert rs._retry_matrix_chunked('driving-car', LOCATIONS, [0], DESTINATIONS, 'json', HOST,
+                                    chunk_size=12)['error'] == 'all_chunks_failed'
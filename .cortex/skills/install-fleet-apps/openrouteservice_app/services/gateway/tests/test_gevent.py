@@ -0,0 +1,89 @@
+"""Smoke test of gevent mode: the app imported after monkey-patching, as
+gunicorn's gevent worker does, serves requests and keeps the hub running
+while another worker holds the shared state db."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('gevent')
+
+HOLD_WRITE_LOCK = '''
+import sqlite3, sys
+conn = sqlite3.connect(sys.argv[1], isolation_level=None)
+conn.execute('BEGIN IMMEDIATE')
+print('locked', flush=True)
+sys.stdin.readline()
+conn.execute('COMMIT')
+'''
+
+SMOKE = '''
+from gevent import monkey
+monkey.patch_all()
+
+import subprocess
+import sys
+import time
+
+import gevent
+
+sys.path[:0] = sys.argv[1:3]
+from conftest import FakeDownstream, FakeSession  # noqa: E402
+import routing_service as rs  # noqa: E402
+
+assert rs.ASYNC_MODE
+fake = FakeDownstream()
+rs._new_session = lambda: FakeSession(fake)
+client = rs.app.test_client()
+assert rs._state_sync()
+
+ticks = []
+
+
+def tick():
+    while True:
+        ticks.append(time.monotonic())
+        gevent.sleep(0.005)
+
+
+gevent.spawn(tick)
+holder = subprocess.Popen([sys.executable, '-c', sys.argv[3], rs.GATEWAY_STATE_DB],
+                          stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+assert holder.stdout.readline().strip() == 'locked'
+
+# A sync with nothing to merge only reads, beside the writer.
+assert rs._state_sync()
+# One that has to write waits out its busy timeout on the hub's threadpool
+# while the hub keeps ticking.
+rs._breaker_on_failure('ors-test', 'matrix')
+t0 = time.monotonic()
+assert not rs._state_sync()
+waited = time.monotonic() - t0
+assert waited >= 0.2, waited
+assert sum(1 for t in ticks if t0 < t < t0 + waited) >= 10
+
+row = [0, 'driving-car', {'coordinates': [[-122.40, 37.70], [-122.41, 37.71]]}, None]
+response = client.post('/directions/json', json={'data': [row]})
+assert response.status_code == 200, response.status_code
+assert 'features' in response.get_json()['data'][0][1], response.get_json()
+assert client.get('/metrics').status_code == 200
+
+holder.communicate('\\n', timeout=5)
+assert rs._state_sync()
+with rs._state_txn(write=False) as conn:
+    assert conn.execute('SELECT COUNT(*) FROM breaker').fetchone()[0] == 1
+print('ok')
+'''
+
+
+def test_app_serves_under_gevent_while_the_state_db_is_locked(tmp_path):
+    tests = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, GUNICORN_WORKER_CLASS='gevent', GATEWAY_STATE_DB=str(tmp_path / 'state.db'),
+               GATEWAY_STATE_BUSY_TIMEOUT_MS='300', GATEWAY_STATE_SYNC_S='3600')
+
+    out = subprocess.run([sys.executable, '-c', SMOKE, tests, os.path.dirname(tests), HOLD_WRITE_LOCK],
+                         env=env, capture_output=True, text=True, timeout=60)
+
+    assert out.returncode == 0, out.stderr
+    assert 'ok' in out.stdout.splitlines()
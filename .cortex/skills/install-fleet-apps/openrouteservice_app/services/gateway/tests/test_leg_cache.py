@@ -0,0 +1,43 @@
+import routing_service as rs
+
+HOST = 'ors-service-sanfrancisco'
+A, B, C, D = [[-122.40 + 0.01 * k, 37.70 + 0.01 * k] for k in range(4)]
+
+
+def _directions(coords, **options):
+    return rs._directions('driving-car', dict({'coordinates': coords}, **options), 'geojson', HOST)
+
+
+def test_cached_legs_are_reused_and_only_missing_legs_fetched(downstream):
+    _directions([A, B, C])
+    direct = _directions([B, C, D], preference='fastest')
+    assert downstream.count('directions') == 2
+
+    resp = _directions([B, C, D])
+
+    assert downstream.bodies('directions')[-1] == {'coordinates': [C, D]}
+    feature, expected = resp['features'][0], direct['features'][0]
+    assert feature['geometry']['coordinates'] == expected['geometry']['coordinates']
+    assert feature['properties']['way_points'] == expected['properties']['way_points']
+    assert feature['properties']['summary'] == expected['properties']['summary']
+    assert [s['steps'][0]['way_points'] for s in feature['properties']['segments']] == \
+        [s['steps'][0]['way_points'] for s in expected['properties']['segments']]
+
+
+def test_a_fully_cached_route_makes_no_ors_call(downstream):
+    _directions([A, B, C, D])
+    calls = downstream.count('directions')
+
+    resp = _directions([B, C, D])
+
+    assert downstream.count('directions') == calls
+    assert resp['features'][0]['properties']['way_points'] == [0, 2, 4]
+    assert resp['metadata']['query']['coordinates'] == [B, C, D]
+
+
+def test_routing_options_bypass_the_cache(downstream):
+    _directions([A, B])
+    _directions([A, B], preference='shortest')
+
+    assert downstream.count('directions') == 2
+    assert rs._LEG_CACHE_STATE['hits'] == 0
@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+
+import pytest
+
+import routing_service as rs
+
+HOST = 'ors-test'
+LOCATIONS = [[-122.40, 37.70], [-122.41, 37.71], [-122.42, 37.72]]
+
+
+def _lane_usage(host, lane):
+    lim = rs._host_limiter(host)
+    with lim['cond']:
+        return rs._host_usage(lim).get(lane, [0, 0])
+
+
+def _breaker_state(host, lane):
+    b = rs._BREAKERS.get(f'{host}/{lane}')
+    return b['state'] if b else 'CLOSED'
+
+
+def _shared_breaker_state(host, lane):
+    with rs._state_txn(write=False) as conn:
+        row = conn.execute('SELECT state FROM breaker WHERE host = ?', (f'{host}/{lane}',)).fetchone()
+    return row[0] if row else 'CLOSED'
+
+
+def _overloaded(kind, body):
+    return (503, {'error': {'code': 503, 'message': 'busy'}}) if kind == 'matrix' else None
+
+
+def test_precompute_holds_a_matrix_lane_slot(downstream):
+    seen = []
+    downstream.fail = lambda kind, body: seen.append(_lane_usage(HOST, 'matrix')[0]) if kind == 'matrix' else None
+
+    out = rs._compute_matrices_from_ors(LOCATIONS, 'driving-car', HOST)
+
+    assert len(out['durations']) == len(LOCATIONS)
+    assert seen == [1]
+    assert _lane_usage(HOST, 'matrix')[0] == 0
+
+
+def test_precompute_overload_backs_off_the_host_limit(downstream):
+    before = rs._host_limit(HOST)
+    downstream.fail = _overloaded
+
+    out = rs._compute_matrices_from_ors(LOCATIONS, 'driving-car', HOST)
+
+    assert '__error__' in out
+    assert rs._host_limit(HOST) == max(rs.ORS_LIMIT_MIN, int(before * rs.ORS_LIMIT_BACKOFF))
+
+
+def test_precompute_is_refused_by_an_open_breaker(downstream):
+    downstream.fail = _overloaded
+    for _ in range(rs.ORS_BREAKER_FAILURE_THRESHOLD):
+        rs._compute_matrices_from_ors(LOCATIONS, 'driving-car', HOST, use_cache=False)
+    assert _breaker_state(HOST, 'matrix') == 'OPEN'
+    calls = downstream.count('matrix')
+
+    out = rs._compute_matrices_from_ors(LOCATIONS, 'driving-car', HOST, use_cache=False)
+
+    assert 'circuit breaker' in out['__error__']
+    assert downstream.count('matrix') == calls
+    # Other lanes of the host keep their own breaker.
+    assert rs._breaker_check(HOST, 'interactive') == (True, None)
+
+
+def test_breaker_half_opens_after_cooldown_and_closes_on_success(downstream):
+    for _ in range(rs.ORS_BREAKER_FAILURE_THRESHOLD):
+        rs._breaker_on_failure(HOST, 'matrix')
+    assert rs._breaker_check(HOST, 'matrix') == (False, 'circuit_open')
+
+    rs._BREAKERS[f'{HOST}/matrix']['open_until'] = 0
+    assert rs._breaker_check(HOST, 'matrix') == (True, None)
+    assert _breaker_state(HOST, 'matrix') == 'HALF_OPEN'
+
+    rs._breaker_on_success(HOST, 'matrix')
+    assert _breaker_state(HOST, 'matrix') == 'CLOSED'
+
+
+def test_half_open_breaker_reopens_on_one_failure(downstream):
+    for _ in range(rs.ORS_BREAKER_FAILURE_THRESHOLD):
+        rs._breaker_on_failure(HOST, 'matrix')
+    rs._BREAKERS[f'{HOST}/matrix']['open_until'] = 0
+    rs._breaker_check(HOST, 'matrix')
+
+    rs._breaker_on_failure(HOST, 'matrix')
+
+    assert rs._breaker_check(HOST, 'matrix') == (False, 'circuit_open')
+
+
+def test_a_call_never_touches_the_state_db(downstream, monkeypatch):
+    def no_db():
+        raise AssertionError('state db on the request path')
+
+    monkeypatch.setattr(rs, '_state_conn', no_db)
+    body = {'coordinates': LOCATIONS[:2]}
+
+    ok = rs.get_ors_response('directions', 'driving-car', body, 'json', HOST, use_cache=False)
+    downstream.fail = lambda kind, body: (503, {'error': {'code': 503, 'message': 'busy'}})
+    failed = rs.get_ors_response('directions', 'driving-car', body, 'json', HOST, use_cache=False)
+
+    assert 'features' in ok
+    assert 'features' not in failed
+    # Recorded for the next sync.
+    assert rs._BREAKERS[f'{HOST}/interactive']['events']
+
+
+def test_sync_merges_trips_and_limit_steps_with_the_other_workers(downstream):
+    for _ in range(rs.ORS_BREAKER_FAILURE_THRESHOLD):
+        rs._breaker_on_failure(HOST, 'matrix')
+    with rs._host_slot(HOST, 'matrix') as slot:
+        slot['overloaded'] = True
+    limit = rs._host_limit(HOST)
+
+    assert rs._state_sync()
+    assert _shared_breaker_state(HOST, 'matrix') == 'OPEN'
+    with rs._state_txn(write=False) as conn:
+        assert conn.execute('SELECT lim FROM host_limit WHERE host = ?', (HOST,)).fetchone()[0] == limit
+
+    # Another worker trips the interactive lane, halves the limit again and
+    # holds every slot.
+    other = os.getppid()
+    with rs._state_txn() as conn:
+        conn.execute("INSERT INTO breaker (host, state, open_until, failures) VALUES (?, 'OPEN', ?, '[]')",
+                     (f'{HOST}/interactive', time.time() + 30))
+        conn.execute('UPDATE host_limit SET lim = 1, last_decrease = ? WHERE host = ?', (time.time(), HOST))
+        conn.execute("INSERT INTO lane_slots (host, lane, pid, in_flight, waiting) VALUES (?, 'interactive', ?, 1, 0)",
+                     (HOST, other))
+    assert rs._state_sync()
+
+    assert rs._breaker_check(HOST, 'interactive') == (False, 'circuit_open')
+    assert rs._host_limit(HOST) == 1
+    with rs._deadline(0.05), pytest.raises(rs.DeadlineExceeded):
+        with rs._host_slot(HOST):
+            pass
+
+
+def test_a_locked_state_db_skips_the_sync_and_keeps_the_changes(downstream):
+    for _ in range(rs.ORS_BREAKER_FAILURE_THRESHOLD):
+        rs._breaker_on_failure(HOST, 'matrix')
+    locked, release = threading.Event(), threading.Event()
+
+    def hold_write_lock():
+        with rs._state_txn():
+            locked.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold_write_lock)
+    holder.start()
+    locked.wait(5)
+    try:
+        t0 = time.monotonic()
+        assert not rs._state_sync()
+        assert time.monotonic() - t0 < 0.5
+        assert rs._breaker_check(HOST, 'matrix') == (False, 'circuit_open')
+    finally:
+        release.set()
+        holder.join(5)
+
+    assert rs._state_sync()
+    assert _shared_breaker_state(HOST, 'matrix') == 'OPEN'
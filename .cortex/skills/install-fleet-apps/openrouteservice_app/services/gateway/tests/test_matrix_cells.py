@@ -0,0 +1,44 @@
+import routing_service as rs
+from conftest import distance, metric_events
+
+DEPOT = [-122.40, 37.70]
+JOBS = [[-122.40 + 0.01 * k, 37.71] for k in range(1, 6)]
+
+
+def _matrix_tabular(client, rows):
+    resp = client.post('/matrix_tabular', json={'data': rows})
+    assert resp.status_code == 200
+    return [answer for _, answer in resp.json['data']]
+
+
+def test_second_row_fetches_only_the_missing_sub_block(client, downstream):
+    first, = _matrix_tabular(client, [[0, 'driving-car', DEPOT, JOBS[:3], None]])
+    second, = _matrix_tabular(client, [[1, 'driving-car', DEPOT, JOBS, None]])
+
+    sub_block = downstream.bodies('matrix')[-1]
+    assert sub_block['locations'] == [DEPOT] + JOBS[3:]
+    assert sub_block['sources'] == [0] and sub_block['destinations'] == [1, 2]
+    assert second['distances'] == [[distance(DEPOT, job) for job in JOBS]]
+    assert second['distances'][0][:3] == first['distances'][0]
+    assert [entry['location'] for entry in second['destinations']] == JOBS
+
+
+def test_repeated_row_is_served_without_ors(client, downstream):
+    _matrix_tabular(client, [[0, 'driving-car', DEPOT, JOBS, None]])
+    calls = downstream.count('matrix')
+    answer, = _matrix_tabular(client, [[1, 'driving-car', DEPOT, JOBS[::-1], None]])
+    assert downstream.count('matrix') == calls
+    assert answer['durations'][0] == [round(distance(DEPOT, job) / 10.0, 2) for job in JOBS[::-1]]
+
+
+def test_rows_are_counted_not_emitted_one_event_each(client, downstream, monkeypatch):
+    monkeypatch.setattr(rs, 'MATRIX_CELL_STORE_METRIC_INTERVAL_S', 3600)
+    rows = [[i, 'driving-car', DEPOT, JOBS, None] for i in range(40)]
+    _matrix_tabular(client, rows)
+    assert metric_events('matrix_cells') == []
+    assert rs._CELL_STORE_STATE['rows'] == 40
+
+    monkeypatch.setattr(rs, 'MATRIX_CELL_STORE_METRIC_INTERVAL_S', 0)
+    _matrix_tabular(client, rows[:1])
+    event, = metric_events('matrix_cells')
+    assert event['rows'] == 41 and event['cells_total'] == 41 * len(JOBS)
@@ -0,0 +1,36 @@
+import routing_service as rs
+from conftest import metric_events
+
+
+def _series(caller):
+    with rs._METRICS_LOCK:
+        return {key: agg for key, agg in rs._METRICS['series'].items() if key[6] == caller}
+
+
+def test_extra_of_a_per_call_event_is_summed_into_its_series(downstream):
+    for items, failed in ((100, 2), (100, 0), (40, 1)):
+        rs._emit_metric('bulk_matrix', 'driving-car', 'ors-test', 200, 10, None, None, caller='bulk_job',
+                        extra={'items': items, 'items_failed': failed, 'note': 'ignored'})
+
+    assert metric_events('bulk_job') == []
+    (agg,) = _series('bulk_job').values()
+    summary = rs._series_summary(agg)
+    assert (summary['count'], summary['items'], summary['items_failed']) == (3, 240, 3)
+    assert 'note' not in summary
+
+
+def test_periodic_counter_flushes_keep_their_own_line(downstream):
+    rs._emit_metric('matrix', None, None, 200, 0, None, None, caller='matrix_cache', extra={'hits': 3})
+
+    (event,) = metric_events('matrix_cache')
+    assert event['hits'] == 3
+    assert _series('matrix_cache') == {}
+
+
+def test_merged_series_keep_extra_sums(downstream):
+    a, b = rs._new_series(), rs._new_series()
+    a['extra'], b['extra'] = {'items': 5}, {'items': 7, 'items_failed': 1}
+
+    rs._merge_series(a, b)
+
+    assert a['extra'] == {'items': 12, 'items_failed': 1}
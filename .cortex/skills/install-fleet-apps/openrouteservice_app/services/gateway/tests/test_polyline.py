@@ -0,0 +1,61 @@
+import random
+
+import numpy as np
+import polyline
+import pytest
+
+import routing_service as rs
+
+
+def _line(seed, n):
+    rnd = random.Random(seed)
+    lat, lon = rnd.uniform(-80, 80), rnd.uniform(-179, 179)
+    points = []
+    for _ in range(n):
+        lat += rnd.uniform(-0.5, 0.5)
+        lon += rnd.uniform(-0.5, 0.5)
+        points.append((round(lat, 5), round(lon, 5)))
+    return points
+
+
+def _same_line(got, expected, precision=5):
+    return np.shape(got) == np.shape(expected) and np.allclose(got, expected, rtol=0, atol=10 ** -(precision + 3))
+
+
+@pytest.mark.parametrize('seed,n,precision', [(1, 1, 5), (2, 2, 5), (3, 500, 5), (4, 200, 6), (5, 50, 5)])
+def test_decode_matches_polyline_decode(seed, n, precision):
+    encoded = polyline.encode(_line(seed, n), precision)
+
+    expected = [[lon, lat] for lat, lon in polyline.decode(encoded, precision)]
+
+    assert _same_line(rs._decode_polyline(encoded, precision), expected, precision)
+
+
+@pytest.mark.parametrize('encoded', ['', '_p~iF~ps|U_ulLnnqC_mqNvxq`@', '_p~iF~ps|', 'é'])
+def test_decode_edge_cases_match_polyline_decode(encoded):
+    try:
+        expected = [[lon, lat] for lat, lon in polyline.decode(encoded)]
+    except Exception as e:  # noqa: B902 - the fallback must raise what polyline raises
+        with pytest.raises(type(e)):
+            rs._decode_polyline(encoded)
+        return
+    assert _same_line(rs._decode_polyline(encoded), expected)
+
+
+def test_encode_round_trips_and_handles_empty_lines():
+    line = [[lon, lat] for lat, lon in _line(7, 20)]
+
+    assert _same_line(rs._decode_polyline(rs._encode_polyline(line)), line)
+    assert rs._encode_polyline([]) == ''
+
+
+def test_vroom_geometry_is_decoded_unless_encoded_is_requested(downstream):
+    payload = {'vehicles': [{'id': 1, 'start': [-122.40, 37.70]}],
+               'jobs': [{'id': 1, 'location': [-122.41, 37.71]}], 'options': {'g': True}}
+
+    decoded = rs.get_vroom_response(payload, 'vroom-test')
+    encoded = rs.get_vroom_response(payload, 'vroom-test', encoded_geometry=True)
+
+    geometry = encoded['routes'][0]['geometry']
+    assert isinstance(geometry, str)
+    assert _same_line(decoded['routes'][0]['geometry'], [[lon, lat] for lat, lon in polyline.decode(geometry)])
@@ -0,0 +1,67 @@
+import threading
+
+import routing_service as rs
+
+
+def _held_handler():
+    entered, release = threading.Event(), threading.Event()
+
+    def handler():
+        entered.set()
+        release.wait(5)
+        return 'done'
+    return rs._request_lane('matrix')(handler), entered, release
+
+
+def _run(handler, out):
+    with rs.app.test_request_context():
+        response = handler()
+        out.append(response if isinstance(response, str) else response.status_code)
+
+
+def test_bulk_batches_are_unbounded_by_default(downstream):
+    handler, entered, release = _held_handler()
+    out = []
+    threads = [threading.Thread(target=_run, args=(handler, out)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    assert entered.wait(5)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert out == ['done'] * 8
+
+
+def test_a_bulk_batch_over_the_bound_queues_for_a_slot(downstream, monkeypatch):
+    monkeypatch.setattr(rs, 'GATEWAY_BULK_REQUEST_SLOTS', 1)
+    monkeypatch.setattr(rs, 'GATEWAY_BULK_QUEUE_WAIT_S', 5)
+    handler, entered, release = _held_handler()
+    out = []
+    first = threading.Thread(target=_run, args=(handler, out))
+    first.start()
+    assert entered.wait(5)
+    second = threading.Thread(target=_run, args=(handler, out))
+    second.start()
+    second.join(0.1)
+    assert second.is_alive() and out == []
+
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert out == ['done', 'done']
+
+
+def test_a_bulk_batch_gets_429_after_its_queue_wait(downstream, monkeypatch):
+    monkeypatch.setattr(rs, 'GATEWAY_BULK_REQUEST_SLOTS', 1)
+    monkeypatch.setattr(rs, 'GATEWAY_BULK_QUEUE_WAIT_S', 0.05)
+    handler, entered, release = _held_handler()
+    out = []
+    first = threading.Thread(target=_run, args=(handler, out))
+    first.start()
+    assert entered.wait(5)
+    try:
+        _run(handler, out)
+    finally:
+        release.set()
+        first.join(5)
+    assert out == [429, 'done']
@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import routing_service as rs
+
+HOST = 'ors-test'
+
+
+def _hold_only_session(monkeypatch):
+    monkeypatch.setattr(rs, 'ORS_SESSION_POOL_SIZE', 1)
+    taken, release = threading.Event(), threading.Event()
+
+    def hold():
+        with rs._pooled_session(HOST):
+            taken.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    assert taken.wait(5)
+    return release, holder
+
+
+def test_released_session_is_handed_to_the_waiter(downstream, monkeypatch):
+    release, holder = _hold_only_session(monkeypatch)
+    threading.Timer(0.05, release.set).start()
+
+    with rs._pooled_session(HOST) as session:
+        assert session is not None
+    holder.join(5)
+    assert rs._session_pool(HOST)['created'] == 1
+
+
+def test_wait_for_a_session_is_capped(downstream, monkeypatch):
+    monkeypatch.setattr(rs, 'ORS_SESSION_WAIT_MAX_S', 0.1)
+    release, holder = _hold_only_session(monkeypatch)
+    t0 = time.monotonic()
+    try:
+        with pytest.raises(requests.exceptions.Timeout):
+            with rs._pooled_session(HOST):
+                pass
+    finally:
+        release.set()
+        holder.join(5)
+    assert time.monotonic() - t0 < 2
+
+
+def test_wait_for_a_session_stops_at_the_request_deadline(downstream, monkeypatch):
+    release, holder = _hold_only_session(monkeypatch)
+    t0 = time.monotonic()
+    try:
+        with pytest.raises(rs.DeadlineExceeded), rs._deadline(0.1):
+            with rs._pooled_session(HOST):
+                pass
+    finally:
+        release.set()
+        holder.join(5)
+    assert time.monotonic() - t0 < 2
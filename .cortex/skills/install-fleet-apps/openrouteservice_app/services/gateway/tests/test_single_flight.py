@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+import routing_service as rs
+
+
+def _lead(key, error):
+    """Start a leader for `key` that fails with `error` once released."""
+    started, release, outcome = threading.Event(), threading.Event(), {}
+
+    def call():
+        started.set()
+        release.wait(5)
+        raise error
+
+    def run():
+        try:
+            rs._single_flight(key, call)
+        except BaseException as e:  # noqa: B902 - recorded for the assertion
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert started.wait(5)
+    return release, thread, outcome
+
+
+def _follow(key, call):
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = rs._single_flight(key, call)
+        except BaseException as e:  # noqa: B902
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while rs._IN_FLIGHT.get(key, {}).get('followers', 0) < 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+    return thread, outcome
+
+
+def test_identical_calls_share_one_result(downstream):
+    calls = []
+    gate = threading.Event()
+
+    def call():
+        calls.append(1)
+        gate.wait(5)
+        return {'value': 42}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(rs._single_flight('k', call))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    gate.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1 and results == [{'value': 42}] * 5
+    assert len({id(r) for r in results}) == 5
+
+
+def test_follower_retries_when_the_leader_runs_out_of_its_own_budget(downstream):
+    release, leader, led = _lead('k', rs.DeadlineExceeded())
+    follower, followed = _follow('k', lambda: {'value': 'retried'})
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert isinstance(led['error'], rs.DeadlineExceeded)
+    assert followed == {'result': {'value': 'retried'}}
+
+
+class _Cancelled(BaseException):
+    """Stands in for GreenletExit: a leader killed mid-call."""
+
+
+def test_follower_retries_when_the_leader_is_cancelled(downstream):
+    release, leader, led = _lead('k', _Cancelled())
+    follower, followed = _follow('k', lambda: {'value': 'retried'})
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert isinstance(led['error'], _Cancelled)
+    assert followed == {'result': {'value': 'retried'}}
+
+
+def test_call_errors_are_shared_with_followers(downstream):
+    release, leader, _ = _lead('k', ValueError('bad body'))
+    follower, followed = _follow('k', lambda: pytest.fail('follower must not call again'))
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert isinstance(followed['error'], ValueError)
+
+
+def test_cache_bypass_calls_do_not_coalesce_with_cached_ones(downstream):
+    body = b'{"locations":[[0,0],[1,1]]}'
+
+    assert rs._flight_key('h', '/matrix', body, use_cache=False) != rs._flight_key('h', '/matrix', body)
+    assert rs._flight_key('h', '/matrix', body, use_cache=False) == rs._flight_key('h', '/matrix', body, False)
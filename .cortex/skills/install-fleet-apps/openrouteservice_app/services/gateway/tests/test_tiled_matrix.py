@@ -0,0 +1,57 @@
+import threading
+import time
+
+import routing_service as rs
+from conftest import distance
+
+HOST = 'ors-service-sanfrancisco'
+LOCATIONS = [[-122.40 + 0.01 * k, 37.70 + 0.005 * k] for k in range(7)]
+
+
+def test_tiles_are_stitched_into_the_full_matrix(downstream, monkeypatch):
+    monkeypatch.setattr(rs, 'GUARDRAIL_MATRIX_MAX_LOCATIONS', 4)
+    body = {'locations': LOCATIONS, 'sources': [0, 2, 4, 6], 'destinations': [1, 3, 5]}
+    resp = rs._tiled_matrix('driving-car', body, 'json', HOST)
+
+    assert resp['_tiled']['tiles'] > 1 and downstream.count('matrix') == resp['_tiled']['tiles']
+    assert '_partial' not in resp
+    assert resp['distances'] == [[distance(LOCATIONS[i], LOCATIONS[j]) for j in (1, 3, 5)] for i in (0, 2, 4, 6)]
+    assert [e['location'] for e in resp['sources']] == [LOCATIONS[i] for i in (0, 2, 4, 6)]
+    assert [e['location'] for e in resp['destinations']] == [LOCATIONS[j] for j in (1, 3, 5)]
+
+
+def test_failed_tile_leaves_none_cells(downstream, monkeypatch):
+    monkeypatch.setattr(rs, 'GUARDRAIL_MATRIX_MAX_LOCATIONS', 4)
+    downstream.fail = lambda kind, body: ((400, {'error': {'code': 6010, 'message': 'no route'}})
+                                          if kind == 'matrix' and body['locations'] == LOCATIONS[:2] * 2 else None)
+    resp = rs._tiled_matrix('driving-car', {'locations': LOCATIONS[:4]}, 'json', HOST)
+
+    assert resp['_partial'] is True
+    assert {'sources': [0, 2], 'destinations': [0, 2]} in [
+        {k: t[k] for k in ('sources', 'destinations')} for t in resp['failed_tiles']]
+    assert resp['durations'][0][:2] == [None, None] and resp['durations'][0][2] is not None
+
+
+def test_empty_sources_or_destinations_give_an_empty_matrix(downstream):
+    for body, shape in (({'locations': LOCATIONS, 'sources': []}, (0, 7)),
+                        ({'locations': LOCATIONS, 'destinations': []}, (7, 0))):
+        resp = rs._tiled_matrix('driving-car', body, 'json', HOST)
+        assert len(resp['durations']) == shape[0] and all(row == [] for row in resp['durations'])
+        assert len(resp['sources']) == shape[0] and len(resp['destinations']) == shape[1]
+    assert downstream.count('matrix') == 0
+
+
+def test_tiles_waiting_past_the_budget_never_reach_ors(downstream, monkeypatch):
+    # Limit 4 leaves the matrix lane 3 slots; the 4th tile queues for one.
+    monkeypatch.setattr(rs, 'GUARDRAIL_MATRIX_MAX_LOCATIONS', 4)
+    monkeypatch.setattr(rs, 'ORS_HOST_CONCURRENCY', 4)
+    downstream.gate = threading.Event()
+    t0 = time.monotonic()
+    resp = rs._tiled_matrix('driving-car', {'locations': LOCATIONS[:4]}, 'json', HOST, use_cache=False,
+                            timeout_s=0.3)
+    assert time.monotonic() - t0 < 2
+    assert resp.get('error') in ('timeout', 'deadline_exceeded')
+    time.sleep(0.3)
+    downstream.gate.set()
+    time.sleep(0.3)
+    assert downstream.count('matrix') == 3
@@ -0,0 +1,76 @@
+import json
+import os
+import time
+
+import routing_service as rs
+
+
+def _warming_up(kind, body):
+    return (503, {'status': 'not ready'}) if kind in ('health', 'status') else None
+
+
+def test_rows_wait_concurrently_within_one_timeout(client, downstream):
+    downstream.fail = _warming_up
+    rows = [[i, None, 0.4] for i in range(4)]
+
+    t0 = time.monotonic()
+    resp = client.post('/ors_wait_ready', json={'data': rows})
+    elapsed = time.monotonic() - t0
+
+    data = resp.get_json()['data']
+    assert [row[0] for row in data] == [0, 1, 2, 3]
+    assert all(row[1]['wait_timed_out'] for row in data)
+    assert elapsed < 1.2
+
+
+def test_ready_rows_return_at_once(client, downstream):
+    data = client.post('/ors_wait_ready', json={'data': [[0, None, 5], [1, None, None]]}).get_json()['data']
+
+    assert all(row[1]['service_ready'] and 'wait_timed_out' not in row[1] for row in data)
+
+
+def test_missing_rows_answer_empty(client, downstream):
+    assert client.post('/ors_wait_ready', json={}).get_json() == {}
+
+
+def test_refresher_stops_with_the_last_waiter(client, downstream):
+    downstream.fail = _warming_up
+
+    client.post('/ors_wait_ready', json={'data': [[0, None, 0.3]]})
+    time.sleep(0.2)
+    calls = downstream.count('status')
+    time.sleep(0.2)
+
+    assert rs._STATUS_REFRESHER['pid'] is None
+    assert downstream.count('status') == calls
+
+
+def _share_status(host, status, fetched_at, lease_until=0.0):
+    with rs._state_txn() as conn:
+        conn.execute('INSERT OR REPLACE INTO ors_status (host, status, fetched_at, fetcher, lease_until) '
+                     'VALUES (?, ?, ?, ?, ?)', (host, json.dumps(status), fetched_at, os.getppid(), lease_until))
+
+
+def test_only_the_lease_holder_refreshes_and_the_others_adopt(downstream):
+    host = rs.resolve_ors_host(None)
+    _share_status(host, {'service_ready': False}, time.time() - 60, lease_until=time.time() + 30)
+
+    rs._status_refresh(host)
+    assert downstream.count('status') == 0
+
+    _share_status(host, {'service_ready': True}, time.time())
+    rs._status_refresh(host)
+
+    assert downstream.count('status') == 0
+    assert rs._get_ors_status(host)['service_ready']
+
+
+def test_a_miss_takes_a_status_another_worker_fetched(downstream):
+    host = rs.resolve_ors_host(None)
+    _share_status(host, {'service_ready': True, 'ors_host': host}, time.time() - 1)
+
+    assert rs._get_ors_status(host)['service_ready']
+    assert downstream.count('status') == 0
+    # Too old for this caller: fetched from ORS.
+    rs._get_ors_status(host, max_age=0.5)
+    assert downstream.count('status') == 1
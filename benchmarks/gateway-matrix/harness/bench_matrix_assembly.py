@@ -0,0 +1,133 @@
+"""Gateway matrix hot-path microbenchmark.
+
+Compares list-based and NumPy-based versions of the three matrix hot-path
+stages in the routing gateway at 100, 200 and 500 locations:
+
+  * round + None->0   (OPTIMIZATION pre-compute; routing_service._rounded_matrix)
+  * chunk stitching   (_retry_matrix_chunked)
+  * tile assembly     (_tiled_matrix)
+
+Inputs are ORS-shaped nested float lists with ~1% `None` (unroutable) cells,
+and every timed run includes the conversion back to JSON-ready lists, i.e.
+exactly what a request pays. The NumPy stitching / tile candidates are
+defined here rather than in the gateway because they lose: see
+../results/summary.md.
+
+Usage:
+    pip install -r requirements.txt
+    python bench_matrix_assembly.py [--sizes 100 200 500] [--repeat 20]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+GATEWAY_DIR = (Path(__file__).resolve().parents[3] / ".cortex" / "skills" / "install-fleet-apps"
+               / "openrouteservice_app" / "services" / "gateway")
+sys.path.insert(0, str(GATEWAY_DIR))
+
+import numpy as np  # noqa: E402
+import routing_service as rs  # noqa: E402
+
+CHUNK = 50
+
+
+def ors_matrix(n, seed):
+    rnd = random.Random(seed)
+    return [[None if rnd.random() < 0.01 else rnd.uniform(0, 50000) for _ in range(n)] for _ in range(n)]
+
+
+# --- legacy implementations (pre-NumPy gateway) -----------------------------
+
+def legacy_round(rows):
+    return [[round(v) if v is not None else 0 for v in row] for row in rows]
+
+
+def legacy_stitch(chunks):
+    stitched = None
+    for chunk in chunks:
+        if stitched is None:
+            stitched = [[] for _ in chunk]
+        for r_idx, row in enumerate(chunk):
+            stitched[r_idx].extend(row)
+    return stitched
+
+
+def legacy_tiles(tiles, n, tile):
+    out = [[None] * n for _ in range(n)]
+    for (i, j), rows in tiles:
+        for a, row in enumerate(rows):
+            out[i + a][j:j + len(row)] = row
+    return out
+
+
+# --- NumPy implementations ---------------------------------------------------
+
+def matrix_json(arr):
+    missing = np.isnan(arr)
+    if not missing.any():
+        return arr.tolist()
+    out = arr.astype(object)
+    out[missing] = None
+    return out.tolist()
+
+
+def numpy_round(rows):
+    return rs._rounded_matrix(rows)
+
+
+def numpy_stitch(chunks):
+    return matrix_json(np.hstack([rs._matrix_array(c) for c in chunks]))
+
+
+def numpy_tiles(tiles, n, tile):
+    out = np.full((n, n), np.nan)
+    for (i, j), rows in tiles:
+        arr = rs._matrix_array(rows)
+        out[i:i + arr.shape[0], j:j + arr.shape[1]] = arr
+    return matrix_json(out)
+
+
+def timed(fn, *args, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 200, 500])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f'| locations | stage | legacy p50 ms | numpy p50 ms | speedup |')
+    print(f'|---|---|---|---|---|')
+    for n in args.sizes:
+        matrix = ors_matrix(n, seed=n)
+        chunks = [[row[c:c + CHUNK] for row in matrix] for c in range(0, n, CHUNK)]
+        tile = max(1, n // 2)
+        tiles = [((i, j), [row[j:j + tile] for row in matrix[i:i + tile]])
+                 for i in range(0, n, tile) for j in range(0, n, tile)]
+        assert legacy_round(matrix) == numpy_round(matrix)
+        assert legacy_stitch(chunks) == numpy_stitch(chunks)
+        assert legacy_tiles(tiles, n, tile) == numpy_tiles(tiles, n, tile)
+        for stage, legacy, vectorized, stage_args in (
+            ('round + None->0', legacy_round, numpy_round, (matrix,)),
+            (f'stitch {len(chunks)} chunks', legacy_stitch, numpy_stitch, (chunks,)),
+            (f'assemble {len(tiles)} tiles', legacy_tiles, numpy_tiles, (tiles, n, tile)),
+        ):
+            a = timed(legacy, *stage_args, repeat=args.repeat)
+            b = timed(vectorized, *stage_args, repeat=args.repeat)
+            print(f'| {n} | {stage} | {a:.2f} | {b:.2f} | {a / b:.1f}x |')
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('ORS_PORT', '8082')
+    main()
@@ -0,0 +1,104 @@
+"""Matrix response format microbenchmark: JSON floats vs /matrix/binary.
+
+Measures, for an ORS-shaped NxN matrix answer (durations + distances, ~1%
+`None` cells), what a MATRIX row costs the gateway to render and a bulk
+consumer to turn back into arrays:
+
+  * json    -- the answer as the gateway returns it today, rendered with
+               _json_encode; the consumer parses it and builds arrays.
+  * binary  -- routing_service._pack_matrix, then the same render; the
+               consumer parses the small JSON envelope and np.frombuffer's
+               the two base64 payloads.
+
+Usage:
+    pip install -r requirements.txt
+    python bench_matrix_format.py [--sizes 100 200 500] [--repeat 20]
+"""
+
+import argparse
+import base64
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+GATEWAY_DIR = (Path(__file__).resolve().parents[3] / ".cortex" / "skills" / "install-fleet-apps"
+               / "openrouteservice_app" / "services" / "gateway")
+sys.path.insert(0, str(GATEWAY_DIR))
+
+import numpy as np  # noqa: E402
+import routing_service as rs  # noqa: E402
+
+
+def ors_answer(n, seed):
+    rnd = random.Random(seed)
+
+    def cells(scale):
+        return [[None if rnd.random() < 0.01 else round(rnd.uniform(0, scale), 2) for _ in range(n)]
+                for _ in range(n)]
+    return {
+        'durations': cells(7200),
+        'distances': cells(150000),
+        'sources': [{'location': [-122.4, 37.7]} for _ in range(n)],
+        'destinations': [{'location': [-122.4, 37.7]} for _ in range(n)],
+        'metadata': {'service': 'matrix'},
+    }
+
+
+def encode_json(answer):
+    return rs._json_encode({'data': [[0, answer]]})
+
+
+def encode_binary(answer):
+    return rs._json_encode({'data': [[0, rs._pack_matrix(answer)]]})
+
+
+def decode_json(raw):
+    answer = rs._json_decode(raw)['data'][0][1]
+    return rs._matrix_array(answer['durations']), rs._matrix_array(answer['distances'])
+
+
+def decode_binary(raw):
+    answer = rs._json_decode(raw)['data'][0][1]
+    shape = answer['shape']
+    return tuple(np.frombuffer(base64.b64decode(answer[k]), '<u4').reshape(shape)
+                 for k in ('durations', 'distances'))
+
+
+def timed(fn, arg, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(arg)
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 200, 500])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print('| locations | format | bytes | encode p50 ms | decode p50 ms |')
+    print('|---|---|---|---|---|')
+    for n in args.sizes:
+        answer = ors_answer(n, seed=n)
+        raw_json, raw_binary = encode_json(answer), encode_binary(answer)
+        durations, _ = decode_binary(raw_binary)
+        expected = np.rint(np.nan_to_num(rs._matrix_array(answer['durations']), nan=0.0))
+        missing = durations == rs.MATRIX_BINARY_MISSING
+        assert np.array_equal(missing, np.isnan(rs._matrix_array(answer['durations'])))
+        assert np.array_equal(durations[~missing], expected[~missing])
+        for name, encode, decode, raw in (('json', encode_json, decode_json, raw_json),
+                                          ('binary', encode_binary, decode_binary, raw_binary)):
+            enc = timed(encode, answer, args.repeat)
+            dec = timed(decode, raw, args.repeat)
+            print(f'| {n} | {name} | {len(raw):,} | {enc:.2f} | {dec:.2f} |')
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('ORS_PORT', '8082')
+    main()